@@ -0,0 +1,109 @@
+# accounts.py — несколько торговых аккаунтов (субаккаунтов Bybit) на один конвейер сигналов
+#
+# Скан и маркет-данные — одни на процесс; исполнение расходится по аккаунтам. У каждого свой
+# BybitAPI (ключи, пул HTTP-соединений, приватный WS), режим позиций, размер позиции, плечо,
+# лимит слотов и кулдауны (entries/cooldowns в StateStore — по имени аккаунта).
+#
+#   ACCOUNTS=main,sub1
+#   ACCOUNT_SUB1_API_KEY=... ACCOUNT_SUB1_API_SECRET=...
+#   ACCOUNT_SUB1_POSITION_USD=50 ACCOUNT_SUB1_LEVERAGE=5 ACCOUNT_SUB1_MAX_OPEN_POSITIONS=2
+#   ACCOUNT_SUB1_POSITION_MODE=hedge ACCOUNT_SUB1_BASE=https://api.bybit.com
+#
+# Незаданные параметры берутся из общих BYBIT_*/POSITION_USD/LEVERAGE/MAX_OPEN_POSITIONS.
+# Аккаунт main без своих ACCOUNT_MAIN_* — это прежний единственный аккаунт.
+import os
+from dataclasses import dataclass
+from typing import List
+
+from bybit_api import BybitAPI
+from settings import Settings
+from state_store import DEFAULT_ACCOUNT
+
+
+@dataclass
+class Account:
+    name: str
+    bybit: BybitAPI
+    pos_mode: str = "ONE_WAY"
+    position_usd: float = 0.0
+    leverage: int = 1
+    max_open_positions: int = 1
+    position_mode_cfg: str = "auto"   # auto | oneway | hedge — что выставить при старте
+
+    @classmethod
+    def default(cls, bybit: BybitAPI, pos_mode: str) -> "Account":
+        """Единственный аккаунт из общих настроек."""
+        return cls(name=DEFAULT_ACCOUNT, bybit=bybit, pos_mode=pos_mode,
+                   position_usd=Settings.POSITION_USD, leverage=Settings.LEVERAGE,
+                   max_open_positions=Settings.MAX_OPEN_POSITIONS,
+                   position_mode_cfg=getattr(Settings, "BYBIT_POSITION_MODE", "auto").lower())
+
+
+def _env(name: str, key: str, default):
+    raw = os.getenv(f"ACCOUNT_{name.upper()}_{key}")
+    if raw is None or raw == "":
+        return default
+    return type(default)(raw) if default is not None else raw
+
+
+def load_accounts() -> List[Account]:
+    names = [n.strip() for n in (Settings.ACCOUNTS or "").split(",") if n.strip()] or [DEFAULT_ACCOUNT]
+    out: List[Account] = []
+    for name in names:
+        bybit = BybitAPI(
+            api_key=_env(name, "API_KEY", Settings.BYBIT_API_KEY),
+            api_secret=_env(name, "API_SECRET", Settings.BYBIT_API_SECRET),
+            base_url=_env(name, "BASE", Settings.BYBIT_BASE),
+        )
+        out.append(Account(
+            name=name,
+            bybit=bybit,
+            position_usd=_env(name, "POSITION_USD", Settings.POSITION_USD),
+            leverage=_env(name, "LEVERAGE", Settings.LEVERAGE),
+            max_open_positions=_env(name, "MAX_OPEN_POSITIONS", Settings.MAX_OPEN_POSITIONS),
+            position_mode_cfg=_env(name, "POSITION_MODE", getattr(Settings, "BYBIT_POSITION_MODE", "auto")).lower(),
+        ))
+    return out
+
+
+def setup_account(acc: Account, logger, on_position_closed=None, reference: "Account" = None) -> None:
+    """
+    Старт аккаунта: сдвиг часов, справочник инструментов (общий с reference при том же base —
+    публичные данные не качаются по разу на аккаунт), приватный WS, режим позиций.
+    """
+    bybit = acc.bybit
+    try:
+        offset = bybit.sync_time()
+        logger.info("[%s] Сдвиг часов Bybit: %+.0f мс", acc.name, offset)
+    except Exception as e:
+        logger.warning("[%s] Не удалось синхронизировать время с Bybit: %s", acc.name, e)
+
+    if reference is not None and reference.bybit.base == bybit.base:
+        bybit.share_reference_data(reference.bybit)
+    else:
+        try:
+            bybit.get_instruments()
+        except Exception as e:
+            logger.warning("[%s] Не удалось прогреть инструменты Bybit: %s", acc.name, e)
+
+    if Settings.BYBIT_WS_ENABLED:
+        try:
+            state = bybit.start_private_stream(_env(acc.name, "WS_PRIVATE", Settings.BYBIT_WS_PRIVATE), logger=logger)
+            if on_position_closed is not None:
+                state.on_position_closed = lambda pos: on_position_closed(acc, pos)
+        except Exception as e:
+            logger.warning("[%s] Приватный WS Bybit не запущен: %s (работаем через REST)", acc.name, e)
+
+    acc.pos_mode = bybit.get_position_mode()
+    cfg = acc.position_mode_cfg
+    try:
+        if cfg in ("oneway", "one-way", "one_way", "single"):
+            bybit.set_position_mode("ONE_WAY")
+            acc.pos_mode = "ONE_WAY"
+        elif cfg in ("hedge", "both", "both_sides"):
+            bybit.set_position_mode("HEDGE")
+            acc.pos_mode = "HEDGE"
+    except Exception as e:
+        logger.warning("[%s] Не удалось переключить режим позиций: %s (используем %s)", acc.name, e, acc.pos_mode)
+    logger.info("[%s] Режим позиций Bybit: %s | $%s x%d | слотов %d",
+                acc.name, acc.pos_mode, acc.position_usd, acc.leverage, acc.max_open_positions)
@@ -0,0 +1,362 @@
+# arrow_io.py — выгрузка/загрузка свечей, индикаторов и истории сигналов в Arrow/Parquet
+#
+# Для ноутбуков и бэктестов вместо разбора текстовых отчётов и iterations.jsonl:
+#   .arrow — Arrow IPC file без сжатия: открывается через memory map, колонки читаются
+#            без копирования (Bars поверх буферов файла), миллионы строк — за миллисекунды;
+#   .parquet — сжатый колоночный формат для pandas/polars/duckdb и обмена.
+# Формат выбирается по расширению. Каждая серия (символ, ТФ) — отдельный record batch /
+# row group, поэтому свечи одной серии читаются срезом без фильтрации всей таблицы.
+#
+#   python arrow_io.py export candles out/candles_1h.arrow --tf 1h
+#   python arrow_io.py export indicators out/ind_1h.parquet --tf 1h --symbols BTC/USDT:USDT
+#   python arrow_io.py export signals out/signals.parquet --tf 1h,4h
+#   python arrow_io.py import candles out/candles_1h.arrow        # в базу свечей backfill.py
+#
+# pyarrow — опциональная зависимость (pip install pyarrow); без неё бот работает как раньше.
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backfill import CandleDB
+from indicators import atr, ema, macd, rsi
+from ohlcv_buffer import PRICE_COLUMNS, Bars
+from settings import Settings
+from signal_history import CHECK_BITS, SignalHistory
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - опциональная зависимость
+    pa = None
+    pq = None
+
+
+def _require() -> None:
+    if pa is None:
+        raise RuntimeError("pyarrow не установлен: pip install pyarrow")
+
+
+def _is_parquet(path: Path) -> bool:
+    return Path(path).suffix.lower() in (".parquet", ".pq")
+
+
+def candle_schema():
+    return pa.schema([
+        ("symbol", pa.string()),
+        ("tf", pa.string()),
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        *((c, pa.float64()) for c in PRICE_COLUMNS),
+    ])
+
+
+def indicator_schema():
+    return pa.schema([
+        ("symbol", pa.string()),
+        ("tf", pa.string()),
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("close", pa.float64()),
+        ("ema_fast", pa.float64()),
+        ("ema_slow", pa.float64()),
+        ("rsi", pa.float64()),
+        ("macd", pa.float64()),
+        ("macd_signal", pa.float64()),
+        ("macd_hist", pa.float64()),
+        ("atr", pa.float64()),
+    ])
+
+
+def signal_schema():
+    return pa.schema([
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("symbol", pa.string()),
+        ("tf", pa.string()),
+        ("direction", pa.string()),
+        ("rsi", pa.float32()),
+        ("patterns", pa.list_(pa.string())),
+        *((name, pa.bool_()) for name in CHECK_BITS),   # null — индикатор был выключен
+    ])
+
+
+class _Sink:
+    """Запись таблицы по частям: IPC file (record batch на серию) или Parquet (row group на серию)."""
+
+    def __init__(self, path: Path, schema):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.schema = schema
+        self.rows = 0
+        if _is_parquet(self.path):
+            self._writer = pq.ParquetWriter(str(self.path), schema, compression="zstd")
+        else:
+            self._file = pa.OSFile(str(self.path), "wb")
+            self._writer = pa.ipc.new_file(self._file, schema)
+
+    def write(self, columns: Dict[str, object]) -> None:
+        batch = pa.record_batch([columns[f.name] for f in self.schema], schema=self.schema)
+        if not batch.num_rows:
+            return
+        if _is_parquet(self.path):
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self) -> int:
+        self._writer.close()
+        if not _is_parquet(self.path):
+            self._file.close()
+        return self.rows
+
+
+def _series(db: CandleDB, symbols: Optional[List[str]], tfs: Optional[List[str]]) -> List[Tuple[str, str]]:
+    return [(s, tf) for s, tf, _ in db.series()
+            if (not symbols or s in symbols) and (not tfs or tf in tfs)]
+
+
+def _ts(bars: Bars):
+    return pa.array(bars.ts, type=pa.timestamp("ms", tz="UTC"))
+
+
+# =========================
+# Выгрузка
+# =========================
+def export_candles(db: CandleDB, path: Path, symbols: Optional[List[str]] = None,
+                   tfs: Optional[List[str]] = None, since: Optional[int] = None,
+                   until: Optional[int] = None) -> int:
+    """Свечи из базы backfill.py; возвращает число строк."""
+    _require()
+    sink = _Sink(path, candle_schema())
+    try:
+        for sym, tf in _series(db, symbols, tfs):
+            b = db.bars(sym, tf, since, until)
+            n = len(b)
+            sink.write({"symbol": pa.array([sym] * n, pa.string()), "tf": pa.array([tf] * n, pa.string()),
+                        "ts": _ts(b), **{c: pa.array(b[c]) for c in PRICE_COLUMNS}})
+    finally:
+        rows = sink.close()
+    return rows
+
+
+def indicator_frame(bars: Bars) -> Dict[str, np.ndarray]:
+    """Индикаторы бота по всей серии — с теми же параметрами, что в скане и входах."""
+    close = np.asarray(bars.close, dtype=float)
+    line, signal_line, hist = macd(close, Settings.MACD_FAST, Settings.MACD_SLOW, Settings.MACD_SIGNAL)
+    return {
+        "close": close,
+        "ema_fast": ema(close, Settings.EMA_FAST),
+        "ema_slow": ema(close, Settings.EMA_SLOW),
+        "rsi": rsi(close, Settings.RSI_LEN),
+        "macd": line,
+        "macd_signal": signal_line,
+        "macd_hist": hist,
+        "atr": np.asarray(atr(bars, Settings.ATR_LEN), dtype=float),
+    }
+
+
+def export_indicators(db: CandleDB, path: Path, symbols: Optional[List[str]] = None,
+                      tfs: Optional[List[str]] = None, since: Optional[int] = None,
+                      until: Optional[int] = None) -> int:
+    """
+    Индикаторы по свечам базы. Прогрев считается по всей истории серии, в файл попадают
+    только бары [since, until).
+    """
+    _require()
+    sink = _Sink(path, indicator_schema())
+    try:
+        for sym, tf in _series(db, symbols, tfs):
+            b = db.bars(sym, tf, None, until)
+            lo = int(np.searchsorted(b.ts, since)) if since is not None else 0
+            n = len(b) - lo
+            if n <= 0:
+                continue
+            cols = {k: pa.array(v[lo:]) for k, v in indicator_frame(b).items()}
+            sink.write({"symbol": pa.array([sym] * n, pa.string()), "tf": pa.array([tf] * n, pa.string()),
+                        "ts": _ts(b.tail(n)), **cols})
+    finally:
+        rows = sink.close()
+    return rows
+
+
+def export_signals(data_dir: Path, path: Path, tfs: List[str], since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> int:
+    """История сигналов (signal_history.py) по ТФ: одна строка на сигнал."""
+    _require()
+    sink = _Sink(path, signal_schema())
+    try:
+        for tf in tfs:
+            h = SignalHistory(Path(data_dir) / "history", tf)
+            rec = h.query(since, until)
+            if not len(rec):
+                continue
+            syms = np.array(h.meta["symbols"], dtype=object)
+            pats = h.meta["patterns"]
+            bits = rec["patterns"]
+            cols = {
+                "ts": pa.array(rec["ts"], type=pa.timestamp("ms", tz="UTC")),
+                "symbol": pa.array(syms[rec["symbol"]], pa.string()),
+                "tf": pa.array([tf] * len(rec), pa.string()),
+                "direction": pa.array(np.where(rec["direction"] > 0, "BULL", "BEAR"), pa.string()),
+                "rsi": pa.array(rec["rsi"]),
+                "patterns": pa.array([[p for i, p in enumerate(pats) if int(b) >> i & 1] for b in bits],
+                                     pa.list_(pa.string())),
+            }
+            for name, bit in CHECK_BITS.items():
+                on = (rec["checks_on"] & bit) != 0
+                cols[name] = pa.array((rec["checks"] & bit) != 0, mask=~on)
+            sink.write(cols)
+    finally:
+        rows = sink.close()
+    return rows
+
+
+# =========================
+# Загрузка
+# =========================
+def load_table(path: Path):
+    """
+    Таблица целиком: .arrow — через memory map без копирования (данные остаются в page cache
+    и подгружаются по мере обращения), .parquet — чтение с memory map и распаковкой.
+    """
+    _require()
+    if _is_parquet(path):
+        return pq.read_table(str(path), memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+class ArrowCandles:
+    """
+    Свечи из .arrow-файла export_candles: bars(symbol, tf) — Bars поверх буферов
+    memory-mapped файла (колонки без null, один batch на серию — numpy без копии).
+    """
+
+    def __init__(self, path: Path):
+        _require()
+        if _is_parquet(path):
+            raise ValueError("zero-copy чтение — только из .arrow (Arrow IPC file)")
+        self.path = Path(path)
+        self._reader = pa.ipc.open_file(pa.memory_map(str(self.path), "r"))
+        self._index: Dict[Tuple[str, str], int] = {}
+        for i in range(self._reader.num_record_batches):
+            batch = self._reader.get_batch(i)
+            if batch.num_rows:
+                self._index[(batch.column(0)[0].as_py(), batch.column(1)[0].as_py())] = i
+
+    def series(self) -> List[Tuple[str, str]]:
+        return list(self._index)
+
+    def bars(self, symbol: str, tf: str) -> Optional[Bars]:
+        i = self._index.get((symbol, tf))
+        if i is None:
+            return None
+        batch = self._reader.get_batch(i)
+        ts = batch.column("ts").view(pa.int64()).to_numpy(zero_copy_only=True)
+        return Bars(ts, *(batch.column(c).to_numpy(zero_copy_only=True) for c in PRICE_COLUMNS))
+
+    def __iter__(self) -> Iterator[Tuple[str, str, Bars]]:
+        for symbol, tf in self._index:
+            yield symbol, tf, self.bars(symbol, tf)
+
+
+def import_candles(path: Path, db: CandleDB) -> int:
+    """Свечи из .arrow/.parquet в базу свечей (без запросов к бирже); возвращает число строк."""
+    _require()
+    t = load_table(path)
+    n = 0
+    for batch in t.to_batches():
+        if not batch.num_rows:
+            continue
+        sym = batch.column("symbol").to_numpy(zero_copy_only=False)
+        tf = batch.column("tf").to_numpy(zero_copy_only=False)
+        data = np.column_stack([batch.column("ts").view(pa.int64()).to_numpy(zero_copy_only=False)]
+                               + [batch.column(c).to_numpy(zero_copy_only=False) for c in PRICE_COLUMNS])
+        # границы серий внутри batch (у export_candles batch — ровно одна серия)
+        cut = np.flatnonzero((sym[1:] != sym[:-1]) | (tf[1:] != tf[:-1])) + 1
+        for lo, hi in zip(np.r_[0, cut], np.r_[cut, batch.num_rows]):
+            n += db.insert(sym[lo], tf[lo], data[lo:hi].tolist())
+    return n
+
+
+def import_signals(path: Path, data_dir: Path) -> int:
+    """
+    Сигналы из файла export_signals — дописываются в историю сигналов по ТФ. История только
+    дописывается и ищется бинарным поиском по ts, поэтому строки не новее последней записи ТФ
+    пропускаются (повторный импорт ничего не дублирует), повторы внутри файла — тоже.
+    """
+    _require()
+    rows = load_table(path).sort_by([("tf", "ascending"), ("ts", "ascending")]).to_pylist()
+    n = 0
+    i = 0
+    hist: Optional[SignalHistory] = None
+    last_ms = None
+    while i < len(rows):
+        tf, ts = rows[i]["tf"], rows[i]["ts"]
+        j = i
+        while j < len(rows) and rows[j]["tf"] == tf and rows[j]["ts"] == ts:
+            j += 1
+        if hist is None or hist.tf != tf:
+            hist = SignalHistory(Path(data_dir) / "history", tf)
+            rec = hist.records()
+            last_ms = int(rec["ts"][-1]) if len(rec) else None
+        if last_ms is None or int(ts.timestamp() * 1000) > last_ms:
+            seen = set()
+            sigs = []
+            for r in rows[i:j]:
+                if (r["symbol"], r["direction"]) in seen:
+                    continue
+                seen.add((r["symbol"], r["direction"]))
+                sigs.append({"symbol": r["symbol"], "direction": r["direction"], "rsi": r["rsi"],
+                             "patterns": r["patterns"],
+                             "checks": {name: r[name] for name in CHECK_BITS if r[name] is not None}})
+            n += hist.append(sigs, ts=ts)
+        i = j
+    return n
+
+
+def _parse_dt(s: str) -> datetime:
+    t = datetime.fromisoformat(s)
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def main():
+    from candles import parse_tfs
+
+    ap = argparse.ArgumentParser(description="Arrow/Parquet export and import of candles, indicators and signals")
+    ap.add_argument("action", choices=["export", "import"])
+    ap.add_argument("what", choices=["candles", "indicators", "signals"])
+    ap.add_argument("path", help=".arrow (memory-mapped, zero-copy) or .parquet")
+    ap.add_argument("--db", default=Settings.BACKFILL_DB or str(Path(Settings.DATA_DIR) / "candles" / "candles.db"))
+    ap.add_argument("--data-dir", default=Settings.DATA_DIR)
+    ap.add_argument("--symbols", default="")
+    ap.add_argument("--tf", default="")
+    ap.add_argument("--since", type=_parse_dt)
+    ap.add_argument("--until", type=_parse_dt)
+    args = ap.parse_args()
+
+    symbols = [s.strip() for s in args.symbols.split(",") if s.strip()] or None
+    tfs = parse_tfs(args.tf) or None
+    since = int(args.since.timestamp() * 1000) if args.since else None
+    until = int(args.until.timestamp() * 1000) if args.until else None
+    path = Path(args.path)
+
+    if args.action == "export":
+        if args.what == "signals":
+            n = export_signals(Path(args.data_dir), path, tfs or parse_tfs(Settings.SCAN_TFS), args.since, args.until)
+        else:
+            fn = export_candles if args.what == "candles" else export_indicators
+            n = fn(CandleDB(Path(args.db)), path, symbols, tfs, since, until)
+        print(f"{args.what}: {n} строк -> {path}")
+    else:
+        if args.what == "candles":
+            n = import_candles(path, CandleDB(Path(args.db)))
+        elif args.what == "signals":
+            n = import_signals(path, Path(args.data_dir))
+        else:
+            raise SystemExit("индикаторы производные — загружайте их через load_table()")
+        print(f"{args.what}: {n} строк <- {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# backfill.py — докачка истории свечей в локальное хранилище (SQLite) для бэктестов и исследований
+#
+# fetch_ohlcv отдаёт не больше 1000 баров за запрос, поэтому история качается постранично
+# вперёд по since. Пары (символ, ТФ) идут параллельно в BACKFILL_WORKERS потоках, запросы —
+# через общий RateGate (или через кэш-демон свечей, если задан CANDLE_CACHE_SOCKET:
+# тогда темп общий со всеми ботами хоста). Каждая страница пишется сразу, поэтому прерванная
+# докачка продолжается с места остановки: качаются только дыры между тем, что уже лежит
+# в базе, и запрошенным диапазоном. Интервалы, где биржа честно не отдала баров (до листинга,
+# остановки торгов), запоминаются в candle_holes и повторно не запрашиваются.
+#
+#   python backfill.py --tf 1h,4h --since 2023-01-01 --top 200
+#   python backfill.py --symbols BTC/USDT:USDT,ETH/USDT:USDT --tf 15m --since 2024-06-01 --workers 8
+#   python backfill.py --tf 1h --since 2023-01-01 --gaps      # только отчёт о дырах
+import argparse
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from candles import parse_tfs, tf_minutes
+from execution import RateGate
+from ohlcv_buffer import Bars, as_bars
+from settings import Settings
+
+PAGE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    symbol TEXT NOT NULL,                 -- ccxt symbol
+    tf     TEXT NOT NULL,
+    ts     INTEGER NOT NULL,              -- открытие бара, мс UTC
+    open   REAL NOT NULL,
+    high   REAL NOT NULL,
+    low    REAL NOT NULL,
+    close  REAL NOT NULL,
+    volume REAL NOT NULL,
+    PRIMARY KEY (symbol, tf, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS candle_holes (
+    symbol TEXT NOT NULL,
+    tf     TEXT NOT NULL,
+    start  INTEGER NOT NULL,              -- [start, end) биржа баров не отдаёт
+    end    INTEGER NOT NULL,
+    PRIMARY KEY (symbol, tf, start)
+);
+"""
+
+
+class CandleDB:
+    """
+    Закрытые свечи по (символ, ТФ) в одной SQLite-базе (WAL).
+    Потокобезопасна: одно соединение под замком, как StateStore.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def insert(self, symbol: str, tf: str, rows: List[list]) -> int:
+        if not rows:
+            return 0
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO candles(symbol, tf, ts, open, high, low, close, volume) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(symbol, tf, int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5] or 0.0))
+                     for r in rows])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def add_hole(self, symbol: str, tf: str, start: int, end: int) -> None:
+        if end <= start:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO candle_holes(symbol, tf, start, end) VALUES (?, ?, ?, ?)",
+                             (symbol, tf, int(start), int(end)))
+
+    def bars(self, symbol: str, tf: str, since: Optional[int] = None, until: Optional[int] = None) -> Bars:
+        """Свечи [since, until) по возрастанию ts."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ts, open, high, low, close, volume FROM candles WHERE symbol = ? AND tf = ? "
+                "AND ts >= ? AND ts < ? ORDER BY ts",
+                (symbol, tf, since if since is not None else -2 ** 62, until if until is not None else 2 ** 62),
+            ).fetchall()
+        return as_bars(rows)
+
+    def span(self, symbol: str, tf: str) -> Tuple[Optional[int], Optional[int], int]:
+        """(первый ts, последний ts, число баров)."""
+        with self._lock:
+            first, last, n = self._db.execute(
+                "SELECT MIN(ts), MAX(ts), COUNT(*) FROM candles WHERE symbol = ? AND tf = ?", (symbol, tf)).fetchone()
+        return first, last, n
+
+    def series(self) -> List[Tuple[str, str, int]]:
+        """[(символ, ТФ, баров)] всего, что лежит в базе."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT symbol, tf, COUNT(*) FROM candles GROUP BY symbol, tf ORDER BY symbol, tf").fetchall()
+
+    def gaps(self, symbol: str, tf: str, since: int, until: int) -> List[Tuple[int, int]]:
+        """
+        Недостающие интервалы [start, end) в [since, until): голова до первого бара, дыры между
+        барами и хвост после последнего — за вычетом известных пустых интервалов биржи.
+        """
+        step = tf_minutes(tf) * 60_000
+        since = -(-since // step) * step   # бары выровнены по ТФ
+        if since >= until:
+            return []
+        with self._lock:
+            ts = np.array([r[0] for r in self._db.execute(
+                "SELECT ts FROM candles WHERE symbol = ? AND tf = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (symbol, tf, since, until))], dtype=np.int64)
+            holes = self._db.execute(
+                "SELECT start, end FROM candle_holes WHERE symbol = ? AND tf = ? AND end > ? AND start < ? "
+                "ORDER BY start", (symbol, tf, since, until)).fetchall()
+        edges = np.concatenate(([since - step], ts, [until]))
+        jump = np.flatnonzero(np.diff(edges) > step)
+        out = [(int(edges[i] + step), int(edges[i + 1])) for i in jump]
+        return _subtract(out, holes)
+
+
+def _subtract(spans: List[Tuple[int, int]], holes: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for start, end in spans:
+        for h0, h1 in holes:
+            if h1 <= start or h0 >= end:
+                continue
+            if h0 > start:
+                out.append((start, h0))
+            start = max(start, h1)
+            if start >= end:
+                break
+        if start < end:
+            out.append((start, end))
+    return out
+
+
+# =========================
+# Докачка
+# =========================
+def _fill_gap(exchange, db: CandleDB, gate: Optional[RateGate], symbol: str, tf: str,
+              start: int, end: int) -> Tuple[int, int]:
+    """Постраничная докачка [start, end); возвращает (баров записано, запросов)."""
+    step = tf_minutes(tf) * 60_000
+    cursor, stored, calls = start, 0, 0
+    while cursor < end:
+        if gate is not None:
+            gate.wait()
+        page = exchange.fetch_ohlcv(symbol, timeframe=tf, since=cursor, limit=PAGE)
+        calls += 1
+        rows = [r for r in page or [] if cursor <= r[0] < end]
+        if not rows:
+            # до конца интервала биржа баров не отдаёт — запоминаем, чтобы не спрашивать снова
+            # (кроме самых свежих баров: их биржа могла ещё не выложить)
+            if end <= last_closed(tf) - step:
+                db.add_hole(symbol, tf, cursor, end)
+            break
+        ts = np.array([cursor - step] + [r[0] for r in rows], dtype=np.int64)
+        for i in np.flatnonzero(np.diff(ts) > step):
+            # пропуски внутри страницы (и перед ней) — тоже честные дыры биржи
+            db.add_hole(symbol, tf, int(ts[i] + step), int(ts[i + 1]))
+        stored += db.insert(symbol, tf, rows)
+        cursor = int(rows[-1][0]) + step
+    return stored, calls
+
+
+def backfill_series(exchange, db: CandleDB, symbol: str, tf: str, since: int, until: int,
+                    gate: Optional[RateGate] = None) -> Dict:
+    """Дыры одной пары (символ, ТФ) в [since, until) — по порядку, страница за страницей."""
+    gaps = db.gaps(symbol, tf, since, until)
+    stored = calls = 0
+    for start, end in gaps:
+        s, c = _fill_gap(exchange, db, gate, symbol, tf, start, end)
+        stored += s
+        calls += c
+    return {"symbol": symbol, "tf": tf, "gaps": len(gaps), "stored": stored, "calls": calls}
+
+
+def last_closed(tf: str, now_ms: Optional[int] = None) -> int:
+    """Граница until, исключающая формирующийся бар."""
+    step = tf_minutes(tf) * 60_000
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return now_ms // step * step
+
+
+def backfill(exchange, db: CandleDB, symbols: List[str], tfs: List[str], since: int,
+             until: Optional[int] = None, workers: int = 4, gate: Optional[RateGate] = None,
+             logger=None) -> List[Dict]:
+    """Все пары symbols x tfs параллельно (не больше workers одновременно)."""
+    jobs = [(sym, tf) for sym in symbols for tf in tfs]
+    done: List[Dict] = []
+    lock = threading.Lock()
+
+    def one(job):
+        sym, tf = job
+        end = min(until, last_closed(tf)) if until is not None else last_closed(tf)
+        try:
+            res = backfill_series(exchange, db, sym, tf, since, end, gate=gate)
+        except Exception as e:
+            res = {"symbol": sym, "tf": tf, "error": f"{type(e).__name__}: {e}"}
+        with lock:
+            done.append(res)
+            n = len(done)
+        if logger is not None:
+            if "error" in res:
+                logger.warning("[%d/%d] %s %s: ошибка %s (продолжится при следующем запуске)",
+                               n, len(jobs), sym, tf, res["error"])
+            elif res["gaps"]:
+                logger.info("[%d/%d] %s %s: дыр %d, записано %d баров за %d запросов",
+                            n, len(jobs), sym, tf, res["gaps"], res["stored"], res["calls"])
+        return res
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backfill") as pool:
+        list(pool.map(one, jobs))
+    return done
+
+
+def _parse_date(raw: str) -> int:
+    t = datetime.fromisoformat(raw)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() * 1000)
+
+
+def main():
+    from bybit_data import build_exchange
+    from universe import get_universe_engine
+    from utils import setup_logger
+
+    ap = argparse.ArgumentParser(description="Resumable historical OHLCV backfill into a local SQLite store")
+    ap.add_argument("--db", default=Settings.BACKFILL_DB or str(Path(Settings.DATA_DIR) / "candles" / "candles.db"))
+    ap.add_argument("--symbols", default="", help="ccxt symbols, comma separated (default: --top by volatility)")
+    ap.add_argument("--top", type=int, default=Settings.TOP_N_BY_VOL, help="universe size when --symbols is empty")
+    ap.add_argument("--tf", default=Settings.SCAN_TFS)
+    ap.add_argument("--since", required=True, help="ISO date, e.g. 2023-01-01")
+    ap.add_argument("--until", default="", help="ISO date (default: last closed bar)")
+    ap.add_argument("--workers", type=int, default=Settings.BACKFILL_WORKERS)
+    ap.add_argument("--gaps", action="store_true", help="only report missing ranges")
+    args = ap.parse_args()
+
+    logger = setup_logger("backfill")
+    exchange = build_exchange()
+    db = CandleDB(Path(args.db))
+    tfs = parse_tfs(args.tf)
+    since = _parse_date(args.since)
+    until = _parse_date(args.until) if args.until else None
+    symbols = [s.strip() for s in args.symbols.split(",") if s.strip()] or \
+        [r["symbol"] for r in get_universe_engine().top(exchange, limit=args.top)]
+
+    if args.gaps:
+        for sym in symbols:
+            for tf in tfs:
+                end = min(until, last_closed(tf)) if until is not None else last_closed(tf)
+                gaps = db.gaps(sym, tf, since, end)
+                bars = sum((b - a) // (tf_minutes(tf) * 60_000) for a, b in gaps)
+                if gaps:
+                    logger.info("%s %s: дыр %d, не хватает ~%d баров", sym, tf, len(gaps), bars)
+        return
+
+    gate = None
+    if getattr(exchange, "enableRateLimit", False):
+        gate = RateGate(float(getattr(exchange, "rateLimit", 0) or 0) / 1000.0)
+    logger.info("Докачка %d символов x %s с %s в %s (%d потоков)",
+                len(symbols), ",".join(tfs), args.since, args.db, args.workers)
+    t0 = time.monotonic()
+    res = backfill(exchange, db, symbols, tfs, since, until, workers=args.workers, gate=gate, logger=logger)
+    errors = [r for r in res if "error" in r]
+    logger.info("Готово за %.0f с: записано %d баров за %d запросов, ошибок %d",
+                time.monotonic() - t0, sum(r.get("stored", 0) for r in res), sum(r.get("calls", 0) for r in res),
+                len(errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,24 @@
 # bybit_api.py
 import time
-import hmac
-import hashlib
-import json
+import uuid
 from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP, getcontext
 from typing import Dict, Any, Optional, List, Tuple
 
-import requests
-
 from settings import Settings
+from bybit_http import BybitTransport, DUPLICATE_LINK_ID_CODE
+from bybit_ws import AccountState, PrivateStream
 
 # Повышаем точность Decimal, чтобы не ловить артефакты на шагах 1e-8
 getcontext().prec = 28
 
+# Максимум ордеров в одном запросе /v5/order/create-batch для linear
+BATCH_ORDER_LIMIT = 10
+
+
+def new_order_link_id() -> str:
+    # до 36 символов по спецификации v5
+    return f"vtb-{uuid.uuid4().hex[:28]}"
+
 
 class BybitAPI:
     """
@@ -24,65 +30,109 @@ class BybitAPI:
         self.api_key = api_key or getattr(Settings, "BYBIT_API_KEY", "")
         self.api_secret = api_secret or getattr(Settings, "BYBIT_API_SECRET", "")
         self.base = (base_url or getattr(Settings, "BYBIT_BASE", "https://api-demo.bybit.com")).rstrip("/")
-        self.session = requests.Session()
+        self.http = BybitTransport(
+            self.base,
+            api_key=self.api_key,
+            api_secret=self.api_secret,
+            pool_size=getattr(Settings, "BYBIT_POOL_SIZE", 10),
+            connect_timeout=getattr(Settings, "BYBIT_CONNECT_TIMEOUT", 3.05),
+            read_timeout=getattr(Settings, "BYBIT_READ_TIMEOUT", 10.0),
+            max_retries=getattr(Settings, "BYBIT_MAX_RETRIES", 4),
+            recv_window=getattr(Settings, "BYBIT_RECV_WINDOW", 5000),
+        )
+        self.session = self.http.session
         self._instruments_cache: Dict[str, Dict[str, Any]] = {}
+        # символы, которых не оказалось в справочнике: monotonic-время промаха (не перезапрашиваем весь список)
+        self._instrument_misses: Dict[str, float] = {}
+        # monotonic-время последней полной загрузки справочника (общее у клиентов с общим справочником)
+        self._instruments_loaded: Dict[str, float] = {"at": 0.0}
+        # Выученные по символу positionIdx и плечо — чтобы не повторять лишние вызовы
+        self._position_idx_cache: Dict[str, int] = {}
+        self._leverage_cache: Dict[str, int] = {}
+        # Живое состояние из приватного WS (если включён) — см. start_private_stream
+        self.account_state: Optional[AccountState] = None
+        self._stream: Optional[PrivateStream] = None
 
     # -------- подпись / заголовки --------
     def _ts(self) -> str:
-        return str(int(time.time() * 1000))
+        # локальное время с поправкой на сдвиг часов сервера
+        return str(self.http.clock.now_ms())
 
-    def _sign(self, payload: str) -> str:
-        return hmac.new(self.api_secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    def sync_time(self) -> float:
+        """Синхронизирует сдвиг часов с сервером; возвращает offset в мс."""
+        return self.http.sync_time()
 
-    def _headers(self, sign: str, timestamp: str) -> Dict[str, str]:
-        return {
-            "X-BAPI-SIGN": sign,
-            "X-BAPI-API-KEY": self.api_key,
-            "X-BAPI-TIMESTAMP": timestamp,
-            "X-BAPI-RECV-WINDOW": "5000",
-            "Content-Type": "application/json",
-        }
+    def _auth_post_raw(self, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Подписанный POST; возвращает ответ целиком (result + retExtInfo) — нужен для batch-эндпоинтов.
+        """
+        return self.http.request("POST", path, body=body, auth=True)
 
     def _auth_post(self, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        url = f"{self.base}{path}"
-        body_str = json.dumps(body or {})
-        ts = self._ts()
-        recv = "5000"
-        payload = f"{ts}{self.api_key}{recv}{body_str}"
-        sign = self._sign(payload)
-        headers = self._headers(sign, ts)
-
-        r = self.session.post(url, headers=headers, data=body_str, timeout=30)
-        if not r.ok:
-            raise RuntimeError(f"Bybit HTTP {r.status_code} {r.reason}: {r.text}")
-
-        data = r.json()
-        if str(data.get("retCode")) != "0":
-            raise RuntimeError(f"Bybit error {data.get('retCode')}: {data.get('retMsg')} | {data}")
+        data = self._auth_post_raw(path, body)
+        return data.get("result", data)
+
+    def _auth_get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Подписанный GET (подписывается query string) — для приватных эндпоинтов чтения."""
+        data = self.http.request("GET", path, params=params, auth=True)
         return data.get("result", data)
 
     def public_get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        url = f"{self.base}{path}"
-        r = self.session.get(url, params=params, timeout=30)
-        if not r.ok:
-            raise RuntimeError(f"Bybit HTTP {r.status_code} {r.reason}: {r.text}")
-        data = r.json()
-        if str(data.get("retCode")) != "0":
-            raise RuntimeError(f"Bybit error {data.get('retCode')}: {data.get('retMsg')} | {data}")
+        data = self.http.request("GET", path, params=params)
         return data.get("result", data)
 
     # -------- справочники / фильтры --------
     def get_instruments(self, category: str = "linear") -> List[Dict[str, Any]]:
-        res = self.public_get("/v5/market/instruments-info", {"category": category})
-        for item in res.get("list", []):
+        # linear-контрактов больше одной страницы — идём по курсору
+        out: List[Dict[str, Any]] = []
+        params: Dict[str, Any] = {"category": category, "limit": 1000}
+        while True:
+            res = self.public_get("/v5/market/instruments-info", params)
+            out.extend(res.get("list", []))
+            cursor = res.get("nextPageCursor")
+            if not cursor or not res.get("list"):
+                break
+            params = dict(params, cursor=cursor)
+        for item in out:
             self._instruments_cache[item["symbol"]] = item
-        return res.get("list", [])
+            self._instrument_misses.pop(item["symbol"], None)
+        if category == "linear" and out:
+            # снятые с листинга пропали из ответа — статус у них неизвестен, а не прежний Trading
+            listed = {item["symbol"] for item in out}
+            for sym in [s for s in self._instruments_cache if s not in listed]:
+                del self._instruments_cache[sym]
+            self._instruments_loaded["at"] = time.monotonic()
+        return out
+
+    def refresh_instruments(self, max_age: float) -> bool:
+        """Перезагружает справочник, если он старше max_age сек; True — перезагружен."""
+        if time.monotonic() - self._instruments_loaded["at"] < max_age:
+            return False
+        self.get_instruments()
+        return True
+
+    def share_reference_data(self, other: "BybitAPI") -> None:
+        """Общий справочник инструментов с другим клиентом (аккаунты на одном base URL)."""
+        self._instruments_cache = other._instruments_cache
+        self._instrument_misses = other._instrument_misses
+        self._instruments_loaded = other._instruments_loaded
+
+    def instrument_status(self, symbol: str) -> Optional[str]:
+        """Статус из справочника ('Trading', 'Closed', 'Settling', ...); None — символ неизвестен."""
+        info = self._instruments_cache.get(symbol)
+        return info.get("status") if info else None
 
     def _get_symbol_filters(self, symbol: str) -> Dict[str, Any]:
         info = self._instruments_cache.get(symbol)
         if not info:
+            missed = self._instrument_misses.get(symbol)
+            if missed is not None and time.monotonic() - missed < Settings.INSTRUMENT_MISS_TTL:
+                raise RuntimeError(f"Instrument {symbol} not listed")
             self.get_instruments()
-            info = self._instruments_cache.get(symbol, {})
+            info = self._instruments_cache.get(symbol)
+            if not info:
+                self._instrument_misses[symbol] = time.monotonic()
+                raise RuntimeError(f"Instrument {symbol} not listed")
         pf = info.get("priceFilter", {}) or {}
         lf = info.get("lotSizeFilter", {}) or {}
         # Некоторые контракты имеют минимальную стоимость ордера (order value)
@@ -165,7 +215,7 @@ class BybitAPI:
             return "HEDGE"
         # auto — пробуем прочитать список позиций
         try:
-            res = self._auth_post("/v5/position/list", {"category": "linear"})
+            res = self._auth_get("/v5/position/list", {"category": "linear"})
             for p in res.get("list", []):
                 pid = str(p.get("positionIdx", "0"))
                 if pid in ("1", "2"):
@@ -186,7 +236,16 @@ class BybitAPI:
         self._auth_post("/v5/position/switch-mode", body)
 
     def get_open_positions(self) -> List[Dict[str, Any]]:
-        res = self._auth_post("/v5/position/list", {"category": "linear"})
+        """
+        Открытые позиции: из живого WS-состояния, если оно готово, иначе REST.
+        """
+        st = self.account_state
+        if st is not None and st.ready:
+            return st.open_positions()
+        return self._rest_open_positions()
+
+    def _rest_open_positions(self) -> List[Dict[str, Any]]:
+        res = self._auth_get("/v5/position/list", {"category": "linear"})
         out = []
         for p in res.get("list", []):
             if float(p.get("size") or 0) != 0:
@@ -200,23 +259,65 @@ class BybitAPI:
             "buyLeverage": str(leverage),
             "sellLeverage": str(leverage),
         }
-        return self._auth_post("/v5/position/set-leverage", body)
+        try:
+            res = self._auth_post("/v5/position/set-leverage", body)
+        except RuntimeError as e:
+            # 110043: leverage not modified — плечо уже такое, это не ошибка
+            if "110043" not in str(e):
+                raise
+            res = {}
+        self._leverage_cache[symbol] = int(leverage)
+        return res
 
-    def place_market_order(
-        self,
+    def ensure_leverage(self, symbol: str, leverage: int) -> bool:
+        """
+        Ставит плечо только если для символа оно ещё не выставлялось в этом процессе.
+        Возвращает True, если был сделан запрос к бирже.
+        """
+        if self._leverage_cache.get(symbol) == int(leverage):
+            return False
+        self.set_leverage(symbol, leverage)
+        return True
+
+    # --- выученный positionIdx по символу ---
+    def position_idx_for(self, symbol: str, side: str, mode_hint: str) -> int:
+        """
+        positionIdx для входа: сначала то, что уже сработало по символу,
+        иначе — по подсказке режима ('ONE_WAY' | 'HEDGE').
+        """
+        learned = self._position_idx_cache.get(symbol)
+        if learned is not None:
+            if learned == 0:
+                return 0
+            return 1 if side == "Buy" else 2
+        if mode_hint == "HEDGE":
+            return 1 if side == "Buy" else 2
+        return 0
+
+    def remember_position_idx(self, symbol: str, position_idx: int) -> None:
+        self._position_idx_cache[symbol] = int(position_idx)
+
+    @staticmethod
+    def build_market_order(
         symbol: str,
         side: str,
         qty_str: str,
         position_idx: int = 0,
         reduce_only: bool = False,
-    ):
+        take_profit: Optional[str] = None,
+        stop_loss: Optional[str] = None,
+        tp_trigger_by: str = "MarkPrice",
+        sl_trigger_by: str = "MarkPrice",
+        order_link_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
-        side: 'Buy' или 'Sell'
-        qty_str: строка, квантизированное количество
-        position_idx: 0 (one-way), 1 (hedge Buy), 2 (hedge Sell)
+        Тело маркет-ордера v5 (без category) — общее для одиночного и batch-запроса.
+        take_profit / stop_loss: если заданы — TP/SL уходят вместе с ордером
+        (tpslMode=Full), позиция не остаётся без стопа ни на один запрос.
+        orderLinkId генерируется всегда: с ним повтор запроса после таймаута безопасен.
         """
         body = {
-            "category": "linear",
+            "orderLinkId": order_link_id or new_order_link_id(),
             "symbol": symbol,
             "side": side,
             "orderType": "Market",
@@ -225,8 +326,72 @@ class BybitAPI:
             "reduceOnly": reduce_only,
             "positionIdx": position_idx,
         }
+        if take_profit is not None or stop_loss is not None:
+            body["tpslMode"] = "Full"
+        if take_profit is not None:
+            body["takeProfit"] = str(take_profit)
+            body["tpTriggerBy"] = tp_trigger_by
+        if stop_loss is not None:
+            body["stopLoss"] = str(stop_loss)
+            body["slTriggerBy"] = sl_trigger_by
+        return body
+
+    def place_market_order(
+        self,
+        symbol: str,
+        side: str,
+        qty_str: str,
+        position_idx: int = 0,
+        reduce_only: bool = False,
+        take_profit: Optional[str] = None,
+        stop_loss: Optional[str] = None,
+        tp_trigger_by: str = "MarkPrice",
+        sl_trigger_by: str = "MarkPrice",
+        order_link_id: Optional[str] = None,
+    ):
+        """
+        side: 'Buy' или 'Sell'
+        qty_str: строка, квантизированное количество
+        position_idx: 0 (one-way), 1 (hedge Buy), 2 (hedge Sell)
+        """
+        body = {"category": "linear"}
+        body.update(self.build_market_order(symbol, side, qty_str, position_idx, reduce_only,
+                                            take_profit, stop_loss, tp_trigger_by, sl_trigger_by,
+                                            order_link_id))
         return self._auth_post("/v5/order/create", body)
 
+    def place_batch_orders(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Пачка ордеров через /v5/order/create-batch (linear), по BATCH_ORDER_LIMIT за запрос.
+        orders — тела из build_market_order.
+        Возвращает список того же порядка: {"ok", "code", "msg", "orderId", "orderLinkId"}.
+        Ошибка всего запроса (HTTP/retCode) помечает все элементы его пачки как неуспешные.
+        """
+        out: List[Dict[str, Any]] = []
+        for i in range(0, len(orders), BATCH_ORDER_LIMIT):
+            chunk = orders[i:i + BATCH_ORDER_LIMIT]
+            try:
+                data = self._auth_post_raw("/v5/order/create-batch", {"category": "linear", "request": chunk})
+            except RuntimeError as e:
+                out.extend({"ok": False, "code": None, "msg": str(e), "orderId": "", "orderLinkId": ""}
+                           for _ in chunk)
+                continue
+            res_list = (data.get("result") or {}).get("list", []) or []
+            ext_list = (data.get("retExtInfo") or {}).get("list", []) or []
+            for j in range(len(chunk)):
+                res = res_list[j] if j < len(res_list) else {}
+                ext = ext_list[j] if j < len(ext_list) else {"code": None, "msg": "no result for item"}
+                code = ext.get("code")
+                out.append({
+                    # дубликат orderLinkId возможен только после ретрая — ордер уже принят
+                    "ok": str(code) in ("0", DUPLICATE_LINK_ID_CODE),
+                    "code": code,
+                    "msg": ext.get("msg", ""),
+                    "orderId": res.get("orderId", ""),
+                    "orderLinkId": res.get("orderLinkId", ""),
+                })
+        return out
+
     def set_tp_sl(
         self,
         symbol: str,
@@ -250,5 +415,32 @@ class BybitAPI:
         return self._auth_post("/v5/position/trading-stop", body)
 
     def get_closed_pnl(self, symbol: str, limit: int = 50):
-        body = {"category": "linear", "symbol": symbol, "limit": str(limit)}
-        return self._auth_post("/v5/position/closed-pnl", body)
+        params = {"category": "linear", "symbol": symbol, "limit": str(limit)}
+        return self._auth_get("/v5/position/closed-pnl", params)
+
+    def get_recent_closed_pnl(self, limit: int = 100):
+        """Последние закрытия по всем символам (без symbol) — один запрос на засев состояния."""
+        params = {"category": "linear", "limit": str(limit)}
+        return self._auth_get("/v5/position/closed-pnl", params)
+
+    # -------- приватный WS --------
+    def start_private_stream(self, url: str, logger=None) -> AccountState:
+        """
+        Запускает приватный WS (position/order/execution). Пока он подписан,
+        get_open_positions и учёт закрытий работают из памяти без REST.
+        """
+        state = AccountState()
+
+        def seed():
+            state.seed(self._rest_open_positions(), self.get_recent_closed_pnl().get("list", []))
+
+        self._stream = PrivateStream(url, self.api_key, self.api_secret, state, seed_fn=seed, logger=logger,
+                                     clock=self.http.clock).start()
+        self.account_state = state
+        return state
+
+    def stop_private_stream(self) -> None:
+        if self._stream is not None:
+            self._stream.stop()
+        self._stream = None
+        self.account_state = None
@@ -0,0 +1,272 @@
+# bybit_http.py — транспорт Bybit v5: пул соединений, ретраи с backoff, учёт сдвига часов
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# retCode, после которых запрос безопасно повторить
+RETRY_RET_CODES = {
+    "10000",  # server timeout
+    "10002",  # timestamp / recv_window — пересинхронизируем часы
+    "10006",  # too many visits (rate limit)
+    "10016",  # server error
+}
+RETRY_HTTP_STATUS = {403, 429, 500, 502, 503, 504}
+
+# Создание ордеров повторяем только если у каждого ордера есть orderLinkId:
+# повтор с тем же orderLinkId биржа отклонит как дубликат, а не откроет второй раз.
+ORDER_CREATE_PATHS = {"/v5/order/create", "/v5/order/create-batch"}
+
+# orderLinkId уже существует — значит, первая попытка дошла до биржи
+DUPLICATE_LINK_ID_CODE = "110072"
+
+
+def _not_sent(e: Exception) -> bool:
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class BybitHTTPError(RuntimeError):
+    """Ошибка HTTP/retCode после всех попыток. Текст совместим с прежним RuntimeError."""
+
+    def __init__(self, message: str, ret_code: Optional[str] = None, status: Optional[int] = None):
+        super().__init__(message)
+        self.ret_code = ret_code
+        self.status = status
+
+
+class ServerClock:
+    """
+    Оценка сдвига часов сервера относительно локальных: offset = server - local (мс).
+    Обновляется по /v5/market/time и по полю "time" каждого ответа (середина RTT).
+    """
+
+    def __init__(self):
+        self._offset_ms = 0.0
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    @property
+    def offset_ms(self) -> float:
+        with self._lock:
+            return self._offset_ms
+
+    def now_ms(self) -> int:
+        return int(time.time() * 1000 + self.offset_ms)
+
+    def observe(self, server_ms: float, sent_ms: float, recv_ms: float, reset: bool = False) -> None:
+        sample = float(server_ms) - (sent_ms + recv_ms) / 2.0
+        with self._lock:
+            if reset or self._samples == 0:
+                self._offset_ms = sample
+            else:
+                # сглаживаем, чтобы одиночный медленный ответ не дёргал оценку
+                self._offset_ms = 0.8 * self._offset_ms + 0.2 * sample
+            self._samples += 1
+
+
+class BybitTransport:
+    """
+    HTTP-слой для BybitAPI: keep-alive пул, раздельные connect/read таймауты,
+    экспоненциальный backoff с джиттером (с учётом X-Bapi-Limit-* заголовков),
+    безопасные ретраи и подпись запросов по серверному времени.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "",
+        api_secret: str = "",
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        max_retries: int = 4,
+        backoff_base: float = 0.25,
+        backoff_cap: float = 8.0,
+        recv_window: int = 5000,
+    ):
+        self.base = base_url.rstrip("/")
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.timeout: Tuple[float, float] = (float(connect_timeout), float(read_timeout))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = float(backoff_base)
+        self.backoff_cap = float(backoff_cap)
+        self.recv_window = str(int(recv_window))
+        self.clock = ServerClock()
+
+        self.session = requests.Session()
+        pool_size = max(1, int(pool_size))
+        self.session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.session.mount("http://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        # path -> момент (локальные мс), до которого лимит исчерпан
+        self._limit_reset: Dict[str, float] = {}
+        self._limit_lock = threading.Lock()
+
+    # -------- часы --------
+    def sync_time(self) -> float:
+        """Синхронизация с /v5/market/time. Возвращает offset (мс); ошибка ответа — BybitHTTPError."""
+        sent = time.time() * 1000
+        r = self.session.get(f"{self.base}/v5/market/time", timeout=self.timeout)
+        recv = time.time() * 1000
+        if not r.ok:
+            raise BybitHTTPError(f"Bybit time HTTP {r.status_code} {r.reason}: {r.text[:200]}", status=r.status_code)
+        try:
+            data = r.json()
+        except ValueError:
+            raise BybitHTTPError(f"Bybit time: ответ не JSON: {r.text[:200]}", status=r.status_code) from None
+        if str(data.get("retCode")) != "0":
+            raise BybitHTTPError(f"Bybit time error {data.get('retCode')}: {data.get('retMsg')}",
+                                 ret_code=str(data.get("retCode")))
+        res = data.get("result") or {}
+        if res.get("timeNano"):
+            server_ms = int(res["timeNano"]) / 1e6
+        elif res.get("timeSecond"):
+            server_ms = int(res["timeSecond"]) * 1000
+        elif data.get("time"):
+            server_ms = float(data["time"])
+        else:
+            raise BybitHTTPError(f"Bybit time: в ответе нет времени сервера: {data}")
+        self.clock.observe(server_ms, sent, recv, reset=True)
+        return self.clock.offset_ms
+
+    # -------- подпись --------
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.api_secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+    def _auth_headers(self, payload_tail: str) -> Dict[str, str]:
+        ts = str(self.clock.now_ms())
+        sign = self._sign(f"{ts}{self.api_key}{self.recv_window}{payload_tail}")
+        return {
+            "X-BAPI-SIGN": sign,
+            "X-BAPI-API-KEY": self.api_key,
+            "X-BAPI-TIMESTAMP": ts,
+            "X-BAPI-RECV-WINDOW": self.recv_window,
+            "Content-Type": "application/json",
+        }
+
+    # -------- лимиты / backoff --------
+    def _wait_limit(self, path: str) -> None:
+        with self._limit_lock:
+            until = self._limit_reset.get(path, 0.0)
+        delay = until / 1000.0 - time.time()
+        if delay > 0:
+            time.sleep(min(delay, self.backoff_cap))
+
+    def _note_limit_headers(self, path: str, r: requests.Response) -> Optional[float]:
+        """Запоминает момент сброса лимита, если остаток исчерпан. Возвращает задержку (с) или None."""
+        remaining = r.headers.get("X-Bapi-Limit-Status")
+        reset_ts = r.headers.get("X-Bapi-Limit-Reset-Timestamp")
+        if reset_ts is None:
+            return None
+        try:
+            # заголовок в серверном времени — переводим в локальное
+            reset_local = float(reset_ts) - self.clock.offset_ms
+        except ValueError:
+            return None
+        if remaining is not None and str(remaining) not in ("0", ""):
+            return None
+        with self._limit_lock:
+            self._limit_reset[path] = reset_local
+        return max(reset_local / 1000.0 - time.time(), 0.0)
+
+    def _backoff(self, attempt: int, at_least: float = 0.0) -> None:
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        time.sleep(min(max(delay, at_least), self.backoff_cap))
+
+    @staticmethod
+    def _retry_safe(method: str, path: str, body: Optional[Dict[str, Any]]) -> bool:
+        if method == "GET" or path not in ORDER_CREATE_PATHS:
+            return True
+        if not body:
+            return False
+        if path == "/v5/order/create":
+            return bool(body.get("orderLinkId"))
+        items = body.get("request") or []
+        return bool(items) and all(it.get("orderLinkId") for it in items)
+
+    # -------- запрос --------
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None,
+        auth: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Выполняет запрос с ретраями. Возвращает JSON-ответ целиком (retCode == 0).
+        Ответ «дубликат orderLinkId» на повторе считается успехом первой попытки.
+        """
+        method = method.upper()
+        url = f"{self.base}{path}"
+        body_str = json.dumps(body or {}) if method == "POST" else ""
+        query = urlencode(params or {}) if method == "GET" else ""
+        retry_safe = self._retry_safe(method, path, body)
+
+        attempt = 0
+        while True:
+            self._wait_limit(path)
+            headers = self._auth_headers(body_str if method == "POST" else query) if auth else None
+            sent = time.time() * 1000
+            try:
+                if method == "POST":
+                    r = self.session.post(url, headers=headers, data=body_str, timeout=self.timeout)
+                else:
+                    # строка запроса должна совпадать с подписанной байт в байт
+                    r = self.session.get(f"{url}?{query}" if query else url, headers=headers, timeout=self.timeout)
+            except requests.exceptions.ConnectionError as e:
+                # соединение не установлено — запрос не ушёл, повторять можно всегда
+                if attempt < self.max_retries and (retry_safe or _not_sent(e)):
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                raise BybitHTTPError(f"Bybit transport error {path}: {e}") from e
+            except requests.exceptions.Timeout as e:
+                if attempt < self.max_retries and retry_safe:
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                raise BybitHTTPError(f"Bybit timeout {path}: {e}") from e
+            recv = time.time() * 1000
+
+            wait_limit = self._note_limit_headers(path, r)
+
+            if not r.ok:
+                if r.status_code in RETRY_HTTP_STATUS and attempt < self.max_retries and retry_safe:
+                    self._backoff(attempt, at_least=wait_limit or 0.0)
+                    attempt += 1
+                    continue
+                raise BybitHTTPError(f"Bybit HTTP {r.status_code} {r.reason}: {r.text}", status=r.status_code)
+
+            data = r.json()
+            if data.get("time"):
+                self.clock.observe(float(data["time"]), sent, recv)
+
+            code = str(data.get("retCode"))
+            if code == "0":
+                return data
+            if code == DUPLICATE_LINK_ID_CODE and attempt > 0:
+                return {"retCode": 0, "retMsg": "OK (duplicate orderLinkId on retry)",
+                        "result": {"orderLinkId": (body or {}).get("orderLinkId", "")}}
+            if code in RETRY_RET_CODES and attempt < self.max_retries and retry_safe:
+                if code == "10002":
+                    try:
+                        self.sync_time()
+                    except Exception:
+                        pass
+                self._backoff(attempt, at_least=wait_limit or 0.0)
+                attempt += 1
+                continue
+            raise BybitHTTPError(f"Bybit error {data.get('retCode')}: {data.get('retMsg')} | {data}", ret_code=code)
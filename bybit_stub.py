@@ -0,0 +1,419 @@
+# bybit_stub.py — локальная заглушка Bybit v5 REST для проверки транспорта и торгового пути
+#
+# Запуск:  python bybit_stub.py --port 18080 --skew-ms 7000
+# и BYBIT_BASE=http://127.0.0.1:18080 для бота.
+#
+# Умеет: /v5/market/time, tickers, instruments-info, position/list, closed-pnl,
+# set-leverage, trading-stop, order/create, order/create-batch.
+# Инъекция сбоев: StubState.fail_next(path, kind), kind = http500 | ratelimit | timestamp | delay | lost
+# (lost — запрос исполняется, но ответ теряется: клиент видит HTTP 502).
+#
+# Приватный WS (--ws-port): auth / subscribe / ping по протоколу v5; ордера REST-заглушки
+# рассылаются событиями order/execution/position, StubState.close_position() имитирует TP/SL.
+# BYBIT_WS_PRIVATE=ws://127.0.0.1:<ws-port>/v5/private
+import argparse
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+
+class StubState:
+    def __init__(self, skew_ms: int = 0, recv_window_check: bool = True):
+        self.skew_ms = int(skew_ms)
+        self.recv_window_check = recv_window_check
+        self.lock = threading.Lock()
+        self.prices: Dict[str, float] = {"BTCUSDT": 60000.0, "ETHUSDT": 3000.0}
+        self.positions: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self.closed: List[Dict[str, Any]] = []
+        self.orders: List[Dict[str, Any]] = []
+        self.link_ids: set = set()
+        self.leverage: Dict[str, str] = {}
+        self.hedge = False
+        self.calls: List[str] = []
+        self._faults: Dict[str, List[str]] = {}
+        self.ws: Optional["StubWsServer"] = None
+
+    def server_ms(self) -> int:
+        return int(time.time() * 1000) + self.skew_ms
+
+    def fail_next(self, path: str, kind: str, times: int = 1) -> None:
+        with self.lock:
+            self._faults.setdefault(path, []).extend([kind] * times)
+
+    def take_fault(self, path: str) -> Optional[str]:
+        with self.lock:
+            q = self._faults.get(path)
+            return q.pop(0) if q else None
+
+    def push(self, topic: str, data: List[Dict[str, Any]]) -> None:
+        if self.ws is not None:
+            self.ws.push(topic, data)
+
+    def close_position(self, symbol: str, pnl: float = 0.0) -> None:
+        """Имитация срабатывания TP/SL: позиция закрыта, события уходят в WS."""
+        with self.lock:
+            keys = [k for k in self.positions if k[0] == symbol]
+            events = []
+            for k in keys:
+                pos = self.positions.pop(k)
+                now = str(self.server_ms())
+                self.closed.append({"symbol": symbol, "side": pos["side"], "closedPnl": str(pnl),
+                                    "updatedTime": now})
+                events.append((pos, now))
+        for pos, now in events:
+            self.push("execution", [{"symbol": symbol, "side": "Sell" if pos["side"] == "Buy" else "Buy",
+                                     "execType": "Trade", "execQty": pos["size"], "closedSize": pos["size"],
+                                     "execTime": now}])
+            self.push("position", [dict(pos, size="0", side="", cumRealisedPnl=str(pnl), updatedTime=now)])
+
+
+def _ok(state: StubState, result: Any, ext: Any = None) -> Dict[str, Any]:
+    return {"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": ext or {}, "time": state.server_ms()}
+
+
+def _err(state: StubState, code: int, msg: str) -> Dict[str, Any]:
+    return {"retCode": code, "retMsg": msg, "result": {}, "retExtInfo": {}, "time": state.server_ms()}
+
+
+def _place(state: StubState, o: Dict[str, Any]) -> Tuple[int, str, Dict[str, Any]]:
+    link = o.get("orderLinkId") or ""
+    if link and link in state.link_ids:
+        return 110072, "OrderLinkedID is duplicate", {}
+    idx = int(o.get("positionIdx", 0))
+    if (idx == 0) == state.hedge:
+        return 10001, "position idx not match position mode", {}
+    sym = o["symbol"]
+    price = state.prices.get(sym, 1.0)
+    side = o["side"]
+    key = (sym, idx)
+    pos = state.positions.get(key)
+    size = float(o["qty"])
+    if pos is None:
+        state.positions[key] = {
+            "symbol": sym, "side": side, "size": str(size), "avgPrice": str(price),
+            "positionIdx": idx, "takeProfit": o.get("takeProfit", ""), "stopLoss": o.get("stopLoss", ""),
+            "updatedTime": str(state.server_ms()),
+        }
+    else:
+        pos["size"] = str(float(pos["size"]) + size)
+    if link:
+        state.link_ids.add(link)
+    oid = f"stub-{len(state.orders) + 1}"
+    state.orders.append(dict(o, orderId=oid))
+    now = str(state.server_ms())
+    state.push("order", [{"orderId": oid, "orderLinkId": link, "symbol": sym, "side": side,
+                          "orderStatus": "Filled", "qty": o["qty"], "updatedTime": now}])
+    state.push("execution", [{"orderId": oid, "symbol": sym, "side": side, "execType": "Trade",
+                              "execQty": o["qty"], "execPrice": str(price), "closedSize": "0", "execTime": now}])
+    state.push("position", [state.positions[key]])
+    return 0, "OK", {"orderId": oid, "orderLinkId": link}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: StubState = None  # type: ignore
+
+    def log_message(self, fmt, *args):  # тихо
+        pass
+
+    def _send(self, payload: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None):
+        if getattr(self, "_lost", False):
+            self._lost = False
+            payload, status, headers = {"retCode": 10016, "retMsg": "stub lost reply"}, 502, None
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _fault(self, path: str) -> bool:
+        st = self.state
+        kind = st.take_fault(path)
+        if kind is None:
+            return False
+        if kind == "http500":
+            self._send({"retCode": 10016, "retMsg": "stub 500"}, status=500)
+        elif kind == "ratelimit":
+            reset = st.server_ms() + 300
+            self._send(_err(st, 10006, "Too many visits!"),
+                       headers={"X-Bapi-Limit-Status": "0", "X-Bapi-Limit": "10",
+                                "X-Bapi-Limit-Reset-Timestamp": str(reset)})
+        elif kind == "timestamp":
+            self._send(_err(st, 10002, "invalid request, please check your server timestamp or recv_window param"))
+        elif kind == "delay":
+            time.sleep(2.0)
+            return False
+        elif kind == "lost":
+            self._lost = True
+            return False
+        return True
+
+    def _check_ts(self) -> bool:
+        st = self.state
+        if not st.recv_window_check or "X-BAPI-TIMESTAMP" not in self.headers:
+            return True
+        ts = int(self.headers["X-BAPI-TIMESTAMP"])
+        recv = int(self.headers.get("X-BAPI-RECV-WINDOW", "5000"))
+        now = st.server_ms()
+        if ts > now + 1000 or now - ts > recv:
+            self._send(_err(st, 10002, "invalid request, please check your server timestamp or recv_window param"))
+            return False
+        return True
+
+    def do_GET(self):
+        st = self.state
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        st.calls.append(u.path)
+        if self._fault(u.path) or not self._check_ts():
+            return
+        if u.path == "/v5/market/time":
+            now = st.server_ms()
+            self._send(_ok(st, {"timeSecond": str(now // 1000), "timeNano": str(now * 1_000_000)}))
+        elif u.path == "/v5/market/tickers":
+            syms = [q["symbol"]] if q.get("symbol") else list(st.prices)
+            self._send(_ok(st, {"category": "linear",
+                                "list": [{"symbol": s, "lastPrice": str(st.prices.get(s, 1.0))} for s in syms]}))
+        elif u.path == "/v5/market/instruments-info":
+            lst = [{"symbol": s, "priceFilter": {"tickSize": "0.01"},
+                    "lotSizeFilter": {"qtyStep": "0.001", "minOrderQty": "0.001", "minNotionalValue": "5"}}
+                   for s in st.prices]
+            self._send(_ok(st, {"category": "linear", "list": lst}))
+        elif u.path == "/v5/position/list":
+            with st.lock:
+                self._send(_ok(st, {"list": list(st.positions.values())}))
+        elif u.path == "/v5/position/closed-pnl":
+            sym = q.get("symbol")
+            with st.lock:
+                self._send(_ok(st, {"list": [c for c in st.closed if not sym or c["symbol"] == sym]}))
+        else:
+            self._send({"retCode": 404, "retMsg": "not found"}, status=404)
+
+    def do_POST(self):
+        st = self.state
+        n = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(n) or b"{}")
+        path = urlparse(self.path).path
+        st.calls.append(path)
+        if self._fault(path) or not self._check_ts():
+            return
+        with st.lock:
+            if path == "/v5/position/set-leverage":
+                if st.leverage.get(body["symbol"]) == body["buyLeverage"]:
+                    self._send(_err(st, 110043, "leverage not modified"))
+                else:
+                    st.leverage[body["symbol"]] = body["buyLeverage"]
+                    self._send(_ok(st, {}))
+            elif path == "/v5/position/switch-mode":
+                st.hedge = int(body.get("mode", 0)) == 3
+                self._send(_ok(st, {}))
+            elif path == "/v5/position/trading-stop":
+                self._send(_ok(st, {}))
+            elif path == "/v5/order/create":
+                code, msg, res = _place(st, body)
+                self._send(_ok(st, res) if code == 0 else _err(st, code, msg))
+            elif path == "/v5/order/create-batch":
+                res_list, ext_list = [], []
+                for o in body.get("request", []):
+                    code, msg, res = _place(st, o)
+                    res_list.append(dict(res, category="linear", symbol=o.get("symbol")))
+                    ext_list.append({"code": code, "msg": msg})
+                self._send(_ok(st, {"list": res_list}, {"list": ext_list}))
+            else:
+                self._send({"retCode": 404, "retMsg": "not found"}, status=404)
+
+
+# =========================
+# Приватный WS (RFC 6455, минимальный, только stdlib)
+# =========================
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_send(conn: socket.socket, payload: bytes, opcode: int = 0x1) -> None:
+    head = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        head += bytes([n])
+    elif n < 65536:
+        head += bytes([126]) + struct.pack(">H", n)
+    else:
+        head += bytes([127]) + struct.pack(">Q", n)
+    conn.sendall(head + payload)
+
+
+def _recv_exact(conn: socket.socket, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("ws closed")
+        buf += chunk
+    return buf
+
+
+def _ws_recv(conn: socket.socket) -> Tuple[int, bytes]:
+    b1, b2 = _recv_exact(conn, 2)
+    opcode = b1 & 0x0F
+    n = b2 & 0x7F
+    if n == 126:
+        n = struct.unpack(">H", _recv_exact(conn, 2))[0]
+    elif n == 127:
+        n = struct.unpack(">Q", _recv_exact(conn, 8))[0]
+    mask = _recv_exact(conn, 4) if b2 & 0x80 else b"\0\0\0\0"
+    data = bytearray(_recv_exact(conn, n))
+    for i in range(n):
+        data[i] ^= mask[i % 4]
+    return opcode, bytes(data)
+
+
+class _WsClient:
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.topics: set = set()
+        self.authed = False
+        self.lock = threading.Lock()
+
+    def send_json(self, obj: Dict[str, Any]) -> None:
+        with self.lock:
+            _ws_send(self.conn, json.dumps(obj).encode())
+
+
+class _WsHandler(socketserver.BaseRequestHandler):
+    server: "StubWsServer"
+
+    def handle(self):
+        conn = self.request
+        raw = b""
+        while b"\r\n\r\n" not in raw:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return
+            raw += chunk
+        headers = {}
+        for line in raw.decode(errors="ignore").split("\r\n")[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + _WS_GUID).encode()).digest())
+        conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        client = _WsClient(conn)
+        self.server.add_client(client)
+        try:
+            while True:
+                opcode, payload = _ws_recv(conn)
+                if opcode == 0x8:
+                    with client.lock:
+                        _ws_send(conn, b"", opcode=0x8)
+                    return
+                if opcode == 0x9:
+                    with client.lock:
+                        _ws_send(conn, payload, opcode=0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                self._on_text(client, json.loads(payload))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.server.remove_client(client)
+
+    def _on_text(self, client: _WsClient, msg: Dict[str, Any]) -> None:
+        op = msg.get("op")
+        if op == "auth":
+            args = msg.get("args") or []
+            ok = len(args) == 3 and int(args[1]) > int(time.time() * 1000)
+            client.authed = ok
+            client.send_json({"op": "auth", "success": ok, "ret_msg": "" if ok else "expired", "conn_id": "stub"})
+        elif op == "subscribe":
+            if client.authed:
+                client.topics.update(msg.get("args") or [])
+            client.send_json({"op": "subscribe", "success": client.authed,
+                              "ret_msg": "" if client.authed else "not authed", "conn_id": "stub"})
+        elif op == "ping":
+            client.send_json({"op": "pong", "success": True, "ret_msg": "pong", "conn_id": "stub"})
+
+
+class StubWsServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), _WsHandler)
+        self._clients: List[_WsClient] = []
+        self._clients_lock = threading.Lock()
+
+    def add_client(self, c: _WsClient) -> None:
+        with self._clients_lock:
+            self._clients.append(c)
+
+    def remove_client(self, c: _WsClient) -> None:
+        with self._clients_lock:
+            if c in self._clients:
+                self._clients.remove(c)
+
+    def push(self, topic: str, data: List[Dict[str, Any]]) -> None:
+        msg = {"id": f"stub-{time.time_ns()}", "topic": topic, "creationTime": int(time.time() * 1000), "data": data}
+        with self._clients_lock:
+            clients = [c for c in self._clients if topic in c.topics]
+        for c in clients:
+            try:
+                c.send_json(msg)
+            except OSError:
+                self.remove_client(c)
+
+    def drop_all(self) -> None:
+        """Рвёт все соединения — проверка переподключения клиента."""
+        with self._clients_lock:
+            clients = list(self._clients)
+        for c in clients:
+            try:
+                c.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def start_stub(port: int = 0, skew_ms: int = 0, ws_port: Optional[int] = None) -> Tuple[ThreadingHTTPServer, StubState]:
+    """
+    Поднимает заглушку в фоне. port=0 — свободный порт (см. server.server_address).
+    ws_port (0 — свободный) дополнительно поднимает приватный WS: state.ws.server_address.
+    """
+    state = StubState(skew_ms=skew_ms)
+    handler = type("StubHandler", (_Handler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="bybit-stub").start()
+    if ws_port is not None:
+        state.ws = StubWsServer(ws_port)
+        threading.Thread(target=state.ws.serve_forever, daemon=True, name="bybit-stub-ws").start()
+    return server, state
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local Bybit v5 REST stub")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--ws-port", type=int, default=None, help="поднять приватный WS на этом порту")
+    ap.add_argument("--skew-ms", type=int, default=0, help="сдвиг часов сервера относительно локальных")
+    args = ap.parse_args()
+    server, state = start_stub(args.port, args.skew_ms, ws_port=args.ws_port)
+    print(f"Bybit stub on http://127.0.0.1:{server.server_address[1]} (skew {args.skew_ms} ms)")
+    if state.ws is not None:
+        print(f"Bybit private WS stub on ws://127.0.0.1:{state.ws.server_address[1]}/v5/private")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# bybit_ws.py — приватный WebSocket Bybit v5: позиции / ордера / исполнения в памяти
+#
+# Опционально (BYBIT_WS_ENABLED=true), нужен пакет websocket-client.
+# Пока поток жив и подписан, AccountState отвечает на вопросы
+# «сколько открыто», «открыта ли пара», «когда закрылась последняя» без REST.
+import hashlib
+import hmac
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - опциональная зависимость
+    websocket = None
+
+PRIVATE_TOPICS = ["position", "order", "execution"]
+TERMINAL_ORDER_STATUSES = {"Filled", "Cancelled", "Rejected", "Deactivated", "PartiallyFilledCanceled"}
+
+
+class AccountState:
+    """
+    Живое состояние аккаунта: открытые позиции, активные ордера, время последних закрытий.
+    Потокобезопасно; ready=True только когда стрим подписан и состояние засеяно снимком REST.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.positions: Dict[str, Dict[str, Any]] = {}   # "SYMBOL|idx" -> позиция (size != 0)
+        self.orders: Dict[str, Dict[str, Any]] = {}      # orderId -> активный ордер
+        self.last_close_ms: Dict[str, int] = {}          # SYMBOL -> время последнего закрытия
+        self.last_event_ms = 0
+        self.ready = False
+        self.on_position_closed: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    @staticmethod
+    def _pos_key(p: Dict[str, Any]) -> str:
+        return f"{p.get('symbol')}|{p.get('positionIdx', 0)}"
+
+    # -------- засев снимком REST --------
+    def seed(self, positions: List[Dict[str, Any]], closed_pnl: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.positions = {self._pos_key(p): p for p in positions if float(p.get("size") or 0) != 0}
+            for c in closed_pnl:
+                ts = int(c.get("updatedTime", 0) or 0)
+                sym = c.get("symbol")
+                if sym and ts > self.last_close_ms.get(sym, 0):
+                    self.last_close_ms[sym] = ts
+
+    # -------- события стрима --------
+    def apply(self, topic: str, data: List[Dict[str, Any]]) -> None:
+        closed: List[Dict[str, Any]] = []
+        with self._lock:
+            self.last_event_ms = int(time.time() * 1000)
+            if topic == "position":
+                for p in data:
+                    key = self._pos_key(p)
+                    if float(p.get("size") or 0) != 0:
+                        self.positions[key] = p
+                    elif key in self.positions:
+                        prev = self.positions.pop(key)
+                        ts = int(p.get("updatedTime", 0) or 0) or self.last_event_ms
+                        self.last_close_ms[p.get("symbol")] = ts
+                        closed.append(dict(prev, **{k: v for k, v in p.items() if v not in ("", None)}))
+            elif topic == "order":
+                for o in data:
+                    oid = o.get("orderId")
+                    if not oid:
+                        continue
+                    if o.get("orderStatus") in TERMINAL_ORDER_STATUSES:
+                        self.orders.pop(oid, None)
+                    else:
+                        self.orders[oid] = o
+            elif topic == "execution":
+                for e in data:
+                    if float(e.get("closedSize") or 0) > 0:
+                        sym = e.get("symbol")
+                        ts = int(e.get("execTime", 0) or 0) or self.last_event_ms
+                        if ts > self.last_close_ms.get(sym, 0):
+                            self.last_close_ms[sym] = ts
+        cb = self.on_position_closed
+        if cb is not None:
+            for p in closed:
+                try:
+                    cb(p)
+                except Exception:
+                    pass
+
+    # -------- запросы торгового пути --------
+    def open_count(self) -> int:
+        with self._lock:
+            return len({k.split("|")[0] for k in self.positions})
+
+    def is_open(self, symbol: str) -> bool:
+        with self._lock:
+            return any(k.split("|")[0] == symbol for k in self.positions)
+
+    def open_positions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.positions.values())
+
+    def last_closed_ms(self, symbol: str) -> Optional[int]:
+        with self._lock:
+            return self.last_close_ms.get(symbol)
+
+
+class PrivateStream:
+    """
+    Поток с подключением к приватному WS: auth -> subscribe -> ping каждые 20с.
+    При обрыве переподключается с backoff; после переподписки состояние заново
+    засевается через seed_fn (снимок REST), чтобы не потерять события разрыва.
+    clock — часы сервера REST-клиента (ServerClock): expires подписи auth считается по ним.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        api_secret: str,
+        state: AccountState,
+        seed_fn: Optional[Callable[[], None]] = None,
+        logger=None,
+        ping_interval: float = 20.0,
+        clock=None,
+    ):
+        if websocket is None:
+            raise RuntimeError("BYBIT_WS_ENABLED=true требует пакет websocket-client")
+        self.url = url
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.state = state
+        self.seed_fn = seed_fn
+        self.logger = logger
+        self.ping_interval = ping_interval
+        self.clock = clock
+        self._ws = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _auth_args(self) -> List[Any]:
+        now_ms = self.clock.now_ms() if self.clock is not None else int(time.time() * 1000)
+        expires = now_ms + 10_000
+        sig = hmac.new(self.api_secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        return [self.api_key, expires, sig]
+
+    def _log(self, level: str, msg: str, *args):
+        if self.logger is not None:
+            getattr(self.logger, level)(msg, *args)
+
+    # -------- колбэки websocket-client --------
+    def _on_open(self, ws):
+        ws.send(json.dumps({"op": "auth", "args": self._auth_args()}))
+
+    def _on_message(self, ws, raw):
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        op = msg.get("op")
+        if op == "auth":
+            if msg.get("success"):
+                ws.send(json.dumps({"op": "subscribe", "args": PRIVATE_TOPICS}))
+            else:
+                self._log("error", "Bybit WS auth failed: %s", msg.get("ret_msg"))
+                ws.close()
+            return
+        if op == "subscribe":
+            if msg.get("success"):
+                try:
+                    if self.seed_fn is not None:
+                        self.seed_fn()
+                    self.state.ready = True
+                    self._log("info", "Bybit WS: подписка %s активна", ",".join(PRIVATE_TOPICS))
+                except Exception as e:
+                    self._log("warning", "Bybit WS seed error: %s", e)
+                    ws.close()
+            else:
+                self._log("error", "Bybit WS subscribe failed: %s", msg.get("ret_msg"))
+            return
+        topic = msg.get("topic")
+        if topic in PRIVATE_TOPICS:
+            self.state.apply(topic, msg.get("data") or [])
+
+    def _on_close(self, ws, *args):
+        self.state.ready = False
+
+    def _on_error(self, ws, err):
+        self._log("warning", "Bybit WS error: %s", err)
+
+    def _pinger(self, ws):
+        while not self._stop.is_set() and ws.sock and ws.sock.connected:
+            try:
+                ws.send(json.dumps({"op": "ping"}))
+            except Exception:
+                return
+            self._stop.wait(self.ping_interval)
+
+    def _run(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            ws = websocket.WebSocketApp(
+                self.url,
+                on_open=lambda w: (self._on_open(w),
+                                   threading.Thread(target=self._pinger, args=(w,), daemon=True).start()),
+                on_message=self._on_message,
+                on_close=self._on_close,
+                on_error=self._on_error,
+            )
+            self._ws = ws
+            started = time.time()
+            ws.run_forever()
+            self.state.ready = False
+            if self._stop.is_set():
+                break
+            # соединение прожило долго — backoff с начала
+            delay = 1.0 if time.time() - started > 60 else min(delay * 2, 30.0)
+            self._log("warning", "Bybit WS: переподключение через %.0fс", delay)
+            self._stop.wait(delay)
+
+    def start(self) -> "PrivateStream":
+        self._thread = threading.Thread(target=self._run, daemon=True, name="bybit-ws")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
@@ -0,0 +1,294 @@
+# candle_cache.py — локальный демон кэша свечей/тикеров для нескольких инстансов бота на хосте
+#
+# Демон держит одно соединение ccxt и буферы свечей (CandleStore на каждый ТФ) и отдаёт
+# OHLCV, тикеры и markets по Unix-сокету (JSON-строки). Одинаковые одновременные запросы
+# разных ботов схлопываются в один запрос к бирже; свежие ответы переиспользуются CANDLE_CACHE_TTL сек.
+#
+#   python candle_cache.py --socket /run/vtb/candles.sock
+#
+# Бот подключается через CANDLE_CACHE_SOCKET=/run/vtb/candles.sock — build_exchange()
+# вернёт CandleCacheClient с тем же интерфейсом, что нужен боту от ccxt.
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from candles import CandleStore, tf_minutes
+from execution import RateGate
+from settings import Settings
+
+
+class CandleCacheError(RuntimeError):
+    pass
+
+
+class _SingleFlight:
+    """
+    Один запрос к бирже на ключ: параллельные вызовы ждут результат первого; ответ живёт ttl сек
+    (ttl=0 — только схлопывание одновременных вызовов). Протухшие ответы вычищаются при вставке.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, "_Call"] = {}
+        self._done: Dict[tuple, tuple] = {}   # key -> (monotonic срок годности, value)
+
+    def do(self, key: tuple, fn: Callable, ttl: float = 0.0):
+        with self._lock:
+            hit = self._done.get(key)
+            if hit is not None and time.monotonic() < hit[0]:
+                return hit[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+        if not leader:
+            return call.wait()
+        try:
+            value = fn()
+        except Exception as e:
+            call.fail(e)
+            with self._lock:
+                self._inflight.pop(key, None)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if ttl > 0:
+                now = time.monotonic()
+                for k in [k for k, (exp, _) in self._done.items() if exp <= now]:
+                    del self._done[k]
+                self._done[key] = (now + ttl, value)
+        call.finish(value)
+        return value
+
+
+class _Call:
+    def __init__(self):
+        self._ev = threading.Event()
+        self._value = None
+        self._error: Optional[BaseException] = None
+
+    def finish(self, value):
+        self._value = value
+        self._ev.set()
+
+    def fail(self, error: BaseException):
+        self._error = error
+        self._ev.set()
+
+    def wait(self):
+        self._ev.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+# =========================
+# Демон
+# =========================
+class CandleCacheService:
+    """Логика демона без сокетов: буферы по ТФ, тикеры, markets."""
+
+    def __init__(self, exchange, capacity: int = 1500, ttl: float = 30.0, tickers_ttl: float = 10.0):
+        self.exchange = exchange
+        self.capacity = int(capacity)
+        self.ttl = float(ttl)
+        self.tickers_ttl = float(tickers_ttl)
+        self._flight = _SingleFlight()
+        self._stores: Dict[str, CandleStore] = {}
+        self._lock = threading.Lock()
+        self._gate = RateGate(float(getattr(exchange, "rateLimit", 0) or 0) / 1000.0) \
+            if getattr(exchange, "enableRateLimit", False) else None
+        self.stats = {"requests": 0, "exchange_calls": 0}
+
+    def _store(self, timeframe: str) -> CandleStore:
+        with self._lock:
+            st = self._stores.get(timeframe)
+            if st is None:
+                st = CandleStore(base_tf=timeframe, capacity=self.capacity, gate=self._gate)
+                self._stores[timeframe] = st
+            return st
+
+    def _counted(self, fn: Callable) -> Callable:
+        def run():
+            self.stats["exchange_calls"] += 1
+            return fn()
+        return run
+
+    def markets(self) -> Dict:
+        return self.exchange.markets
+
+    def fetch_tickers(self) -> Dict:
+        self.stats["requests"] += 1
+        return self._flight.do(("tickers",), self._counted(self.exchange.fetch_tickers), ttl=self.tickers_ttl)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str, since: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[list]:
+        self.stats["requests"] += 1
+        limit = int(limit or 500)
+        store = self._store(timeframe)
+        bars = self._flight.do(("ohlcv", symbol, timeframe),
+                               self._counted(lambda: store.update(self.exchange, symbol)), ttl=self.ttl)
+        rows = bars.rows()
+        if since is not None:
+            # свечи выровнены по ТФ: since внутри бара перед первой строкой ничего не теряет
+            covered = bool(rows) and since > rows[0][0] - tf_minutes(timeframe) * 60_000
+        else:
+            covered = len(rows) >= limit
+        if not covered:
+            # глубже буфера — прямой запрос: одинаковые одновременные схлопываются, но не хранятся
+            # (у постраничной докачки истории since на каждой странице свой)
+            return self._flight.do(
+                ("ohlcv-raw", symbol, timeframe, since, limit),
+                self._counted(lambda: self.exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since,
+                                                                limit=limit)))
+        if since is not None:
+            return [r for r in rows if r[0] >= since][:limit]
+        return rows[-limit:]
+
+    def handle(self, req: Dict):
+        op = req.get("op")
+        args = req.get("args") or {}
+        if op == "fetch_ohlcv":
+            return self.fetch_ohlcv(args["symbol"], args.get("timeframe", "1h"), args.get("since"), args.get("limit"))
+        if op == "fetch_tickers":
+            return self.fetch_tickers()
+        if op == "markets":
+            return self.markets()
+        if op == "info":
+            return {"rateLimit": getattr(self.exchange, "rateLimit", 0), "id": getattr(self.exchange, "id", ""),
+                    "stats": dict(self.stats)}
+        raise CandleCacheError(f"unknown op: {op}")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service: CandleCacheService = self.server.service
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                resp = {"id": req.get("id"), "ok": True, "result": service.handle(req)}
+            except Exception as e:
+                resp = {"id": None, "ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(resp, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class CandleCacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128   # одновременные подключения потоков скана нескольких ботов
+
+    def __init__(self, socket_path: str, service: CandleCacheService):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(socket_path, _Handler)
+        self.service = service
+
+
+# =========================
+# Клиент (для бота)
+# =========================
+class CandleCacheClient:
+    """
+    Подмножество интерфейса ccxt, которое использует бот: markets, load_markets,
+    fetch_tickers, fetch_ohlcv. Соединение — одно на поток (скан идёт из пула потоков).
+    Троттлинг делает демон, поэтому enableRateLimit здесь выключен.
+    """
+
+    enableRateLimit = False
+
+    def __init__(self, socket_path: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.markets: Dict = {}
+        self._local = threading.local()
+        self._seq = 0
+        info = self._call("info")
+        self.id = info.get("id", "")
+        self.rateLimit = info.get("rateLimit", 0)
+
+    def _conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            c = (sock, sock.makefile("rb"))
+            self._local.conn = c
+        return c
+
+    def _drop_conn(self):
+        c = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if c is not None:
+            try:
+                c[1].close()
+                c[0].close()
+            except OSError:
+                pass
+
+    def _call(self, op: str, **args):
+        self._seq += 1
+        payload = (json.dumps({"id": self._seq, "op": op, "args": args}) + "\n").encode("utf-8")
+        for attempt in (0, 1):
+            try:
+                sock, rf = self._conn()
+                sock.sendall(payload)
+                line = rf.readline()
+                if not line:
+                    raise ConnectionError("candle cache closed connection")
+                break
+            except (OSError, ConnectionError):
+                self._drop_conn()
+                if attempt:
+                    raise
+        resp = json.loads(line)
+        if not resp.get("ok"):
+            raise CandleCacheError(resp.get("error") or "candle cache error")
+        return resp["result"]
+
+    def load_markets(self) -> Dict:
+        self.markets = self._call("markets")
+        return self.markets
+
+    def fetch_tickers(self) -> Dict:
+        return self._call("fetch_tickers")
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1h", since: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[list]:
+        return self._call("fetch_ohlcv", symbol=symbol, timeframe=timeframe, since=since, limit=limit)
+
+
+def main():
+    from bybit_data import build_direct_exchange
+    from utils import setup_logger
+
+    ap = argparse.ArgumentParser(description="Local OHLCV/tickers cache daemon")
+    ap.add_argument("--socket", default=Settings.CANDLE_CACHE_SOCKET or "./data/candles.sock")
+    ap.add_argument("--capacity", type=int, default=Settings.CANDLE_CAPACITY)
+    ap.add_argument("--ttl", type=float, default=Settings.CANDLE_CACHE_TTL)
+    args = ap.parse_args()
+
+    logger = setup_logger("candle-cache")
+    service = CandleCacheService(build_direct_exchange(), capacity=args.capacity, ttl=args.ttl)
+    server = CandleCacheServer(args.socket, service)
+    logger.info("Кэш свечей слушает %s (capacity=%d, ttl=%.0f c)", args.socket, args.capacity, args.ttl)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
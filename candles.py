@@ -0,0 +1,243 @@
+# candles.py — общий буфер свечей процесса: один базовый ТФ на символ, старшие ТФ — ресемплингом
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ohlcv_buffer import COLUMNS, Bars, OHLCVRing
+
+TF_MINUTES = {
+    "1m": 1, "3m": 3, "5m": 5, "15m": 15, "30m": 30,
+    "1h": 60, "2h": 120, "4h": 240, "6h": 360, "12h": 720,
+    "1d": 1440, "1w": 10080,
+}
+
+# эпоха (1970-01-01) — четверг, а недельные свечи биржи начинаются с понедельника
+_BUCKET_OFFSET_MS = {"1w": 4 * 86_400_000}
+
+
+def tf_minutes(tf: str) -> int:
+    if tf not in TF_MINUTES:
+        raise ValueError(f"Unsupported timeframe: {tf}")
+    return TF_MINUTES[tf]
+
+
+def parse_tfs(raw: str) -> List[str]:
+    """'1h, 4h,1d' -> ['1h', '4h', '1d'] (без дублей, порядок сохраняется)."""
+    out: List[str] = []
+    for part in (raw or "").split(","):
+        tf = part.strip()
+        if tf and tf not in out:
+            tf_minutes(tf)
+            out.append(tf)
+    return out
+
+
+def resample_bars(bars: Bars, base_tf: str, tf: str) -> Bars:
+    """
+    Собирает свечи tf из свечей base_tf (границы — от эпохи UTC, как у биржи; 1w — с понедельника).
+    Первая неполная корзина отбрасывается; последняя (формирующаяся) остаётся,
+    как и формирующаяся свеча в ответе fetch_ohlcv.
+    """
+    if tf == base_tf or not len(bars):
+        return bars
+    step = tf_minutes(tf) // tf_minutes(base_tf)
+    if step <= 1 or tf_minutes(tf) % tf_minutes(base_tf):
+        raise ValueError(f"Cannot derive {tf} from {base_tf}")
+    bucket_ms = tf_minutes(tf) * 60_000
+    offset = _BUCKET_OFFSET_MS.get(tf, 0)
+    bucket = (bars.ts - offset) // bucket_ms
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)]
+    if ends[0] - starts[0] < step:
+        starts, ends = starts[1:], ends[1:]
+    if not len(starts):
+        return Bars(*(np.empty(0, dtype=getattr(bars, c).dtype) for c in COLUMNS))
+    return Bars(
+        bucket[starts] * bucket_ms + offset,
+        bars.open[starts],
+        np.maximum.reduceat(bars.high, starts),
+        np.minimum.reduceat(bars.low, starts),
+        bars.close[ends - 1],
+        np.add.reduceat(bars.volume, starts),
+    )
+
+
+class CandleStore:
+    """
+    Свечи базового ТФ по символам в памяти процесса — по кольцевому буферу OHLCVRing на символ.
+    Первый запрос — полная история (capacity баров), дальше — только хвост с последней
+    известной свечи, дописанный на место. Старшие ТФ (4h, 1d, ...) строятся из базового
+    без отдельных загрузок и кэшируются до следующего изменения буфера.
+
+    compact=True хранит буферы в компактном виде (см. OHLCVRing); mem_limit > 0 — потолок
+    байт на буферы и производные ТФ: сверх него выселяются давно не использованные символы
+    (LRU), их история при следующем обращении загрузится заново.
+    """
+
+    def __init__(self, base_tf: str = "1h", capacity: int = 1000, gate=None,
+                 compact: bool = False, mem_limit: int = 0):
+        self.base_tf = base_tf
+        self.capacity = int(capacity)
+        self.gate = gate  # RateGate: общий темп запросов, когда update зовут из нескольких потоков
+        self.compact = compact
+        self.mem_limit = int(mem_limit)
+        self.evictions = 0
+        self._rings: "OrderedDict[str, OHLCVRing]" = OrderedDict()   # порядок — от холодных к горячим
+        self._derived: Dict[tuple, tuple] = {}   # (symbol, tf) -> (version, Bars)
+        self._sym_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> Optional[Bars]:
+        with self._lock:
+            ring = self._rings.get(symbol)
+        return ring.view() if ring is not None and len(ring) else None
+
+    def _symbol_lock(self, symbol: str) -> threading.Lock:
+        with self._lock:
+            lk = self._sym_locks.get(symbol)
+            if lk is None:
+                lk = self._sym_locks[symbol] = threading.Lock()
+            return lk
+
+    def update(self, exchange, symbol: str) -> Bars:
+        with self._symbol_lock(symbol):
+            with self._lock:
+                ring = self._rings.get(symbol)
+            last = ring.last_ts if ring is not None else None
+            if last is not None:
+                gap_bars = (time.time() * 1000 - last) / (tf_minutes(self.base_tf) * 60_000)
+                if gap_bars >= 1000:
+                    last = None  # разрыв длиннее одной страницы — проще загрузить заново
+            if last is None:
+                rows = self._fetch_history(exchange, symbol)
+                ring = OHLCVRing(self.capacity, compact=self.compact)
+                ring.extend(rows)
+                with self._lock:
+                    self._rings[symbol] = ring
+            else:
+                ring.extend(self._fetch(exchange, symbol, since=last, limit=1000))
+            with self._lock:
+                self._rings.move_to_end(symbol)
+                if self.mem_limit > 0:
+                    self._evict_locked(keep=symbol)
+            return ring.view()
+
+    def patch(self, symbol: str, price: float, now_ms: int) -> bool:
+        """
+        Цена тикера в формирующуюся свечу без запроса свечей: close = price, high/low раздвигаются.
+        False — буфера нет или формирующийся бар уже закрылся по времени: выдуманный следующий
+        бар сдвинул бы since у update(), и закрытый бар не получил бы итоговые OHLCV биржи
+        (ждём полного скана).
+        """
+        step = tf_minutes(self.base_tf) * 60_000
+        with self._symbol_lock(symbol):
+            with self._lock:
+                ring = self._rings.get(symbol)
+            if ring is None or not len(ring):
+                return False
+            last = ring.last_ts
+            if now_ms >= last + step:
+                return False
+            bar = ring.view(1)
+            ring.extend([[last, float(bar.open[0]), max(float(bar.high[0]), price),
+                          min(float(bar.low[0]), price), price, float(bar.volume[0])]])
+            return True
+
+    def _bytes_locked(self) -> int:
+        derived = sum(getattr(b, c).nbytes for _, b in self._derived.values() for c in COLUMNS)
+        return sum(r.nbytes for r in self._rings.values()) + derived
+
+    def _evict_locked(self, keep: str) -> None:
+        used = self._bytes_locked()
+        while used > self.mem_limit:
+            victim = next((s for s in self._rings if s != keep), None)
+            if victim is None:
+                break
+            used -= self._rings.pop(victim).nbytes
+            for key in [k for k in self._derived if k[0] == victim]:
+                bars = self._derived.pop(key)[1]
+                used -= sum(getattr(bars, c).nbytes for c in COLUMNS)
+            self.evictions += 1
+
+    def nbytes(self) -> int:
+        """Память под буферы и кэш производных ТФ, байт."""
+        with self._lock:
+            return self._bytes_locked()
+
+    def _fetch(self, exchange, symbol: str, since: Optional[int] = None, limit: int = 1000) -> list:
+        if self.gate is not None:
+            self.gate.wait()
+        if since is None:
+            return exchange.fetch_ohlcv(symbol, timeframe=self.base_tf, limit=limit)
+        return exchange.fetch_ohlcv(symbol, timeframe=self.base_tf, since=since, limit=limit)
+
+    def _fetch_history(self, exchange, symbol: str) -> list:
+        """Полная история capacity баров; больше 1000 — постранично через since."""
+        if self.capacity <= 1000:
+            return self._fetch(exchange, symbol, limit=self.capacity)
+        step_ms = tf_minutes(self.base_tf) * 60_000
+        now_ms = int(time.time() * 1000)
+        since = now_ms - self.capacity * step_ms
+        rows: list = []
+        while since < now_ms:
+            page = self._fetch(exchange, symbol, since=since, limit=1000)
+            if not page:
+                break
+            if rows:
+                page = [r for r in page if r[0] > rows[-1][0]]
+                if not page:
+                    break
+            rows.extend(page)
+            since = int(page[-1][0]) + step_ms
+            if len(page) < 1000:
+                break
+        return rows[-self.capacity:]
+
+    def frame(self, symbol: str, tf: str) -> Optional[Bars]:
+        with self._lock:
+            ring = self._rings.get(symbol)
+        if ring is None or not len(ring):
+            return None
+        with self._lock:
+            if symbol in self._rings:
+                self._rings.move_to_end(symbol)
+        if tf == self.base_tf:
+            return ring.view()
+        key = (symbol, tf)
+        with self._lock:
+            hit = self._derived.get(key)
+        if hit is not None and hit[0] == ring.version:
+            return hit[1]
+        bars = resample_bars(ring.view(), self.base_tf, tf)
+        with self._lock:
+            self._derived[key] = (ring.version, bars)
+        return bars
+
+    def drop(self, symbol: str) -> None:
+        with self._lock:
+            self._rings.pop(symbol, None)
+            self._sym_locks.pop(symbol, None)
+            for key in [k for k in self._derived if k[0] == symbol]:
+                del self._derived[key]
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._rings)
+
+
+_store: Optional[CandleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_candle_store(base_tf: str = "1h", capacity: int = 1000, gate=None,
+                     compact: bool = False, mem_limit: int = 0) -> CandleStore:
+    """Один буфер свечей на процесс (параметры берутся при первом вызове)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CandleStore(base_tf=base_tf, capacity=capacity, gate=gate,
+                                 compact=compact, mem_limit=mem_limit)
+        return _store
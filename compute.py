@@ -0,0 +1,302 @@
+# compute.py — оценка символов в пуле процессов (CPU-этап скана вне GIL)
+#
+# Загрузка свечей остаётся в потоках пула скана, а паттерны/индикаторы/тренд для сотен
+# символов и нескольких ТФ считаются в COMPUTE_WORKERS процессах. Готовые к оценке символы
+# собираются в пачки до COMPUTE_CHUNK: окна базового ТФ пачки копируются одним блоком
+# в shared_memory (ts int64 + o/h/l/c/v float64), воркер строит Bars как view в этот блок —
+# без pickle DataFrame. Обратно идёт компактный структурированный массив сигналов
+# (индексы символа/ТФ, коды направления и тренда, битовые маски паттернов и проверок, RSI);
+# словари сигналов собираются здесь, в том же виде, что у evaluate_symbol.
+import multiprocessing as mp
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from candles import CandleStore, resample_bars
+from execution import get_scan_pool
+from ohlcv_buffer import Bars
+from patterns import BEAR_PATTERNS, BULL_PATTERNS
+from settings import Settings
+
+DIRECTIONS = ("BULL", "BEAR")
+TRENDS = ("BULL", "BEAR", "NEUTRAL")
+CHECKS = ("EMA", "RSI", "MACD")
+PATTERNS = sorted(set(BULL_PATTERNS) | set(BEAR_PATTERNS))
+_PATTERN_BIT = {name: 1 << i for i, name in enumerate(PATTERNS)}
+
+SIGNAL_DTYPE = np.dtype([
+    ("sym", np.int32),      # индекс символа в пачке
+    ("tf", np.int8),        # индекс ТФ в scan_tfs
+    ("dir", np.int8),       # DIRECTIONS
+    ("trend", np.int8),     # TRENDS, -1 — тренд не считался
+    ("checks", np.uint8),   # по 2 бита на CHECKS: есть проверка, результат
+    ("pats", np.uint64),    # биты PATTERNS
+    ("rsi", np.float64),
+])
+
+
+def encode_signal(k: int, sig: Dict, scan_tfs: List[str]) -> tuple:
+    checks = 0
+    for i, name in enumerate(CHECKS):
+        if name in sig["checks"]:
+            checks |= (1 | (bool(sig["checks"][name]) << 1)) << (2 * i)
+    pats = 0
+    for name in sig["patterns"]:
+        pats |= _PATTERN_BIT[name]
+    trend = TRENDS.index(sig["trend"]) if sig.get("trend") is not None else -1
+    return (k, scan_tfs.index(sig["tf"]), DIRECTIONS.index(sig["direction"]), trend, checks, pats, sig["rsi"])
+
+
+def decode_signal(row, sym: str, scan_tfs: List[str]) -> Dict:
+    direction = DIRECTIONS[int(row["dir"])]
+    registry = BULL_PATTERNS if direction == "BULL" else BEAR_PATTERNS
+    mask = int(row["pats"])
+    code = int(row["checks"])
+    sig = {
+        "symbol": sym,
+        "direction": direction,
+        "tf": scan_tfs[int(row["tf"])],
+        "rsi": float(row["rsi"]),
+        # порядок паттернов и проверок — как у find_patterns/evaluate_indicators
+        "patterns": [name for name in registry if mask & _PATTERN_BIT[name]],
+        "checks": {name: bool(code >> (2 * i + 1) & 1) for i, name in enumerate(CHECKS) if code >> (2 * i) & 1},
+    }
+    if int(row["trend"]) >= 0:
+        sig["trend"] = TRENDS[int(row["trend"])]
+    return sig
+
+
+# =========================
+# Воркер
+# =========================
+class _Frames:
+    """То, что evaluate_symbol берёт у CandleStore: frame(sym, tf) поверх окна базового ТФ."""
+
+    def __init__(self, base_tf: str, bars: Bars):
+        self.base_tf = base_tf
+        self.bars = bars
+        self._derived: Dict[str, Bars] = {}
+
+    def frame(self, symbol: str, tf: str) -> Optional[Bars]:
+        if tf == self.base_tf:
+            return self.bars
+        if tf not in self._derived:
+            self._derived[tf] = resample_bars(self.bars, self.base_tf, tf)
+        return self._derived[tf]
+
+
+def _init_worker(settings: Dict) -> None:
+    # настройки координатора: воркер оценивает ровно тем же конфигом
+    for k, v in settings.items():
+        setattr(Settings, k, v)
+
+
+def _evaluate_block(buf, layout: List[Tuple[str, int, int]], base_tf: str, scan_tfs: List[str],
+                    trend_tfs: List[str]) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+    from main import evaluate_symbol
+
+    total = layout[-1][2] if layout else 0
+    ts = np.ndarray((total,), dtype=np.int64, buffer=buf)
+    px = np.ndarray((5, total), dtype=np.float64, buffer=buf, offset=total * 8)
+    rows: List[tuple] = []
+    errors: List[Tuple[int, str]] = []
+    for k, (sym, lo, hi) in enumerate(layout):
+        try:
+            sigs, _ = evaluate_symbol(_Frames(base_tf, Bars(ts[lo:hi], *px[:, lo:hi])), sym, scan_tfs, trend_tfs)
+        except Exception as e:
+            errors.append((k, f"{type(e).__name__}: {e}"))
+            continue
+        rows.extend(encode_signal(k, sig, scan_tfs) for sig in sigs)
+    return np.array(rows, dtype=SIGNAL_DTYPE), errors
+
+
+def _evaluate_chunk(shm_name: str, layout: List[Tuple[str, int, int]], base_tf: str, scan_tfs: List[str],
+                    trend_tfs: List[str]) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # все view в блок живут только внутри _evaluate_block — к close() ссылок не остаётся
+        return _evaluate_block(shm.buf, layout, base_tf, scan_tfs, trend_tfs)
+    finally:
+        shm.close()
+
+
+# =========================
+# Координатор
+# =========================
+def _pack(candles: CandleStore, symbols: List[str]) -> Tuple[Optional[shared_memory.SharedMemory], list]:
+    """Окна базового ТФ символов одним блоком shared_memory; layout — [(symbol, lo, hi)]."""
+    bars = [(sym, candles.get(sym)) for sym in symbols]
+    bars = [(sym, b) for sym, b in bars if b is not None and len(b)]
+    if not bars:
+        return None, []
+    layout, pos = [], 0
+    for sym, b in bars:
+        layout.append((sym, pos, pos + len(b)))
+        pos += len(b)
+    shm = shared_memory.SharedMemory(create=True, size=pos * 8 * 6)
+    ts = np.ndarray((pos,), dtype=np.int64, buffer=shm.buf)
+    px = np.ndarray((5, pos), dtype=np.float64, buffer=shm.buf, offset=pos * 8)
+    for (sym, lo, hi), (_, b) in zip(layout, bars):
+        ts[lo:hi] = b.ts
+        for i, c in enumerate(("open", "high", "low", "close", "volume")):
+            px[i, lo:hi] = b[c]
+    del ts, px
+    return shm, layout
+
+
+def _settle(fut: Future, result=None, error: Optional[BaseException] = None) -> None:
+    try:
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass  # отменён координатором (дедлайн)
+
+
+class ComputeStage:
+    """
+    submit() возвращает по Future на символ в порядке входного списка — как пул скана:
+    cycle_once работает с ними так же (дедлайн, порядок, отмена). Результат — (сигналы, frames).
+    """
+
+    def __init__(self, workers: int, chunk: int = 16, logger=None):
+        self.workers = max(1, int(workers))
+        self.chunk = max(1, int(chunk))
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                settings = {k: v for k, v in vars(Settings).items() if k.isupper()}
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(settings,))
+            return self._pool
+
+    def _broken(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        if self.logger is not None:
+            self.logger.warning("Пул оценки: воркер упал — пул будет пересоздан")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, exchange, candles: CandleStore, symbols: List[str], scan_tfs: List[str],
+               trend_tfs: List[str]) -> List[Future]:
+        out: Dict[str, Future] = {sym: Future() for sym in symbols}
+        ready: "queue.Queue" = queue.Queue()
+        scan_pool = get_scan_pool()
+        for sym in symbols:
+            fetch = scan_pool.submit(candles.update, exchange, sym)
+            fetch.add_done_callback(lambda f, sym=sym: ready.put((sym, f)))
+            # отменённый дедлайном символ не качаем, если загрузка ещё не началась
+            out[sym].add_done_callback(lambda f, fetch=fetch: f.cancelled() and fetch.cancel())
+        threading.Thread(target=self._dispatch, args=(candles, out, ready, scan_tfs, trend_tfs),
+                         daemon=True, name="compute-dispatch").start()
+        return [out[sym] for sym in symbols]
+
+    def _dispatch(self, candles: CandleStore, out: Dict[str, Future], ready: "queue.Queue",
+                  scan_tfs: List[str], trend_tfs: List[str]) -> None:
+        left = len(out)
+        while left:
+            # пачка — всё, что успело загрузиться, но не больше chunk: первый символ не ждёт остальных
+            batch = [ready.get()]
+            while len(batch) < self.chunk:
+                try:
+                    batch.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            left -= len(batch)
+            syms: List[str] = []
+            for sym, fetch in batch:
+                if fetch.cancelled() or out[sym].done():
+                    continue
+                err = fetch.exception()
+                if err is not None:
+                    _settle(out[sym], error=err)
+                else:
+                    syms.append(sym)
+            if syms:
+                self._run_chunk(candles, out, syms, scan_tfs, trend_tfs)
+
+    def _run_chunk(self, candles: CandleStore, out: Dict[str, Future], syms: List[str],
+                   scan_tfs: List[str], trend_tfs: List[str]) -> None:
+        try:
+            shm, layout = _pack(candles, syms)
+        except Exception as e:
+            for sym in syms:
+                _settle(out[sym], error=e)
+            return
+        if shm is None:
+            for sym in syms:
+                _settle(out[sym], ([], {}))
+            return
+        pool = self._executor()
+        try:
+            job = pool.submit(_evaluate_chunk, shm.name, layout, candles.base_tf, scan_tfs, trend_tfs)
+        except Exception as e:
+            shm.close()
+            shm.unlink()
+            if isinstance(e, BrokenProcessPool):
+                self._broken(pool)
+            for sym in syms:
+                _settle(out[sym], error=e)
+            return
+
+        def done(job: Future) -> None:
+            shm.close()
+            shm.unlink()
+            try:
+                rows, errors = job.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._broken(pool)
+                for sym in syms:
+                    _settle(out[sym], error=e)
+                return
+            failed = dict(errors)
+            by_sym: Dict[int, List[Dict]] = {}
+            for row in rows:
+                k = int(row["sym"])
+                by_sym.setdefault(k, []).append(decode_signal(row, layout[k][0], scan_tfs))
+            packed = {sym for sym, _, _ in layout}
+            for sym in syms:
+                if sym not in packed:
+                    _settle(out[sym], ([], {}))
+            for k, (sym, _, _) in enumerate(layout):
+                if k in failed:
+                    _settle(out[sym], error=RuntimeError(failed[k]))
+                    continue
+                sigs = by_sym.get(k, [])
+                # свечи нужны только для ATR по сигналам — view в свой буфер, без копий
+                frames = {(sym, tf): candles.frame(sym, tf).tail(Settings.SCAN_BARS)
+                          for tf in {s["tf"] for s in sigs}}
+                _settle(out[sym], (sigs, frames))
+
+        job.add_done_callback(done)
+
+    def stop(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+_stage: Optional[ComputeStage] = None
+_stage_lock = threading.Lock()
+
+
+def get_compute_stage(logger=None) -> ComputeStage:
+    """Пул оценки процесса (COMPUTE_WORKERS процессов, создаётся при первом вызове)."""
+    global _stage
+    with _stage_lock:
+        if _stage is None:
+            _stage = ComputeStage(Settings.COMPUTE_WORKERS, chunk=Settings.COMPUTE_CHUNK, logger=logger)
+        return _stage
@@ -0,0 +1,180 @@
+# correlation.py — скользящая матрица корреляций доходностей universe
+#
+# Окно — CORR_WINDOW закрытых баров CORR_TF. Матрица не пересчитывается заново: на каждый
+# закрытый бар прибавляется вклад нового вектора доходностей и вычитается вклад выпавшего
+# (внешние произведения NumPy, O(N^2) на бар). Корреляция попарная — по барам, где есть
+# данные у обоих символов (пропуски: символ отставал, ярусный скан, только что в universe).
+# Раз в окно суммы пересобираются из сохранённых доходностей, чтобы не копилась ошибка округления.
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from candles import CandleStore, tf_minutes
+from settings import Settings
+
+
+class RollingCorrelation:
+    def __init__(self, window: int = 100, min_periods: int = 30, capacity: int = 64):
+        self.window = int(window)
+        self.min_periods = int(min_periods)
+        self.last_ts: Optional[int] = None
+        self._idx: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._pos = 0
+        self._filled = 0
+        self._pushes = 0
+        self._lock = threading.Lock()
+        self._alloc(capacity)
+
+    def _alloc(self, cap: int) -> None:
+        self._cap = cap
+        self._r = np.zeros((self.window, cap))   # доходности (0 там, где данных нет)
+        self._v = np.zeros((self.window, cap))   # 1 — доходность есть
+        # попарные суммы по общим барам: n_ij, sum r_i, sum r_i^2 (по барам, где есть j), sum r_i r_j
+        self._n = np.zeros((cap, cap))
+        self._sx = np.zeros((cap, cap))
+        self._sxx = np.zeros((cap, cap))
+        self._sxy = np.zeros((cap, cap))
+        self._free = [i for i in range(cap - 1, -1, -1) if i not in self._idx.values()]
+
+    def _grow(self) -> None:
+        old = (self._r, self._v, self._n, self._sx, self._sxx, self._sxy, self._cap)
+        self._alloc(self._cap * 2)
+        c = old[-1]
+        self._r[:, :c], self._v[:, :c] = old[0], old[1]
+        for dst, src in zip((self._n, self._sx, self._sxx, self._sxy), old[2:6]):
+            dst[:c, :c] = src
+        self._free = [i for i in range(self._cap - 1, c - 1, -1)]
+
+    def set_symbols(self, symbols: Iterable[str]) -> None:
+        """Набор символов матрицы: новые получают пустую историю, выбывшие освобождают слот."""
+        keep = set(symbols)
+        with self._lock:
+            for sym in [s for s in self._idx if s not in keep]:
+                i = self._idx.pop(sym)
+                self._r[:, i] = 0.0
+                self._v[:, i] = 0.0
+                for m in (self._n, self._sx, self._sxx, self._sxy):
+                    m[i, :] = 0.0
+                    m[:, i] = 0.0
+                self._free.append(i)
+            for sym in keep:
+                if sym not in self._idx:
+                    if not self._free:
+                        self._grow()
+                    self._idx[sym] = self._free.pop()
+
+    def push(self, ts: int, returns: Dict[str, float]) -> None:
+        """Доходности одного закрытого бара {symbol: r}; символов без значения на этом баре нет."""
+        with self._lock:
+            r = np.zeros(self._cap)
+            v = np.zeros(self._cap)
+            for sym, x in returns.items():
+                i = self._idx.get(sym)
+                if i is not None and np.isfinite(x):
+                    r[i] = x
+                    v[i] = 1.0
+            old_r, old_v = self._r[self._pos].copy(), self._v[self._pos].copy()
+            self._r[self._pos], self._v[self._pos] = r, v
+            self._pos = (self._pos + 1) % self.window
+            self._filled = min(self._filled + 1, self.window)
+            self._pushes += 1
+            self.last_ts = ts
+            if self._pushes % self.window == 0:
+                self._rebuild()
+                return
+            self._n += np.outer(v, v) - np.outer(old_v, old_v)
+            self._sx += np.outer(r, v) - np.outer(old_r, old_v)
+            self._sxx += np.outer(r * r, v) - np.outer(old_r * old_r, old_v)
+            self._sxy += np.outer(r, r) - np.outer(old_r, old_r)
+
+    def _rebuild(self) -> None:
+        r, v = self._r, self._v
+        self._n = v.T @ v
+        self._sx = r.T @ v
+        self._sxx = (r * r).T @ v
+        self._sxy = r.T @ r
+
+    def _corr_locked(self, i: int, j) -> np.ndarray:
+        n = self._n[i, j]
+        sx, sy = self._sx[i, j], self._sx[j, i]
+        cov = n * self._sxy[i, j] - sx * sy
+        var = (n * self._sxx[i, j] - sx * sx) * (n * self._sxx[j, i] - sy * sy)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rho = cov / np.sqrt(var)
+        return np.where((n >= self.min_periods) & (var > 0), rho, np.nan)
+
+    def corr(self, a: str, b: str) -> float:
+        with self._lock:
+            i, j = self._idx.get(a), self._idx.get(b)
+            if i is None or j is None:
+                return float("nan")
+            return float(self._corr_locked(i, j))
+
+    def most_correlated(self, symbol: str, others: Iterable[str]) -> Optional[Tuple[str, float]]:
+        """(символ, rho) с наибольшей корреляцией к symbol среди others; None — нечего сравнивать."""
+        with self._lock:
+            i = self._idx.get(symbol)
+            pairs = [(s, self._idx[s]) for s in others if s != symbol and s in self._idx]
+            if i is None or not pairs:
+                return None
+            rho = self._corr_locked(i, np.array([j for _, j in pairs]))
+        if np.all(np.isnan(rho)):
+            return None
+        k = int(np.nanargmax(rho))
+        return pairs[k][0], float(rho[k])
+
+    def matrix(self, symbols: List[str]) -> np.ndarray:
+        with self._lock:
+            ix = np.array([self._idx.get(s, -1) for s in symbols])
+            out = np.full((len(symbols), len(symbols)), np.nan)
+            ok = np.flatnonzero(ix >= 0)
+            if len(ok):
+                out[np.ix_(ok, ok)] = self._corr_locked(ix[ok][:, None], ix[ok][None, :])
+            return out
+
+    def update_from_candles(self, candles: CandleStore, tf: str, symbols: List[str],
+                            now_ms: Optional[int] = None) -> int:
+        """
+        Досчитывает все закрытые с прошлого раза бары tf по буферам свечей (первый вызов —
+        последние window баров истории). Возвращает число добавленных баров.
+        """
+        self.set_symbols(symbols)
+        step = tf_minutes(tf) * 60_000
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        last_closed = now_ms // step * step - step
+        first = last_closed - (self.window - 1) * step
+        if self.last_ts is not None:
+            first = max(first, self.last_ts + step)
+        if first > last_closed:
+            return 0
+        want = np.arange(first - step, last_closed + 1, step, dtype=np.int64)   # + бар до первого
+        closes = np.full((len(want), len(symbols)), np.nan)
+        for k, sym in enumerate(symbols):
+            bars = candles.frame(sym, tf)
+            if bars is None or not len(bars):
+                continue
+            ts = bars.ts[-(len(want) + 2):]
+            pos = np.searchsorted(ts, want)
+            hit = pos < len(ts)
+            hit[hit] = ts[pos[hit]] == want[hit]
+            closes[hit, k] = np.asarray(bars.close[-(len(want) + 2):], dtype=float)[pos[hit]]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rets = np.log(closes[1:] / closes[:-1])
+        for row, ts in zip(rets, want[1:]):
+            self.push(int(ts), {sym: x for sym, x in zip(symbols, row) if np.isfinite(x)})
+        return len(want) - 1
+
+
+_corr: Optional[RollingCorrelation] = None
+_corr_lock = threading.Lock()
+
+
+def get_correlation() -> RollingCorrelation:
+    global _corr
+    with _corr_lock:
+        if _corr is None:
+            _corr = RollingCorrelation(window=Settings.CORR_WINDOW, min_periods=Settings.CORR_MIN_BARS)
+        return _corr
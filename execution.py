@@ -0,0 +1,113 @@
+# execution.py — примитивы параллельного исполнения входов и скана
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from settings import Settings
+
+
+class SlotBook:
+    """
+    Атомарный учёт слотов под MAX_OPEN_POSITIONS.
+    reserve() — занять слот до отправки ордера, commit() — позиция открыта,
+    release() — вход не состоялся, слот возвращается.
+    """
+
+    def __init__(self, capacity: int, used: int = 0):
+        self.capacity = int(capacity)
+        self._used = int(used)
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> bool:
+        with self._lock:
+            if self._used + self._reserved >= self.capacity:
+                return False
+            self._reserved += 1
+            return True
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._reserved > 0:
+                self._reserved -= 1
+            self._used += 1
+
+    def release(self) -> None:
+        with self._lock:
+            if self._reserved > 0:
+                self._reserved -= 1
+
+    @property
+    def free(self) -> int:
+        with self._lock:
+            return max(self.capacity - self._used - self._reserved, 0)
+
+
+class SymbolLocks:
+    """
+    По одному Lock на символ: BULL и BEAR по одной паре никогда не входят одновременно.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, symbol: str) -> threading.Lock:
+        with self._guard:
+            lk = self._locks.get(symbol)
+            if lk is None:
+                lk = threading.Lock()
+                self._locks[symbol] = lk
+            return lk
+
+
+class RateGate:
+    """
+    Потокобезопасный интервал между запросами: wait() возвращает управление не чаще,
+    чем раз в min_interval секунд на все потоки вместе (троттлинг ccxt между потоками гоняется).
+    """
+
+    def __init__(self, min_interval: float = 0.0):
+        self.min_interval = max(0.0, float(min_interval))
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_scan_pool: Optional[ThreadPoolExecutor] = None
+_pool_guard = threading.Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """
+    Общий пул потоков исполнения (создаётся один раз на процесс).
+    """
+    global _pool
+    with _pool_guard:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, Settings.EXEC_WORKERS),
+                                       thread_name_prefix="exec")
+        return _pool
+
+
+def get_scan_pool() -> ThreadPoolExecutor:
+    """
+    Отдельный пул загрузки/оценки символов: скан не занимает потоки, нужные входам.
+    """
+    global _scan_pool
+    with _pool_guard:
+        if _scan_pool is None:
+            _scan_pool = ThreadPoolExecutor(max_workers=max(1, Settings.SCAN_WORKERS),
+                                            thread_name_prefix="scan")
+        return _scan_pool
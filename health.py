@@ -0,0 +1,113 @@
+# health.py — реестр здоровья символов: отрицательное кэширование сломанных пар
+#
+# Делистнутые, остановленные и «битые» символы падают в скане каждый цикл, и каждый раз это
+# полный запрос, а то и таймаут. Реестр запоминает ошибки по типам и не пускает символ
+# в universe до retry_at: экспоненциальный backoff от HEALTH_BACKOFF_SEC, а после
+# HEALTH_QUARANTINE_AFTER ошибок подряд (или сразу для BadSymbol) — карантин на
+# HEALTH_QUARANTINE_SEC. Первый успешный скан после паузы снимает запись.
+# Состояние — в таблице symbol_health StateStore, переживает перезапуск.
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+
+from settings import Settings
+from state_store import StateStore
+
+# Имя класса исключения (в т.ч. из текста ошибки воркера/кэш-демона "BadSymbol: ...") -> тип.
+# Первое совпадение по MRO; сетевые и лимиты — не вина символа, их не откладываем.
+_KINDS = {
+    "SymbolUnavailable": "bad_symbol",
+    "BadSymbol": "bad_symbol",
+    "RequestTimeout": "timeout",
+    "TimeoutError": "timeout",
+    "ReadTimeout": "timeout",
+    "RateLimitExceeded": "rate_limit",
+    "DDoSProtection": "rate_limit",
+    "NetworkError": "network",
+    "ConnectionError": "network",
+    "ExchangeNotAvailable": "network",
+    "BadRequest": "exchange",
+    "ExchangeError": "exchange",
+    "ValueError": "data",
+    "IndexError": "data",
+    "KeyError": "data",
+    "TypeError": "data",
+}
+_TRANSIENT = {"network", "rate_limit"}
+
+
+class SymbolUnavailable(Exception):
+    """Инструмент не торгуется (статус справочника Bybit не Trading)."""
+
+
+def classify_error(e: BaseException) -> str:
+    names = [c.__name__ for c in type(e).__mro__]
+    head = str(e).split(":", 1)[0].strip()
+    for name in [head] + names:
+        if name in _KINDS:
+            return _KINDS[name]
+    return "other"
+
+
+class SymbolHealth:
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._rows: Dict[str, Dict] = store.load_health()
+
+    def record_failure(self, symbol: str, e: BaseException, now: Optional[datetime] = None) -> Optional[Dict]:
+        """Запись ошибки; возвращает новое состояние символа (None — ошибка транзиентная)."""
+        kind = classify_error(e)
+        if kind in _TRANSIENT:
+            return None
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            prev = self._rows.get(symbol)
+            failures = (prev["failures"] if prev else 0) + 1
+            quarantined = kind == "bad_symbol" or failures >= Settings.HEALTH_QUARANTINE_AFTER
+            if quarantined:
+                delay = Settings.HEALTH_QUARANTINE_SEC
+            else:
+                delay = min(Settings.HEALTH_BACKOFF_SEC * 2 ** (failures - 1), Settings.HEALTH_MAX_BACKOFF_SEC)
+            row = {"kind": kind, "failures": failures, "last_error": f"{type(e).__name__}: {e}",
+                   "retry_at": now + timedelta(seconds=delay), "quarantined": quarantined}
+            self._rows[symbol] = row
+        self.store.upsert_health(symbol, kind, failures, row["last_error"], row["retry_at"], quarantined)
+        return row
+
+    def record_ok(self, symbol: str) -> None:
+        with self._lock:
+            if self._rows.pop(symbol, None) is None:
+                return
+        self.store.clear_health([symbol])
+
+    def blocked(self, now: Optional[datetime] = None) -> Set[str]:
+        """Символы, которые сейчас не пробуем (backoff или карантин не истекли)."""
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            return {s for s, r in self._rows.items() if r["retry_at"] is not None and r["retry_at"] > now}
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._rows.get(symbol)
+            return dict(row) if row else None
+
+    def summary(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            live = [r for r in self._rows.values() if r["retry_at"] is not None and r["retry_at"] > now]
+        return {"backoff": sum(1 for r in live if not r["quarantined"]),
+                "quarantined": sum(1 for r in live if r["quarantined"])}
+
+
+_health: Dict[int, SymbolHealth] = {}
+_health_lock = threading.Lock()
+
+
+def get_health(store: StateStore) -> SymbolHealth:
+    """Один реестр на хранилище состояния."""
+    with _health_lock:
+        h = _health.get(id(store))
+        if h is None:
+            h = _health[id(store)] = SymbolHealth(store)
+        return h
@@ -1,48 +1,72 @@
 import numpy as np
 import pandas as pd
 
-def ema(series: pd.Series, length: int) -> pd.Series:
-    return series.ewm(span=length, adjust=False).mean()
+# Индикаторы принимают pd.Series или np.ndarray и возвращают то же, что получили:
+# массивы (окна OHLCVRing) считаются тем же ewm-ядром pandas поверх view без копии колонки.
 
-def rsi(close: pd.Series, length: int = 14) -> pd.Series:
-    delta = close.diff()
+def _ewm_mean(x, **kw):
+    if isinstance(x, pd.Series):
+        return x.ewm(**kw).mean()
+    return pd.Series(x, copy=False).ewm(**kw).mean().to_numpy()
+
+def ema(series, length: int):
+    return _ewm_mean(series, span=length, adjust=False)
+
+def rsi(close, length: int = 14):
+    if isinstance(close, pd.Series):
+        delta = close.diff()
+    else:
+        close = np.asarray(close, dtype=float)
+        delta = np.empty_like(close)
+        delta[:1] = np.nan
+        np.subtract(close[1:], close[:-1], out=delta[1:])
     up = np.where(delta > 0, delta, 0.0)
     dn = np.where(delta < 0, -delta, 0.0)
-    roll_up = pd.Series(up, index=close.index).ewm(alpha=1/length, adjust=False).mean()
-    roll_dn = pd.Series(dn, index=close.index).ewm(alpha=1/length, adjust=False).mean()
+    if isinstance(close, pd.Series):
+        up, dn = pd.Series(up, index=close.index), pd.Series(dn, index=close.index)
+    roll_up = _ewm_mean(up, alpha=1/length, adjust=False)
+    roll_dn = _ewm_mean(dn, alpha=1/length, adjust=False)
     rs = roll_up / (roll_dn + 1e-12)
     return 100 - (100 / (1 + rs))
 
-def macd(close: pd.Series, fast=12, slow=26, signal=9):
-    ema_fast = close.ewm(span=fast, adjust=False).mean()
-    ema_slow = close.ewm(span=slow, adjust=False).mean()
+def macd(close, fast=12, slow=26, signal=9):
+    ema_fast = _ewm_mean(close, span=fast, adjust=False)
+    ema_slow = _ewm_mean(close, span=slow, adjust=False)
     line = ema_fast - ema_slow
-    signal_line = line.ewm(span=signal, adjust=False).mean()
+    signal_line = _ewm_mean(line, span=signal, adjust=False)
     hist = line - signal_line
     return line, signal_line, hist
 
-def slope(series: pd.Series, length: int = 8) -> float:
+def slope(series, length: int = 8) -> float:
     if len(series) < max(3, length):
         return 0.0
-    y = series.iloc[-length:].to_numpy(dtype=float)
+    y = np.asarray(series[-length:] if not isinstance(series, pd.Series) else series.iloc[-length:], dtype=float)
     x = np.arange(length, dtype=float)
     x -= x.mean()
-    y -= y.mean()
+    y = y - y.mean()
     denom = (x ** 2).sum()
     if denom == 0:
         return 0.0
     return float((x * y).sum() / denom)
 
-def atr(df: pd.DataFrame, length: int = 14) -> pd.Series:
+def atr(df, length: int = 14):
     """
-    df: columns ['open','high','low','close']
+    df: columns ['open','high','low','close'] (DataFrame или окно Bars)
     ATR (Wilder) для SL/TP.
     """
-    h, l, c = df["high"], df["low"], df["close"]
-    prev_close = c.shift(1)
-    tr = pd.concat([
-        (h - l).abs(),
-        (h - prev_close).abs(),
-        (l - prev_close).abs()
-    ], axis=1).max(axis=1)
-    return tr.ewm(alpha=1/length, adjust=False).mean()
+    if isinstance(df, pd.DataFrame):
+        h, l, c = df["high"], df["low"], df["close"]
+        prev_close = c.shift(1)
+        tr = pd.concat([
+            (h - l).abs(),
+            (h - prev_close).abs(),
+            (l - prev_close).abs()
+        ], axis=1).max(axis=1)
+        return tr.ewm(alpha=1/length, adjust=False).mean()
+    h, l, c = (np.asarray(df[k], dtype=float) for k in ("high", "low", "close"))
+    prev_close = np.empty_like(c)
+    prev_close[:1] = np.nan
+    prev_close[1:] = c[:-1]
+    # fmax пропускает NaN, как max(axis=1) у pandas на первой свече
+    tr = np.fmax(np.abs(h - l), np.fmax(np.abs(h - prev_close), np.abs(l - prev_close)))
+    return _ewm_mean(tr, alpha=1/length, adjust=False)
@@ -0,0 +1,112 @@
+# iterlog.py — журнал итераций: постоянно открытый файл, ротация по размеру/дню, gzip
+import gzip
+import json
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils import _json_default
+
+
+class RotatingJsonlWriter:
+    """
+    Пишет JSONL в один открытый файл. Ротация — когда файл превысил max_bytes
+    или сменились сутки (локальное время). Ротированный файл переименовывается
+    в <stem>.<YYYYmmdd_HHMMSS>.jsonl и сжимается в .gz в фоне; хранится keep_files последних.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 50 * 1024 * 1024, rotate_daily: bool = True,
+                 compress: bool = True, keep_files: int = 30):
+        self.path = Path(path)
+        self.max_bytes = int(max_bytes)
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.keep_files = int(keep_files)
+        self._lock = threading.Lock()
+        self._fh = None
+        self._size = 0
+        self._day: Optional[str] = None
+        self._open()
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._size = self._fh.tell()
+        if self._size > 0:
+            self._day = datetime.fromtimestamp(self.path.stat().st_mtime).strftime("%Y%m%d")
+        else:
+            self._day = datetime.now().strftime("%Y%m%d")
+
+    def _need_rotate(self, incoming: int) -> bool:
+        if self._size == 0:
+            return False
+        if self.max_bytes > 0 and self._size + incoming > self.max_bytes:
+            return True
+        return self.rotate_daily and datetime.now().strftime("%Y%m%d") != self._day
+
+    def _rotate(self):
+        self._fh.close()
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        rotated = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        n = 1
+        while rotated.exists() or Path(f"{rotated}.gz").exists():
+            rotated = self.path.with_name(f"{self.path.stem}.{stamp}-{n}{self.path.suffix}")
+            n += 1
+        self.path.rename(rotated)
+        self._open()
+        if self.compress:
+            threading.Thread(target=self._compress_and_prune, args=(rotated,), daemon=True).start()
+        else:
+            self._prune()
+
+    def _compress_and_prune(self, rotated: Path):
+        try:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            rotated.unlink()
+        except OSError:
+            pass
+        self._prune()
+
+    def _prune(self):
+        if self.keep_files <= 0:
+            return
+        old = sorted(self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}*"))
+        for p in old[:-self.keep_files]:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+    def write(self, obj) -> None:
+        line = json.dumps(obj, ensure_ascii=False, default=_json_default) + "\n"
+        with self._lock:
+            if self._need_rotate(len(line.encode("utf-8"))):
+                self._rotate()
+            self._fh.write(line)
+            self._fh.flush()
+            self._size += len(line.encode("utf-8"))
+            self._day = datetime.now().strftime("%Y%m%d")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+_writers: Dict[str, RotatingJsonlWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path: Path, **kwargs) -> RotatingJsonlWriter:
+    """Один писатель на путь на процесс."""
+    key = str(Path(path).resolve())
+    with _writers_lock:
+        w = _writers.get(key)
+        if w is None:
+            w = RotatingJsonlWriter(path, **kwargs)
+            _writers[key] = w
+        return w
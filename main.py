@@ -1,50 +1,61 @@
 # main.py
-import json
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 from settings import Settings
-from utils import ensure_dirs, setup_logger, write_jsonl, sleep_until_next_cycle, now_iso
-from bybit_data import build_exchange, fetch_top_by_volatility_24h
+from utils import ensure_dirs, setup_logger, sleep_until_next_cycle, now_iso, peak_rss_mb, reset_peak_rss, rss_mb
+from bybit_data import build_exchange
 from indicators import ema, rsi, macd, atr
 from reporter import build_report_txt, build_signals_txt, write_file
-from telegram_utils import send_document, send_text, TelegramError
+from telegram_utils import get_dispatcher
 from patterns import BULL_PATTERNS, BEAR_PATTERNS
 from bybit_api import BybitAPI
-
-
-# =========================
-# OHLCV helpers
-# =========================
-def fetch_ohlcv_df(exchange, symbol: str, timeframe: str, limit: int = 300) -> pd.DataFrame:
-    ohlcv = exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=min(max(limit, 50), 1000))
-    df = pd.DataFrame(ohlcv, columns=["ts", "open", "high", "low", "close", "volume"])
-    df["ts"] = pd.to_datetime(df["ts"], unit="ms")
-    return df
+from execution import RateGate, SlotBook, SymbolLocks, get_pool, get_scan_pool
+from state_store import DEFAULT_ACCOUNT, StateStore, get_store
+from iterlog import get_writer
+from signal_history import get_history
+from ohlcv_buffer import Bars, as_bars
+from candles import CandleStore, get_candle_store, parse_tfs, tf_minutes
+from trend import classify_trend, combine_trends
+from shard import get_shard_pool
+from compute import get_compute_stage
+from tiers import TIERS, get_tier_scheduler
+from universe import get_universe_engine
+from correlation import get_correlation
+from health import SymbolUnavailable, get_health
+from accounts import Account, load_accounts, setup_account
+from shadow import get_shadow_engine
 
 
 # =========================
 # Indicators & patterns
 # =========================
-def evaluate_indicators(close: pd.Series, direction: str) -> Dict[str, bool]:
+def evaluate_indicators(close, direction: str) -> Dict[str, bool]:
+    """close — np.ndarray (окно Bars) или pd.Series."""
+    close = np.asarray(close, dtype=float)
     checks = {}
     if Settings.ENABLE_EMA:
         e50 = ema(close, Settings.EMA_FAST)
         e200 = ema(close, Settings.EMA_SLOW)
         i = -1
         if Settings.RELAX_MODE in ("relaxed", "debug"):
-            ok = (close.iat[i] > e200.iat[i]) or (e50.iat[i] > e200.iat[i]) if direction == "BULL" \
-                else (close.iat[i] < e200.iat[i]) or (e50.iat[i] < e200.iat[i])
+            ok = (close[i] > e200[i]) or (e50[i] > e200[i]) if direction == "BULL" \
+                else (close[i] < e200[i]) or (e50[i] < e200[i])
         else:
-            ok = (close.iat[i] > e200.iat[i]) and (e50.iat[i] > e200.iat[i]) if direction == "BULL" \
-                else (close.iat[i] < e200.iat[i]) and (e50.iat[i] < e200.iat[i])
+            ok = (close[i] > e200[i]) and (e50[i] > e200[i]) if direction == "BULL" \
+                else (close[i] < e200[i]) and (e50[i] < e200[i])
         checks["EMA"] = bool(ok)
 
     if Settings.ENABLE_RSI:
-        rv = float(rsi(close, Settings.RSI_LEN).iloc[-1])
+        rv = float(rsi(close, Settings.RSI_LEN)[-1])
         overbought = Settings.RSI_RELAXED_OVERBOUGHT if Settings.RELAX_MODE in ("relaxed", "debug") else Settings.RSI_OVERBOUGHT
         oversold   = Settings.RSI_RELAXED_OVERSOLD   if Settings.RELAX_MODE in ("relaxed", "debug") else Settings.RSI_OVERSOLD
         ok = (rv <= oversold) if direction == "BULL" else (rv >= overbought)
@@ -53,7 +64,7 @@ def evaluate_indicators(close: pd.Series, direction: str) -> Dict[str, bool]:
     if Settings.ENABLE_MACD:
         _, _, hist = macd(close, Settings.MACD_FAST, Settings.MACD_SLOW, Settings.MACD_SIGNAL)
         if len(hist) >= 2:
-            h1, h2 = float(hist.iloc[-2]), float(hist.iloc[-1])
+            h1, h2 = float(hist[-2]), float(hist[-1])
             if Settings.RELAX_MODE in ("relaxed", "debug"):
                 ok = (h2 > h1) if direction == "BULL" else (h2 < h1)
             else:
@@ -86,7 +97,8 @@ def indicators_pass(checks: Dict[str, bool]) -> bool:
     return all(vals)
 
 
-def find_patterns(df: pd.DataFrame, direction: str) -> List[str]:
+def find_patterns(df, direction: str) -> List[str]:
+    df = as_bars(df)
     pats = []
     registry = BULL_PATTERNS if direction == "BULL" else BEAR_PATTERNS
     for name, fn in registry.items():
@@ -101,48 +113,27 @@ def find_patterns(df: pd.DataFrame, direction: str) -> List[str]:
 # =========================
 # State helpers (signals + last entries)
 # =========================
-def _signals_state_file(data_dir: Path) -> Path:
-    return data_dir / "state" / "last_signals.json"
-
-def _entries_state_file(data_dir: Path) -> Path:
-    return data_dir / "state" / "last_entries.json"
+def _store(data_dir: Path) -> StateStore:
+    return get_store(data_dir)
 
 def have_prev_signals_state(data_dir: Path) -> bool:
-    return _signals_state_file(data_dir).exists()
+    return _store(data_dir).has_signals_snapshot()
 
 def load_last_signals(data_dir: Path) -> List[Dict]:
-    p = _signals_state_file(data_dir)
-    if p.exists():
-        try:
-            return json.loads(p.read_text(encoding="utf-8"))
-        except Exception:
-            return []
-    return []
+    return _store(data_dir).load_signals()
 
 def save_last_signals(data_dir: Path, signals: List[Dict]):
-    p = _signals_state_file(data_dir)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(signals, ensure_ascii=False), encoding="utf-8")
-
-def load_last_entries(data_dir: Path) -> Dict[str, str]:
-    """
-    Возвращает словарь {bybit_symbol: iso_ts_last_entry}
-    """
-    p = _entries_state_file(data_dir)
-    if p.exists():
-        try:
-            return json.loads(p.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
+    # пишутся только изменившиеся ключи, одной транзакцией
+    _store(data_dir).replace_signals(signals, key=_signal_key)
 
-def save_last_entries(data_dir: Path, mapping: Dict[str, str]):
-    p = _entries_state_file(data_dir)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(mapping, ensure_ascii=False), encoding="utf-8")
+def record_entry(data_dir: Path, bybit_symbol: str, ts: datetime, account: str = DEFAULT_ACCOUNT):
+    """Отметка входа + кулдаун REENTRY_COOLDOWN_HOURS — атомарный upsert по одной паре аккаунта."""
+    until = ts + timedelta(hours=Settings.REENTRY_COOLDOWN_HOURS)
+    _store(data_dir).record_entry(bybit_symbol, ts, cooldown_until=until, account=account)
 
 def _signal_key(sig: Dict) -> str:
-    return f"{sig['symbol']}|{sig['direction']}"
+    # сигналы из старых снимков без "tf" относятся к WORK_TF
+    return f"{sig['symbol']}|{sig['direction']}|{sig.get('tf') or Settings.WORK_TF}"
 
 
 # =========================
@@ -166,6 +157,13 @@ def is_symbol_open(bybit: BybitAPI, bybit_symbol: str) -> bool:
         return False
 
 def last_closed_age_hours(bybit: BybitAPI, bybit_symbol: str) -> float:
+    st = bybit.account_state
+    if st is not None and st.ready:
+        ts_ms = st.last_closed_ms(bybit_symbol)
+        if not ts_ms:
+            return 9999.0
+        t = datetime.fromtimestamp(ts_ms / 1000.0, tz=timezone.utc)
+        return (datetime.now(timezone.utc) - t).total_seconds() / 3600.0
     try:
         res = bybit.get_closed_pnl(bybit_symbol, limit=50)
         items = res.get("list", [])
@@ -180,40 +178,41 @@ def last_closed_age_hours(bybit: BybitAPI, bybit_symbol: str) -> float:
     except Exception:
         return 9999.0
 
-def pair_in_cooldown(now_utc: datetime, bybit_symbol: str, last_entries: Dict[str, str], bybit: BybitAPI) -> bool:
+def pair_in_cooldown(now_utc: datetime, bybit_symbol: str, store: StateStore, bybit: BybitAPI,
+                     account: str = DEFAULT_ACCOUNT) -> bool:
     """
     True -> вход запрещён.
     Логика:
-      1) Если у нас есть локальная отметка последнего входа < 24ч — запрещаем.
+      1) Если у нас есть локальная отметка последнего входа < 24ч (или активный кулдаун) — запрещаем.
       2) Иначе смотрим закрытые позиции на Bybit — если последняя закрыта < 24ч, запрещаем.
     """
     hours = Settings.REENTRY_COOLDOWN_HOURS
-    iso = last_entries.get(bybit_symbol)
-    if iso:
-        try:
-            t_local = datetime.fromisoformat(iso)
-            if t_local.tzinfo is None:
-                t_local = t_local.replace(tzinfo=timezone.utc)
-            if (now_utc - t_local).total_seconds() / 3600.0 < hours:
-                return True
-        except Exception:
-            pass
+    t_local = store.get_entry(bybit_symbol, account=account)
+    if t_local is not None and (now_utc - t_local).total_seconds() / 3600.0 < hours:
+        return True
+    until = store.cooldown_until(bybit_symbol, account=account)
+    if until is not None and now_utc < until:
+        return True
     # fallback к закрытым сделкам
     return last_closed_age_hours(bybit, bybit_symbol) < hours
 
 
 def calc_levels_and_qty(
-    bybit: BybitAPI, bybit_symbol: str, side: str, df: pd.DataFrame
+    bybit: BybitAPI, bybit_symbol: str, side: str, df: Bars, last: Optional[float] = None,
+    position_usd: Optional[float] = None,
 ) -> Tuple[str, str, str, str, float]:
     """
     Возвращает (qty_str, entry_ref_str, tp_str, sl_str, atr_val)
+    last — цена из тикеров скана; если не передана, запрашиваем у Bybit.
+    position_usd — размер позиции аккаунта (по умолчанию POSITION_USD).
     """
-    last = bybit.get_last_price(bybit_symbol)
-    raw_qty = Settings.POSITION_USD / last
+    if not last or last <= 0:
+        last = bybit.get_last_price(bybit_symbol)
+    raw_qty = (position_usd or Settings.POSITION_USD) / last
     qty_str = bybit.round_qty(bybit_symbol, raw_qty)
     qty_str = bybit.enforce_min_notional(bybit_symbol, qty_str, last)
 
-    a = float(atr(df, Settings.ATR_LEN).iloc[-1])
+    a = float(np.asarray(atr(df, Settings.ATR_LEN))[-1])
     entry_ref = last
     if side == "Buy":
         sl_f = entry_ref - Settings.SL_ATR_MULT * a
@@ -233,140 +232,433 @@ def place_with_auto_position_idx(
     side: str,
     qty_str: str,
     pos_mode_hint: str,
+    take_profit: Optional[str] = None,
+    stop_loss: Optional[str] = None,
 ):
-    hedge = (pos_mode_hint == "HEDGE")
-    idx = 1 if (hedge and side == "Buy") else (2 if hedge and side == "Sell" else 0)
+    """
+    Маркет-вход одним запросом с приложенными TP/SL.
+    positionIdx берём из выученного по символу значения (или из подсказки режима);
+    при несовпадении режима пробуем альтернативный idx один раз и запоминаем удачный.
+    """
+    idx = bybit.position_idx_for(bybit_symbol, side, pos_mode_hint)
 
     try:
-        bybit.place_market_order(bybit_symbol, side, qty_str, position_idx=idx)
-        return idx, ("HEDGE" if idx in (1, 2) else "ONE_WAY")
+        bybit.place_market_order(bybit_symbol, side, qty_str, position_idx=idx,
+                                 take_profit=take_profit, stop_loss=stop_loss)
     except RuntimeError as e:
         msg = str(e)
         if "position idx not match position mode" not in msg:
             raise
-        alt_idx = 0 if idx in (1, 2) else (1 if side == "Buy" else 2)
-        bybit.place_market_order(bybit_symbol, side, qty_str, position_idx=alt_idx)
-        return alt_idx, ("HEDGE" if alt_idx in (1, 2) else "ONE_WAY")
+        idx = 0 if idx in (1, 2) else (1 if side == "Buy" else 2)
+        bybit.place_market_order(bybit_symbol, side, qty_str, position_idx=idx,
+                                 take_profit=take_profit, stop_loss=stop_loss)
+    bybit.remember_position_idx(bybit_symbol, idx)
+    return idx, ("HEDGE" if idx in (1, 2) else "ONE_WAY")
 
 
-def open_trade_if_ok(
-    bybit: BybitAPI,
-    logger,
-    data_dir: Path,
-    new_sigs: List[Dict],
-    df_cache: Dict[str, pd.DataFrame],
-    market_id_map: Dict[str, str],
-    pos_mode: str,
-):
-    """
-    Открываем сделки по «новым» сигналам с лимитами, ATR SL/TP, анти-реэнтри и запретом повторного открытия по паре.
-    """
-    if not new_sigs:
-        return
+_SYMBOL_LOCKS = SymbolLocks()
+_CORR_LOCK = threading.Lock()   # проверка корреляции (в памяти) и занятие символа — атомарно между кандидатами
 
-    current_open = count_open_positions(bybit)
-    slots_left = max(Settings.MAX_OPEN_POSITIONS - current_open, 0)
-    if slots_left <= 0:
-        logger.info("Лимит позиций достигнут (%d). Входы пропущены.", Settings.MAX_OPEN_POSITIONS)
+
+def _notify_trade(logger, sig: Dict, ccxt_symbol: str, bybit_symbol: str, side: str, used_idx: int,
+                  final_mode: str, qty_str: str, entry_ref_str: str, tp_str: str, sl_str: str, atr_val: float,
+                  account: Optional[Account] = None):
+    if not (Settings.TG_TRADE_BOT_TOKEN and Settings.TG_TRADE_CHAT_ID):
+        return
+    usd = account.position_usd if account is not None else Settings.POSITION_USD
+    lev = account.leverage if account is not None else Settings.LEVERAGE
+    try:
+        pats = ", ".join(sig.get("patterns", [])) or "-"
+        ch = sig.get("checks", {})
+        flags = ", ".join([f"{k}={str(v)}" for k, v in ch.items()]) if ch else "-"
+        text = (
+            "✅ ОТКРЫТА СДЕЛКА\n"
+            + (f"Аккаунт: {account.name}\n" if account is not None and Settings.ACCOUNTS else "")
+            + f"Пара: {ccxt_symbol} (Bybit: {bybit_symbol})\n"
+            f"Режим позиций: {final_mode} (idx={used_idx})\n"
+            f"Направление: {'LONG' if side=='Buy' else 'SHORT'}\n"
+            f"Объём: ${usd} (~ qty {qty_str}) | Плечо x{lev}\n"
+            f"Entry≈: {entry_ref_str}\n"
+            f"SL: {sl_str} | TP: {tp_str}\n"
+            f"ATR({Settings.ATR_LEN}): {atr_val:.4f}\n"
+            f"TF: {sig.get('tf') or Settings.WORK_TF}\n"
+            f"Паттерны: {pats}\n"
+            f"Индикаторы: {flags}\n"
+            f"RSI: {sig.get('rsi'):.1f}\n"
+            f"Условие: новая пара; cooldown {Settings.REENTRY_COOLDOWN_HOURS}ч"
+        )
+        get_dispatcher(logger).submit_text(Settings.TG_TRADE_BOT_TOKEN, Settings.TG_TRADE_CHAT_ID, text)
+    except Exception as e:
+        logger.warning("TG trade notify error: %s", e)
+
+
+@dataclass
+class _Entry:
+    """Подготовленный вход: проверки пройдены, слот занят, уровни посчитаны."""
+    sig: Dict
+    ccxt_symbol: str
+    bybit_symbol: str
+    side: str
+    qty_str: str
+    entry_ref_str: str
+    tp_str: str
+    sl_str: str
+    atr_val: float
+    position_idx: int = 0
+
+
+def _notify_close(logger, pos: Dict, account: str = DEFAULT_ACCOUNT):
+    if not (Settings.TG_TRADE_BOT_TOKEN and Settings.TG_TRADE_CHAT_ID):
         return
+    try:
+        text = (
+            "❎ ПОЗИЦИЯ ЗАКРЫТА\n"
+            + (f"Аккаунт: {account}\n" if Settings.ACCOUNTS else "")
+            + f"Пара (Bybit): {pos.get('symbol')}\n"
+            f"Направление: {'LONG' if pos.get('side') == 'Buy' else 'SHORT'}\n"
+            f"Entry: {pos.get('avgPrice') or pos.get('entryPrice') or '-'}\n"
+            f"TP: {pos.get('takeProfit') or '-'} | SL: {pos.get('stopLoss') or '-'}\n"
+            f"Realised PnL (cum): {pos.get('cumRealisedPnl') or '-'}"
+        )
+        get_dispatcher(logger).submit_text(Settings.TG_TRADE_BOT_TOKEN, Settings.TG_TRADE_CHAT_ID, text)
+    except Exception as e:
+        logger.warning("TG close notify error: %s", e)
 
-    last_entries = load_last_entries(data_dir)
+
+def _on_position_closed(logger, data_dir: Path, pos: Dict, account: str = DEFAULT_ACCOUNT):
+    # закрытие из WS сразу ставит кулдаун — без опроса closed-pnl
     now_utc = datetime.now(timezone.utc)
+    try:
+        _store(data_dir).set_cooldown(pos.get("symbol"), now_utc + timedelta(hours=Settings.REENTRY_COOLDOWN_HOURS),
+                                      reason="close", account=account)
+    except Exception as e:
+        logger.warning("Не удалось записать кулдаун по %s: %s", pos.get("symbol"), e)
+    _notify_close(logger, pos, account=account)
 
-    for sig in new_sigs[:slots_left]:
-        ccxt_symbol = sig["symbol"]
-        bybit_symbol = market_id_map.get(ccxt_symbol) or ccxt_symbol.replace("/", "").replace(":USDT", "")
-        direction = sig["direction"]
-        side = "Buy" if direction == "BULL" else "Sell"
 
-        # 0) если уже есть открытая позиция по паре — запрет
-        if is_symbol_open(bybit, bybit_symbol):
+def _prepare_entry(
+    bybit: BybitAPI,
+    logger,
+    sig: Dict,
+    df_cache: Dict[Tuple[str, str], Bars],
+    market_id_map: Dict[str, str],
+    pos_mode: str,
+    last_prices: Dict[str, float],
+    store: StateStore,
+    slots: SlotBook,
+    pending: set,
+    now_utc: datetime,
+    account: Optional[Account] = None,
+    held: Optional[set] = None,
+) -> Optional[_Entry]:
+    """
+    Проверки и подготовка одного входа (в пуле потоков, под замком символа).
+    При успехе слот остаётся зарезервированным до результата ордера.
+    account — аккаунт входа (размер, плечо, лимит, кулдауны); по умолчанию общие настройки.
+    held — снимок открытых позиций (ccxt-символы) для фильтра корреляций; None — запросить.
+    """
+    account = account or Account.default(bybit, pos_mode)
+    ccxt_symbol = sig["symbol"]
+    bybit_symbol = market_id_map.get(ccxt_symbol) or ccxt_symbol.replace("/", "").replace(":USDT", "")
+    direction = sig["direction"]
+    side = "Buy" if direction == "BULL" else "Sell"
+
+    with _SYMBOL_LOCKS.get(f"{account.name}:{bybit_symbol}"):
+        # 0) если уже есть открытая позиция по паре (или вход по ней уже готовится) — запрет
+        if bybit_symbol in pending or is_symbol_open(bybit, bybit_symbol):
             logger.info("По %s уже есть открытая позиция — вход пропущен.", bybit_symbol)
-            continue
+            return None
 
         # 1) кулдаун 24ч по нашей локальной отметке + по закрытым сделкам на Bybit
-        if pair_in_cooldown(now_utc, bybit_symbol, last_entries, bybit):
+        if pair_in_cooldown(now_utc, bybit_symbol, store, bybit, account=account.name):
             logger.info("Cooldown по %s — менее %d часов с последнего входа/закрытия. Пропуск.",
                         bybit_symbol, Settings.REENTRY_COOLDOWN_HOURS)
-            continue
+            return None
 
-        # 2) плечо (best-effort)
-        try:
-            bybit.set_leverage(bybit_symbol, Settings.LEVERAGE)
-        except Exception as e:
-            logger.warning("set_leverage %s: %s (продолжаем)", bybit_symbol, e)
-
-        # 3) проверка данных
-        df = df_cache.get(ccxt_symbol)
+        # 2) проверка данных
+        df = df_cache.get((ccxt_symbol, sig.get("tf") or Settings.WORK_TF))
         if df is None or len(df) < 20:
             logger.info("Нет df в кэше для %s — пропуск", ccxt_symbol)
-            continue
+            return None
+
+        # 2.5) не набираем позиции, которые ходят вместе с уже открытыми (и готовящимися)
+        if Settings.CORR_FILTER:
+            if held is None:
+                held = _open_position_symbols(bybit, market_id_map)
+            with _CORR_LOCK:
+                hit = _correlated_holding(ccxt_symbol, market_id_map, held, pending)
+                if hit is not None:
+                    logger.info("Корреляция %s с %s = %.2f >= %.2f — вход пропущен.",
+                                ccxt_symbol, hit[0], hit[1], Settings.CORR_MAX)
+                    return None
+                pending.add(bybit_symbol)   # занят для остальных кандидатов цикла
+
+        # 3) слот под позицию — атомарно, до любых торговых запросов
+        if not slots.reserve():
+            logger.info("Лимит позиций достигнут (%d). Вход по %s пропущен.",
+                        account.max_open_positions, bybit_symbol)
+            pending.discard(bybit_symbol)
+            return None
 
-        # 4) уровни и qty
         try:
-            qty_str, entry_ref_str, tp_str, sl_str, atr_val = calc_levels_and_qty(bybit, bybit_symbol, side, df)
+            # 4) плечо (best-effort, один раз на символ за процесс)
+            try:
+                bybit.ensure_leverage(bybit_symbol, account.leverage)
+            except Exception as e:
+                logger.warning("set_leverage %s: %s (продолжаем)", bybit_symbol, e)
+
+            # 5) уровни и qty
+            qty_str, entry_ref_str, tp_str, sl_str, atr_val = calc_levels_and_qty(
+                bybit, bybit_symbol, side, df, last=last_prices.get(ccxt_symbol), position_usd=account.position_usd)
         except RuntimeError as e:
             logger.error("Подготовка ордера %s: %s", bybit_symbol, e)
-            continue
+            slots.release()
+            pending.discard(bybit_symbol)
+            return None
+        except Exception:
+            slots.release()
+            pending.discard(bybit_symbol)
+            raise
+
+        pending.add(bybit_symbol)
+
+    return _Entry(sig, ccxt_symbol, bybit_symbol, side, qty_str, entry_ref_str, tp_str, sl_str, atr_val,
+                  position_idx=bybit.position_idx_for(bybit_symbol, side, pos_mode))
+
+
+def _correlated_holding(ccxt_symbol: str, market_id_map: Dict[str, str], held: set,
+                        pending: set) -> Optional[Tuple[str, float]]:
+    """
+    (символ, rho) открытой/готовящейся позиции с корреляцией >= CORR_MAX к кандидату.
+    held — ccxt-символы открытых позиций, pending — bybit-символы готовящихся; без запросов к бирже.
+    """
+    by_id = {v: k for k, v in market_id_map.items()}
+    others = set(held) | {by_id[p] for p in pending if p in by_id}
+    top = get_correlation().most_correlated(ccxt_symbol, list(others))
+    if top is not None and top[1] >= Settings.CORR_MAX:
+        return top
+    return None
+
+
+def _submit_single(bybit: BybitAPI, logger, e: _Entry, pos_mode: str) -> bool:
+    try:
+        used_idx, _ = place_with_auto_position_idx(
+            bybit, e.bybit_symbol, e.side, e.qty_str, pos_mode, take_profit=e.tp_str, stop_loss=e.sl_str)
+    except RuntimeError as err:
+        logger.error("Не удалось открыть позицию %s %s: %s", e.bybit_symbol, e.side, err)
+        return False
+    e.position_idx = used_idx
+    return True
 
-        # 5) вход
-        try:
-            used_idx, final_mode = place_with_auto_position_idx(bybit, bybit_symbol, side, qty_str, pos_mode)
-            logger.info("Открыта позиция: %s %s qty=%s (idx=%d, mode=%s)", bybit_symbol, side, qty_str, used_idx, final_mode)
-        except RuntimeError as e:
-            logger.error("Не удалось открыть позицию %s %s: %s", bybit_symbol, side, e)
-            continue
 
-        # 6) TP/SL
+def _run_each(fn, items: List, logger) -> List:
+    """fn(item) по очереди в текущем потоке (он уже из пула исполнения); ошибка элемента — None."""
+    out = []
+    for it in items:
         try:
-            bybit.set_tp_sl(bybit_symbol, take_profit=tp_str, stop_loss=sl_str, position_idx=used_idx)
-            logger.info("TP/SL проставлены: TP=%s SL=%s (idx=%d)", tp_str, sl_str, used_idx)
+            out.append(fn(it))
         except Exception as e:
-            logger.warning("Не удалось проставить TP/SL для %s: %s", bybit_symbol, e)
+            logger.exception("Execution worker error: %s", e)
+            out.append(None)
+    return out
 
-        # 7) локальная отметка «последний вход по паре»
-        last_entries[bybit_symbol] = now_utc.isoformat(timespec="seconds")
-        save_last_entries(data_dir, last_entries)
 
-        # 8) Telegram уведомление о сделке
-        if Settings.TG_TRADE_BOT_TOKEN and Settings.TG_TRADE_CHAT_ID:
+def _submit_entries(bybit: BybitAPI, logger, entries: List[_Entry], pos_mode: str) -> List[bool]:
+    """
+    Отправка подготовленных входов. Несколько входов — одним /v5/order/create-batch
+    (по BATCH_ORDER_LIMIT за запрос); результаты и ошибки сопоставляются по позиции в пачке.
+    Элементы с несовпавшим режимом позиций переотправляются поштучно с альтернативным idx.
+    Поштучные отправки идут в текущем потоке — вызов уже из пула исполнения.
+    """
+    if len(entries) == 1 or not Settings.EXEC_BATCH_ORDERS:
+        return _run_each(lambda e: _submit_single(bybit, logger, e, pos_mode), entries, logger)
+
+    orders = [
+        BybitAPI.build_market_order(e.bybit_symbol, e.side, e.qty_str, position_idx=e.position_idx,
+                                    take_profit=e.tp_str, stop_loss=e.sl_str)
+        for e in entries
+    ]
+    results = bybit.place_batch_orders(orders)
+
+    ok: List[bool] = [False] * len(entries)
+    retry: List[int] = []
+    for i, (e, res) in enumerate(zip(entries, results)):
+        if res["ok"]:
+            bybit.remember_position_idx(e.bybit_symbol, e.position_idx)
+            ok[i] = True
+        elif "position idx not match position mode" in str(res.get("msg", "")):
+            retry.append(i)
+        else:
+            logger.error("Не удалось открыть позицию %s %s: Bybit %s: %s",
+                         e.bybit_symbol, e.side, res.get("code"), res.get("msg"))
+
+    if retry:
+        for e in (entries[i] for i in retry):
+            # заставляем place_with_auto_position_idx начать с альтернативного idx
+            bybit.remember_position_idx(e.bybit_symbol, 0 if e.position_idx in (1, 2) else 1)
+        again = _run_each(lambda i: _submit_single(bybit, logger, entries[i], pos_mode), retry, logger)
+        for i, r in zip(retry, again):
+            ok[i] = bool(r)
+    return ok
+
+
+class TradeStream:
+    """
+    Входы по мере появления новых сигналов — без ожидания конца скана.
+    offer(sig) сразу отправляет подготовку входа в пул исполнения; готовые входы
+    уходят пачкой из тех, что накопились к моменту отправки (один отправитель за раз).
+    Кандидаты отбираются как раньше: первые slots_left новых сигналов в порядке universe.
+    account — аккаунт исполнения (bybit/pos_mode берутся из него); по умолчанию общие настройки.
+    """
+
+    def __init__(self, bybit: BybitAPI, logger, data_dir: Path,
+                 df_cache: Dict[Tuple[str, str], Bars], market_id_map: Dict[str, str],
+                 pos_mode: str, last_prices: Optional[Dict[str, float]] = None,
+                 account: Optional[Account] = None):
+        self.account = account or Account.default(bybit, pos_mode)
+        self.bybit = self.account.bybit
+        self.logger = logger
+        self.data_dir = data_dir
+        self.df_cache = df_cache
+        self.market_id_map = market_id_map
+        self.pos_mode = self.account.pos_mode
+        self.prices = last_prices or {}
+        limit = self.account.max_open_positions
+        current_open = count_open_positions(self.bybit)
+        self.slots_left = max(limit - current_open, 0)
+        self.slots = SlotBook(limit, used=current_open)
+        self.store = _store(data_dir)
+        self.now_utc = datetime.now(timezone.utc)
+        # снимок открытых позиций для фильтра корреляций — один запрос на поток, не на кандидата
+        self.held = _open_position_symbols(self.bybit, market_id_map) if Settings.CORR_FILTER else set()
+        self.opened: List[_Entry] = []
+        self._pending: set = set()
+        self._offered = 0
+        self._limit_logged = False
+        self._futures: List[Future] = []
+        self._ready: List[_Entry] = []
+        self._sending = False
+        self._lock = threading.Lock()
+
+    def offer(self, sig: Dict) -> bool:
+        if self._offered >= self.slots_left:
+            if not self._limit_logged:
+                self._limit_logged = True
+                self.logger.info("%sЛимит позиций достигнут (%d). Входы пропущены.",
+                                 self._tag, self.account.max_open_positions)
+            return False
+        self._offered += 1
+        self._futures.append(get_pool().submit(self._run, sig))
+        return True
+
+    def _run(self, sig: Dict) -> None:
+        e = _prepare_entry(self.bybit, self.logger, sig, self.df_cache, self.market_id_map, self.pos_mode,
+                           self.prices, self.store, self.slots, self._pending, self.now_utc, account=self.account,
+                           held=self.held)
+        if e is None:
+            return
+        with self._lock:
+            self._ready.append(e)
+            if self._sending:
+                return
+            self._sending = True
+        while True:
+            with self._lock:
+                batch, self._ready = self._ready, []
+                if not batch:
+                    self._sending = False
+                    return
             try:
-                pats = ", ".join(sig.get("patterns", [])) or "-"
-                ch = sig.get("checks", {})
-                flags = ", ".join([f"{k}={str(v)}" for k, v in ch.items()]) if ch else "-"
-                text = (
-                    "✅ ОТКРЫТА СДЕЛКА\n"
-                    f"Пара: {ccxt_symbol} (Bybit: {bybit_symbol})\n"
-                    f"Режим позиций: {final_mode} (idx={used_idx})\n"
-                    f"Направление: {'LONG' if side=='Buy' else 'SHORT'}\n"
-                    f"Объём: ${Settings.POSITION_USD} (~ qty {qty_str}) | Плечо x{Settings.LEVERAGE}\n"
-                    f"Entry≈: {entry_ref_str}\n"
-                    f"SL: {sl_str} | TP: {tp_str}\n"
-                    f"ATR({Settings.ATR_LEN}): {atr_val:.4f}\n"
-                    f"TF: {Settings.WORK_TF}\n"
-                    f"Паттерны: {pats}\n"
-                    f"Индикаторы: {flags}\n"
-                    f"RSI: {sig.get('rsi'):.1f}\n"
-                    f"Условие: новая пара; cooldown {Settings.REENTRY_COOLDOWN_HOURS}ч"
-                )
-                send_text(Settings.TG_TRADE_BOT_TOKEN, Settings.TG_TRADE_CHAT_ID, text)
+                self._send(batch)
+            except Exception:
+                for _ in batch:
+                    self.slots.release()
+                with self._lock:
+                    self._sending = False
+                raise
+
+    def _send(self, entries: List[_Entry]) -> None:
+        results = _submit_entries(self.bybit, self.logger, entries, self.pos_mode)
+        for e, ok in zip(entries, results):
+            if not ok:
+                self.slots.release()
+                continue
+            self.slots.commit()
+            final_mode = "HEDGE" if e.position_idx in (1, 2) else "ONE_WAY"
+            self.logger.info("%sОткрыта позиция: %s %s qty=%s TP=%s SL=%s (idx=%d, mode=%s)", self._tag,
+                             e.bybit_symbol, e.side, e.qty_str, e.tp_str, e.sl_str, e.position_idx, final_mode)
+            # локальная отметка «последний вход по паре» — в кулдаунах своего аккаунта
+            record_entry(self.data_dir, e.bybit_symbol, self.now_utc, account=self.account.name)
+            # Telegram уведомление о сделке (в фоновую очередь — исполнение не ждёт Telegram)
+            _notify_trade(self.logger, e.sig, e.ccxt_symbol, e.bybit_symbol, e.side, e.position_idx,
+                          final_mode, e.qty_str, e.entry_ref_str, e.tp_str, e.sl_str, e.atr_val,
+                          account=self.account)
+            with self._lock:
+                self.opened.append(e)
+
+    def close(self) -> List[_Entry]:
+        """Ждёт все начатые входы; возвращает открытые."""
+        for fut in self._futures:
+            try:
+                fut.result()
             except Exception as e:
-                logger.warning("TG trade notify error: %s", e)
+                self.logger.exception("Trade pipeline error: %s", e)
+        self._futures = []
+        return self.opened
+
+    @property
+    def _tag(self) -> str:
+        return f"[{self.account.name}] " if Settings.ACCOUNTS else ""
+
+
+class FanOutStream:
+    """
+    Один поток сигналов — на все аккаунты: offer(sig) отдаёт сигнал в TradeStream каждого
+    аккаунта, подготовка и ордера идут в общем пуле исполнения параллельно по аккаунтам.
+    У каждого аккаунта свои слоты, кулдауны, размер, плечо и режим позиций.
+    """
+
+    def __init__(self, streams: List[TradeStream]):
+        self.streams = streams
+
+    def offer(self, sig: Dict) -> bool:
+        # без short-circuit: аккаунт с исчерпанным лимитом не мешает остальным
+        return any([s.offer(sig) for s in self.streams])
+
+    def close(self) -> List[_Entry]:
+        opened: List[_Entry] = []
+        for s in self.streams:
+            opened.extend(s.close())
+        return opened
+
+
+def trade_stream(accounts: List[Account], logger, data_dir: Path,
+                 df_cache: Dict[Tuple[str, str], Bars], market_id_map: Dict[str, str],
+                 last_prices: Optional[Dict[str, float]] = None):
+    """TradeStream единственного аккаунта или FanOutStream на несколько."""
+    def make(acc: Account) -> TradeStream:
+        return TradeStream(acc.bybit, logger, data_dir, df_cache, market_id_map, acc.pos_mode,
+                           last_prices=last_prices, account=acc)
+    if len(accounts) == 1:
+        return make(accounts[0])
+    # открытые позиции аккаунтов запрашиваются параллельно (при WS — из памяти)
+    return FanOutStream(list(get_pool().map(make, accounts)))
 
 
 # =========================
 # Optional: anomaly filter
 # =========================
-def pass_anomaly_filter(exchange, symbol: str) -> bool:
+def pass_anomaly_filter(candles: CandleStore, symbol: str) -> bool:
+    """Дневные изменения считаются по 1d, собранному из буфера базового ТФ — без отдельной загрузки."""
     if not Settings.ANOMALY_FILTER_ENABLED:
         return True
     try:
-        ddf = fetch_ohlcv_df(exchange, symbol, "1d", limit=8)
-        if len(ddf) < 8:
+        ddf = candles.frame(symbol, "1d")
+        if ddf is None or len(ddf) < 8:
             return True
         c = ddf["close"]
-        ch24 = (c.iloc[-1] / c.iloc[-2] - 1.0) * 100.0
-        ch7d = (c.iloc[-1] / c.iloc[-8] - 1.0) * 100.0
+        ch24 = (c[-1] / c[-2] - 1.0) * 100.0
+        ch7d = (c[-1] / c[-8] - 1.0) * 100.0
         if abs(ch24) >= Settings.MAX_24H_ABS_CHANGE_PCT or abs(ch7d) >= Settings.MAX_7D_ABS_CHANGE_PCT:
             return False
     except Exception:
@@ -374,95 +666,403 @@ def pass_anomaly_filter(exchange, symbol: str) -> bool:
     return True
 
 
+# =========================
+# Скан: общий буфер свечей, несколько ТФ
+# =========================
+def _scan_tfs() -> List[str]:
+    return parse_tfs(Settings.SCAN_TFS) or [Settings.WORK_TF]
+
+
+def _lookback_bars(base_tf: str, scan_tfs: List[str], trend_tfs: List[str]) -> int:
+    """
+    Сколько баров базового ТФ реально нужно потребителям: SCAN_BARS на каждом ТФ скана,
+    окно EMA_SLOW для тренда, 8 дневок для фильтра аномалий (+1 бар старшего ТФ —
+    на неполную первую корзину ресемплинга). Не больше CANDLE_CAPACITY.
+    """
+    base = tf_minutes(base_tf)
+    need = [(Settings.SCAN_BARS + 1) * tf_minutes(tf) // base for tf in scan_tfs]
+    need += [(max(Settings.SCAN_BARS, Settings.EMA_SLOW) + 1) * tf_minutes(tf) // base for tf in trend_tfs]
+    if Settings.ANOMALY_FILTER_ENABLED:
+        need.append(9 * tf_minutes("1d") // base)
+    return min(max(need), Settings.CANDLE_CAPACITY)
+
+
+def candle_store(exchange=None) -> CandleStore:
+    # базовый ТФ — наименьший из сканируемых и трендовых, остальные строятся из него
+    scan_tfs, trend_tfs = _scan_tfs(), parse_tfs(Settings.TREND_TFS)
+    base_tf = min(scan_tfs + trend_tfs, key=tf_minutes)
+    gate = None
+    if exchange is not None and getattr(exchange, "enableRateLimit", False):
+        gate = RateGate(float(getattr(exchange, "rateLimit", 0) or 0) / 1000.0)
+    if not Settings.LOW_MEMORY:
+        return get_candle_store(base_tf=base_tf, capacity=Settings.CANDLE_CAPACITY, gate=gate,
+                                mem_limit=int(Settings.CANDLE_MEM_LIMIT_MB * 2 ** 20))
+    return get_candle_store(base_tf=base_tf, capacity=_lookback_bars(base_tf, scan_tfs, trend_tfs), gate=gate,
+                            compact=True, mem_limit=int(Settings.CANDLE_MEM_LIMIT_MB * 2 ** 20))
+
+
+def scan_frame(sym: str, tf: str, df: Bars) -> List[Dict]:
+    """Паттерны + индикаторы по одному ТФ одного символа."""
+    out: List[Dict] = []
+    if len(df) < 50:
+        return out
+    close = df["close"]
+    for direction in ("BULL", "BEAR"):
+        pats = find_patterns(df.tail(5), direction)
+        if not pats:
+            continue
+        checks = evaluate_indicators(close, direction)
+        if indicators_pass(checks):
+            out.append({
+                "symbol": sym,
+                "direction": direction,
+                "tf": tf,
+                "rsi": float(rsi(close, Settings.RSI_LEN)[-1]),
+                "patterns": pats,
+                "checks": checks,
+            })
+    return out
+
+
+def scan_symbol(exchange, candles: CandleStore, sym: str, scan_tfs: List[str],
+                trend_tfs: List[str]) -> Tuple[List[Dict], Dict[Tuple[str, str], Bars]]:
+    """
+    Загрузка свечей и оценка одного символа (выполняется в пуле скана).
+    Возвращает (сигналы в порядке ТФ, {(sym, tf): df}).
+    """
+    candles.update(exchange, sym)
+    return evaluate_symbol(candles, sym, scan_tfs, trend_tfs)
+
+
+def evaluate_symbol(candles: CandleStore, sym: str, scan_tfs: List[str],
+                    trend_tfs: List[str]) -> Tuple[List[Dict], Dict[Tuple[str, str], Bars]]:
+    """Оценка символа по уже загруженным свечам (полный скан и быстрый путь по тикерам)."""
+    sigs: List[Dict] = []
+    frames: Dict[Tuple[str, str], Bars] = {}
+    if not pass_anomaly_filter(candles, sym):
+        return sigs, frames
+
+    trend = _symbol_trend(candles, sym, trend_tfs)
+    for tf in scan_tfs:
+        df = candles.frame(sym, tf).tail(Settings.SCAN_BARS)   # view в буфер, без копии
+        frames[(sym, tf)] = df
+        for sig in scan_frame(sym, tf, df):
+            if trend is not None:
+                sig["trend"] = trend
+                if Settings.TREND_FILTER and trend != sig["direction"]:
+                    continue
+            sigs.append(sig)
+    return sigs, frames
+
+
+def _symbol_trend(candles: CandleStore, sym: str, trend_tfs: List[str]) -> Optional[str]:
+    """Сводный тренд по TREND_TFS (combine_trends по всем ТФ); None — тренд не настроен."""
+    if not trend_tfs:
+        return None
+    res: Optional[str] = None
+    for tf in trend_tfs:
+        df = candles.frame(sym, tf)
+        if df is not None and Settings.LOW_MEMORY:
+            df = df.tail(max(Settings.SCAN_BARS, Settings.EMA_SLOW))   # то же окно, что заложено в буфер
+        t = classify_trend(df) if df is not None and len(df) >= 2 else "NEUTRAL"
+        res = t if res is None else combine_trends(res, t)
+    return res
+
+
 # =========================
 # Основной цикл
 # =========================
-def cycle_once(exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str):
+def scan_priority(universe_rows: List[Dict], boosted: set) -> List[str]:
+    """
+    Порядок обработки символов: сначала поднятые (открытые позиции, свежие сигналы,
+    отложенные прошлым циклом), внутри групп — по рангу universe (убывание волатильности).
+    """
+    rows = sorted(universe_rows, key=lambda r: r["symbol"] not in boosted)
+    return [r["symbol"] for r in rows]
+
+
+def _market_id_map(exchange, symbols: List[str]) -> Dict[str, str]:
+    """ccxt symbol -> bybit v5 symbol."""
+    out: Dict[str, str] = {}
+    for sym in symbols:
+        m = exchange.markets.get(sym) or {}
+        out[sym] = m.get("id") or sym.replace("/", "").replace(":USDT", "")
+    return out
+
+
+def _open_position_symbols(bybit: BybitAPI, market_id_map: Dict[str, str]) -> set:
+    by_id = {v: k for k, v in market_id_map.items()}
+    try:
+        pos = bybit.get_open_positions()
+    except Exception:
+        return set()
+    return {by_id[p.get("symbol")] for p in pos
+            if p.get("symbol") in by_id and abs(float(p.get("size") or 0)) > 0}
+
+
+def cycle_once(exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str,
+               accounts: Optional[List[Account]] = None):
+    """
+    Один цикл: universe, скан, входы, отчёты. Скан и маркет-данные — одни на все accounts
+    (по умолчанию единственный аккаунт bybit/pos_mode), входы расходятся по аккаунтам.
+    """
+    accounts = accounts or [Account.default(bybit, pos_mode)]
     logger.info("=== Новый цикл ===")
-    universe_rows = fetch_top_by_volatility_24h(exchange)
+    started = time.monotonic()
+    peak_reset = reset_peak_rss()
+    budget = Settings.CYCLE_BUDGET_SEC
+    deadline = started + max(budget - Settings.CYCLE_RESERVE_SEC, 0.0) if budget > 0 else None
+    # символы в backoff/карантине не занимают место в universe и не тратят запросы
+    health = get_health(_store(data_dir))
+    blocked = health.blocked()
+    candles = candle_store(exchange)
+    universe_rows = get_universe_engine().top(exchange, limit=Settings.UNIVERSE_MAX if Settings.TIERED_SCAN else None,
+                                              exclude=blocked, candles=candles)
     universe_symbols = [r["symbol"] for r in universe_rows]
+    last_prices: Dict[str, float] = {r["symbol"]: r["last"] for r in universe_rows if r.get("last")}
     logger.info(
         "Universe (top %d by 24h vol): %s",
         len(universe_rows),
         ", ".join(universe_symbols[:10]) + (" ..." if len(universe_symbols) > 10 else "")
     )
 
-    # ccxt symbol -> bybit v5 symbol
-    market_id_map: Dict[str, str] = {}
-    for sym in universe_symbols:
-        m = exchange.markets.get(sym) or {}
-        bybit_symbol = m.get("id") or sym.replace("/", "").replace(":USDT", "")
-        market_id_map[sym] = bybit_symbol
-
-    signals: List[Dict] = []
-    df_cache: Dict[str, pd.DataFrame] = {}
-
-    for sym in universe_symbols:
-        try:
-            if not pass_anomaly_filter(exchange, sym):
-                continue
-
-            df = fetch_ohlcv_df(exchange, sym, Settings.WORK_TF, limit=300)
-            df_cache[sym] = df
-            if len(df) < 50:
-                continue
-
-            close = df["close"]
-
-            # BULL
-            pats_bull = find_patterns(df.tail(5), "BULL")
-            if pats_bull:
-                checks = evaluate_indicators(close, "BULL")
-                if indicators_pass(checks):
-                    signals.append({
-                        "symbol": sym,
-                        "direction": "BULL",
-                        "rsi": float(rsi(close, Settings.RSI_LEN).iloc[-1]),
-                        "patterns": pats_bull,
-                        "checks": checks,
-                    })
-
-            # BEAR
-            pats_bear = find_patterns(df.tail(5), "BEAR")
-            if pats_bear:
-                checks = evaluate_indicators(close, "BEAR")
-                if indicators_pass(checks):
-                    signals.append({
-                        "symbol": sym,
-                        "direction": "BEAR",
-                        "rsi": float(rsi(close, Settings.RSI_LEN).iloc[-1]),
-                        "patterns": pats_bear,
-                        "checks": checks,
-                    })
+    market_id_map = _market_id_map(exchange, universe_symbols)
 
-        except Exception as e:
-            logger.warning("Ошибка по %s: %s", sym, e)
-
-    # Новые сигналы против прошлой итерации
+    # справочник Bybit знает о делистинге/остановке раньше, чем ccxt-markets процесса
+    try:
+        bybit.refresh_instruments(Settings.INSTRUMENTS_TTL)
+    except Exception as e:
+        logger.warning("Не удалось обновить справочник инструментов Bybit: %s", e)
+    halted = {sym for sym, bid in market_id_map.items() if bybit.instrument_status(bid) not in (None, "Trading")}
+    if halted:
+        for sym in halted:
+            health.record_failure(sym, SymbolUnavailable(f"{market_id_map[sym]} status {bybit.instrument_status(market_id_map[sym])}"))
+        universe_rows = [r for r in universe_rows if r["symbol"] not in halted]
+        universe_symbols = [r["symbol"] for r in universe_rows]
+        logger.warning("Не торгуются (карантин): %s", ", ".join(sorted(halted)))
+    if blocked:
+        hs = health.summary()
+        logger.info("Реестр здоровья: пропущено %d символов (backoff %d, карантин %d)",
+                    len(blocked), hs["backoff"], hs["quarantined"])
+
+    scan_tfs = _scan_tfs()
+    trend_tfs = parse_tfs(Settings.TREND_TFS)
+
+    # Прошлый снимок сигналов нужен до скана: новые сигналы уходят в торговлю сразу
     prev_exists = have_prev_signals_state(data_dir)
     prev = load_last_signals(data_dir) if prev_exists else []
     prev_keys = {_signal_key(s) for s in prev}
-    curr_keys = {_signal_key(s) for s in signals}
-    new_keys = curr_keys - prev_keys
-    new_sigs = [s for s in signals if _signal_key(s) in new_keys]
-
-    # Торговля: на самом первом запуске — НЕ входим (bootstrap)
     if not prev_exists:
+        # Торговля: на самом первом запуске — НЕ входим (bootstrap)
         logger.info("Bootstrap: первый запуск — сохраняем список сигналов, входы отключены в этом цикле.")
+
+    signals: List[Dict] = []
+    df_cache: Dict[Tuple[str, str], Bars] = {}
+    stream = None
+
+    # Приоритет: открытые позиции, свежие сигналы и отложенные прошлым циклом — вперёд
+    store = _store(data_dir)
+    was_deferred = store.load_deferred()
+    boosted = set(was_deferred) | {s["symbol"] for s in prev}
+    for acc in accounts:
+        boosted |= _open_position_symbols(acc.bybit, market_id_map)
+    # Ярусный скан: за цикл — hot и просроченные warm/cold в пределах SCAN_SYMBOLS_BUDGET
+    sched = get_tier_scheduler() if Settings.TIERED_SCAN else None
+    skipped: List[str] = []
+    tiers: Dict[str, str] = {}
+    if sched is not None:
+        planned, tiers = sched.plan(universe_rows, boosted)
+        picked = set(planned)
+        skipped = [sym for sym in universe_symbols if sym not in picked]
+        order = scan_priority([r for r in universe_rows if r["symbol"] in picked], boosted)
     else:
-        try:
-            open_trade_if_ok(bybit, logger, data_dir, new_sigs, df_cache, market_id_map, pos_mode)
-        except Exception as e:
-            logger.exception("Trade pipeline error: %s", e)
+        order = scan_priority(universe_rows, boosted)
+
+    # Конвейер: символы качаются и оцениваются в пуле скана по мере прихода данных,
+    # результаты принимаются строго в порядке приоритета, вход по первому символу не ждёт последний.
+    # После дедлайна берём только уже готовые результаты, остальные откладываем на следующий цикл.
+    deferred: List[str] = []
+    if Settings.SHARD_WORKERS > 0:
+        # шарды по процессам-воркерам: те же Future на символ, сигналы сводятся здесь
+        futures = get_shard_pool(logger).submit(order, scan_tfs, trend_tfs, universe=universe_symbols)
+    elif Settings.COMPUTE_WORKERS > 0:
+        # загрузка в потоках скана, оценка — пачками в пуле процессов
+        futures = get_compute_stage(logger).submit(exchange, candles, order, scan_tfs, trend_tfs)
+    else:
+        pool = get_scan_pool()
+        futures = [pool.submit(scan_symbol, exchange, candles, sym, scan_tfs, trend_tfs) for sym in order]
+    try:
+        for sym, fut in zip(order, futures):
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                sym_sigs, frames = fut.result(timeout=timeout)
+            except FutureTimeout:
+                deferred.append(sym)
+                continue
+            except Exception as e:
+                st = health.record_failure(sym, e)
+                if st is None:
+                    logger.warning("Ошибка по %s: %s", sym, e)
+                else:
+                    logger.warning("Ошибка по %s: %s | %s #%d, пауза до %s%s", sym, e, st["kind"], st["failures"],
+                                   st["retry_at"].astimezone().strftime("%d.%m %H:%M"),
+                                   " (карантин)" if st["quarantined"] else "")
+                continue
+            health.record_ok(sym)
+            if sched is not None:
+                sched.mark(sym)
+            df_cache.update(frames)
+            signals.extend(sym_sigs)
+            if not prev_exists:
+                continue
+            for sig in sym_sigs:
+                if _signal_key(sig) in prev_keys:
+                    continue
+                try:
+                    if stream is None:
+                        stream = trade_stream(accounts, logger, data_dir, df_cache, market_id_map,
+                                              last_prices=last_prices)
+                    stream.offer(sig)
+                except Exception as e:
+                    logger.exception("Trade pipeline error: %s", e)
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+    # отложенные и не вошедшие в расписание цикла символы сохраняют прошлые сигналы —
+    # иначе в следующем цикле они сойдут за «новые»
+    if deferred or skipped:
+        held = set(deferred) | set(skipped)
+        signals.extend(s for s in prev if s["symbol"] in held)
+    rank = {sym: i for i, sym in enumerate(universe_symbols)}
+    signals.sort(key=lambda s: rank.get(s["symbol"], len(rank)))
+
+    scan_sec = time.monotonic() - started
+    budget_info = {
+        "budget_sec": budget,
+        "scan_sec": round(scan_sec, 2),
+        "processed": len(order) - len(deferred),
+        "total": len(order),
+        "deferred": deferred,
+        "health": dict(health.summary(), skipped=len(blocked)),
+    }
+    if sched is not None:
+        budget_info["tiers"] = {t: sum(1 for v in tiers.values() if v == t) for t in TIERS}
+        budget_info["skipped"] = len(skipped)
+        logger.info("Ярусы: hot %d, warm %d, cold %d | в цикле %d из %d (бюджет %d), пропущено до своей очереди %d",
+                    budget_info["tiers"]["hot"], budget_info["tiers"]["warm"], budget_info["tiers"]["cold"],
+                    len(order), len(universe_symbols), Settings.SCAN_SYMBOLS_BUDGET, len(skipped))
+    store.replace_deferred(deferred)
+    if deferred:
+        stale = [s for s in deferred if was_deferred.get(s, 0) >= 1]
+        logger.warning("Дедлайн цикла: обработано %d/%d за %.1f с (бюджет %.0f с), отложено %d: %s%s",
+                       budget_info["processed"], len(order), scan_sec, budget, len(deferred),
+                       ", ".join(deferred[:10]) + (" ..." if len(deferred) > 10 else ""),
+                       f" | повторно: {len(stale)}" if stale else "")
+    else:
+        logger.info("Скан: %d символов за %.1f с (бюджет %s)", len(order), scan_sec,
+                    f"{budget:.0f} с" if budget > 0 else "без ограничения")
+
+    # выпавшие из universe символы не держим в памяти
+    keep = set(universe_symbols)
+    for sym in candles.symbols():
+        if sym not in keep:
+            candles.drop(sym)
+    if sched is not None:
+        sched.forget(keep)
 
     # Сохраняем текущее состояние сигналов
     save_last_signals(data_dir, signals)
+    _store(data_dir).prune_cooldowns(datetime.now(timezone.utc))
 
+    if Settings.CORR_FILTER:
+        _update_correlation(logger, candles, universe_symbols, scan_tfs)
+
+    mem_info = _memory_info(candles, peak_reset)
+    logger.info("Память: RSS %s МБ, пик %s %s МБ | свечи %.1f МБ, символов %d, выселено %d%s",
+                mem_info["rss_mb"], "цикла" if peak_reset else "процесса", mem_info["peak_rss_mb"],
+                mem_info["candles_mb"], mem_info["candle_symbols"], mem_info["evictions"],
+                f" | воркеры: пик {mem_info['workers_peak_rss_mb']} МБ" if "workers_peak_rss_mb" in mem_info else "")
+
+    # Отчёты идут последними и не держат входы: начатые ордера дорабатывают параллельно
+    try:
+        write_cycle_outputs(logger, data_dir, universe_rows, signals, scan_tfs, trend_tfs,
+                            budget=budget_info, memory=mem_info)
+        if Settings.SHADOW_VARIANTS:
+            held = set(deferred) | set(skipped)
+            _run_shadow(logger, data_dir, candles, [s for s in universe_symbols if s not in held],
+                        signals, last_prices)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def _update_correlation(logger, candles: CandleStore, universe_symbols: List[str], scan_tfs: List[str]) -> None:
+    """Дописывает в матрицу корреляций бары, закрывшиеся с прошлого цикла (по свежим буферам)."""
+    if Settings.SHARD_WORKERS > 0:
+        return   # свечи живут в воркерах — матрицы в координаторе нет, фильтр не срабатывает
+    t0 = time.monotonic()
+    corr = get_correlation()
+    try:
+        added = corr.update_from_candles(candles, Settings.CORR_TF or scan_tfs[0], universe_symbols)
+    except Exception as e:
+        logger.warning("Корреляции: ошибка обновления: %s", e)
+        return
+    if added:
+        logger.info("Корреляции: +%d бар(ов) %s, %d символов за %.3f с",
+                    added, Settings.CORR_TF or scan_tfs[0], len(universe_symbols), time.monotonic() - t0)
+
+
+def _run_shadow(logger, data_dir: Path, candles: CandleStore, symbols: List[str], signals: List[Dict],
+                last_prices: Dict[str, float]) -> None:
+    """Теневые варианты стратегии по тем же буферам свечей: без ордеров и запросов к бирже."""
+    if Settings.SHARD_WORKERS > 0:
+        return   # свечи живут в воркерах
+    t0 = time.monotonic()
+    try:
+        perf = get_shadow_engine(data_dir).run(candles, symbols, signals, last_prices)
+    except Exception as e:
+        logger.warning("Теневые варианты: ошибка: %s", e)
+        return
+    for name, p in perf.items():
+        c = p["cycle"]
+        logger.info("Тень [%s]: сделок %d%s, PnL %+.2f%%%s | открыто %d (%+.2f%%) | цикл: сигналов %d, +%d/-%d",
+                    name, p["trades"], f" (win {p['win_rate_pct']:.0f}%)" if p["trades"] else "", p["pnl_pct"],
+                    f", ср. R {p['avg_r']:+.2f}" if p["trades"] else "", p["open"], p["open_pnl_pct"],
+                    c["signals"], c["opened"], c["closed"])
+    logger.info("Теневые варианты: %d за %.2f с", len(perf), time.monotonic() - t0)
+
+
+def _memory_info(candles: CandleStore, peak_reset: bool) -> Dict:
+    """RSS процесса и его пик за цикл (если ядро позволяет сбросить VmHWM), память буферов свечей."""
+    info = {
+        "low_memory": Settings.LOW_MEMORY,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_is_cycle": peak_reset,
+        "candles_mb": round(candles.nbytes() / 2 ** 20, 2),
+        "candle_symbols": len(candles.symbols()),
+        "evictions": candles.evictions,
+    }
+    if Settings.SHARD_WORKERS > 0:
+        # свечи живут в воркерах: их пик — с запуска воркера (сбрасывать чужой VmHWM не берёмся)
+        peaks = [peak_rss_mb(pid) for pid in get_shard_pool().pids()]
+        info["workers_peak_rss_mb"] = round(sum(p for p in peaks if p is not None), 1)
+    return info
+
+
+def write_cycle_outputs(logger, data_dir: Path, universe_rows: List[Dict], signals: List[Dict],
+                        scan_tfs: List[str], trend_tfs: List[str], budget: Optional[Dict] = None,
+                        memory: Optional[Dict] = None):
+    """Отчёт, файлы сигналов по ТФ, журнал итераций, история и Telegram."""
     # Отчёты / файлы / телега
     report_txt = build_report_txt(
         cycle_info={"top_n": Settings.TOP_N_BY_VOL,
                     "params": {
                         "WORK_TF": Settings.WORK_TF,
+                        "SCAN_TFS": ",".join(scan_tfs),
+                        "TREND_TFS": ",".join(trend_tfs) or "-",
+                        "TREND_FILTER": Settings.TREND_FILTER,
                         "EMA_FAST": Settings.EMA_FAST,
                         "EMA_SLOW": Settings.EMA_SLOW,
                         "RSI_LEN": Settings.RSI_LEN,
@@ -482,36 +1082,142 @@ def cycle_once(exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str)
                     }},
         universe=universe_rows
     )
-    rep_path = data_dir / "reports" / f"report_{Settings.WORK_TF}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.txt"
+    stamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M')
+    rep_path = data_dir / "reports" / f"report_{'-'.join(scan_tfs)}_{stamp}.txt"
     write_file(rep_path, report_txt)
     logger.info("Report saved: %s", rep_path)
 
-    sig_txt = build_signals_txt(Settings.WORK_TF, signals)
-    sig_path = data_dir / "signals" / f"signals_{Settings.WORK_TF}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.txt"
-    write_file(sig_path, sig_txt)
-    logger.info("Signals saved: %s", sig_path)
-
-    write_jsonl(data_dir / "logs" / "iterations.jsonl", {
+    # файлы, история и Telegram сигналов — по каждому ТФ отдельно, как раньше у отдельных процессов
+    sig_docs: List[Tuple[Path, str, List[Dict]]] = []
+    for tf in scan_tfs:
+        tf_sigs = [s for s in signals if s.get("tf") == tf]
+        sig_txt = build_signals_txt(tf, tf_sigs)
+        sig_path = data_dir / "signals" / f"signals_{tf}_{stamp}.txt"
+        write_file(sig_path, sig_txt)
+        logger.info("Signals saved: %s", sig_path)
+        sig_docs.append((sig_path, sig_txt, tf_sigs))
+
+    get_writer(data_dir / "logs" / "iterations.jsonl",
+               max_bytes=Settings.LOG_MAX_MB * 1024 * 1024,
+               rotate_daily=Settings.LOG_ROTATE_DAILY,
+               keep_files=Settings.LOG_KEEP_FILES).write({
         "ts": now_iso(),
         "signals": signals,
-        "universe": universe_symbols
+        "universe": [r["symbol"] for r in universe_rows],
+        "budget": budget,
+        "memory": memory,
     })
+    for tf in scan_tfs:
+        try:
+            get_history(data_dir, tf).append([s for s in signals if s.get("tf") == tf])
+        except Exception as e:
+            logger.warning("Signal history append error (%s): %s", tf, e)
 
+    # Telegram: один sendDocument из памяти на отчёт, отправка в фоне
     if Settings.TG_REPORT_BOT_TOKEN and Settings.TG_REPORT_CHAT_ID:
-        try:
-            send_text(Settings.TG_REPORT_BOT_TOKEN, Settings.TG_REPORT_CHAT_ID, "Report incoming…")
-            send_document(Settings.TG_REPORT_BOT_TOKEN, Settings.TG_REPORT_CHAT_ID,
-                          rep_path, caption="Pattern+Indicators report")
-        except TelegramError as te:
-            logger.error("Telegram REPORT error: %s", te)
+        get_dispatcher(logger).submit_document(Settings.TG_REPORT_BOT_TOKEN, Settings.TG_REPORT_CHAT_ID,
+                                               rep_path.name, report_txt,
+                                               caption="Pattern+Indicators report", announce="Report incoming…")
+
+    if Settings.TG_SIGNAL_BOT_TOKEN and Settings.TG_SIGNAL_CHAT_ID:
+        for sig_path, sig_txt, tf_sigs in sig_docs:
+            if tf_sigs:
+                get_dispatcher(logger).submit_document(Settings.TG_SIGNAL_BOT_TOKEN, Settings.TG_SIGNAL_CHAT_ID,
+                                                       sig_path.name, sig_txt,
+                                                       caption="Confirmed candle patterns", announce="Signals incoming…")
+
 
-    if signals and Settings.TG_SIGNAL_BOT_TOKEN and Settings.TG_SIGNAL_CHAT_ID:
+# =========================
+# Быстрый путь по тикерам
+# =========================
+class TickerFastPath:
+    """
+    Между полными сканами: один fetch_tickers на опрос вместо запроса свечей на символ.
+    Цена каждого символа с буфером дописывается в формирующуюся свечу; символы, сдвинувшиеся
+    на FAST_MOVE_PCT от цены последней оценки, переоцениваются по буферу. Новые сигналы
+    сразу сохраняются в снимок (следующий полный цикл не примет их за новые) и идут в торговлю.
+    """
+
+    def __init__(self):
+        self.ref: Dict[str, float] = {}   # symbol -> цена на момент последней оценки
+
+    def reset(self) -> None:
+        # после полного скана точка отсчёта — первый опрос
+        self.ref.clear()
+
+    def poll(self, exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str,
+             accounts: Optional[List[Account]] = None) -> int:
+        candles = candle_store(exchange)
+        syms = candles.symbols()
+        if not syms:
+            return 0
+        tickers = exchange.fetch_tickers()
+        now_ms = int(time.time() * 1000)
+        prices: Dict[str, float] = {}
+        moved: List[str] = []
+        for sym in syms:
+            last = (tickers.get(sym) or {}).get("last")
+            if not last or last <= 0:
+                continue
+            last = prices[sym] = float(last)
+            if not candles.patch(sym, last, now_ms):
+                continue
+            ref = self.ref.setdefault(sym, last)
+            if abs(last / ref - 1.0) * 100.0 >= Settings.FAST_MOVE_PCT:
+                moved.append(sym)
+        if not moved:
+            return 0
+
+        scan_tfs, trend_tfs = _scan_tfs(), parse_tfs(Settings.TREND_TFS)
+        prev = load_last_signals(data_dir)
+        prev_keys = {_signal_key(s) for s in prev}
+        fresh: List[Dict] = []
+        df_cache: Dict[Tuple[str, str], Bars] = {}
+        for sym in moved:
+            self.ref[sym] = prices[sym]
+            try:
+                sigs, frames = evaluate_symbol(candles, sym, scan_tfs, trend_tfs)
+            except Exception as e:
+                logger.warning("Быстрый путь: ошибка по %s: %s", sym, e)
+                continue
+            new = [sig for sig in sigs if _signal_key(sig) not in prev_keys]
+            if new:
+                fresh.extend(new)
+                df_cache.update(frames)
+        logger.info("Быстрый путь: сдвиг >= %.2f%% у %d из %d, новых сигналов %d%s",
+                    Settings.FAST_MOVE_PCT, len(moved), len(syms), len(fresh),
+                    (": " + ", ".join(f"{s['symbol']} {s['direction']} {s['tf']}" for s in fresh)) if fresh else "")
+        if not fresh:
+            return 0
+
+        trading = have_prev_signals_state(data_dir)
+        save_last_signals(data_dir, prev + fresh)
+        if not trading:
+            return len(fresh)
+        # весь буферизованный universe, а не только свежие сигналы: по этой карте открытые позиции
+        # переводятся обратно в ccxt-символы для фильтра корреляций
+        market_id_map = _market_id_map(exchange, syms + [s["symbol"] for s in fresh])
+        stream = trade_stream(accounts or [Account.default(bybit, pos_mode)], logger, data_dir, df_cache,
+                              market_id_map, last_prices=prices)
         try:
-            send_text(Settings.TG_SIGNAL_BOT_TOKEN, Settings.TG_SIGNAL_CHAT_ID, "Signals incoming…")
-            send_document(Settings.TG_SIGNAL_BOT_TOKEN, Settings.TG_SIGNAL_CHAT_ID,
-                          sig_path, caption="Confirmed candle patterns")
-        except TelegramError as te:
-            logger.error("Telegram SIGNAL error: %s", te)
+            for sig in fresh:
+                stream.offer(sig)
+        finally:
+            stream.close()
+        return len(fresh)
+
+    def run(self, exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str, until: float,
+            accounts: Optional[List[Account]] = None) -> None:
+        """Опросы до момента until (time.monotonic) — вместо сна между циклами."""
+        while True:
+            t0 = time.monotonic()
+            if t0 >= until:
+                return
+            try:
+                self.poll(exchange, logger, data_dir, bybit, pos_mode, accounts=accounts)
+            except Exception as e:
+                logger.warning("Быстрый путь: ошибка опроса тикеров: %s", e)
+            time.sleep(max(min(Settings.FAST_POLL_SEC - (time.monotonic() - t0), until - time.monotonic()), 0.0))
 
 
 # =========================
@@ -520,40 +1226,56 @@ def cycle_once(exchange, logger, data_dir: Path, bybit: BybitAPI, pos_mode: str)
 def main():
     data_dir = ensure_dirs(Settings.DATA_DIR)
     logger = setup_logger("vola-trend-bot")
+    get_dispatcher(logger, maxsize=Settings.TG_QUEUE_SIZE)
     exchange = build_exchange()   # ccxt для маркет-данных
-    bybit = BybitAPI()            # прямой Bybit v5 для торговли
-
-    # прогрев шагов цены/лота
-    try:
-        bybit.get_instruments()
-    except Exception as e:
-        logger.warning("Не удалось прогреть инструменты Bybit: %s", e)
-
-    # Режим позиций
-    pos_mode = bybit.get_position_mode()
-    try:
-        cfg = getattr(Settings, "BYBIT_POSITION_MODE", "auto").lower()
-        if cfg in ("oneway", "one-way", "one_way", "single"):
-            bybit.set_position_mode("ONE_WAY")
-            pos_mode = "ONE_WAY"
-        elif cfg in ("hedge", "both", "both_sides"):
-            bybit.set_position_mode("HEDGE")
-            pos_mode = "HEDGE"
-    except Exception as e:
-        logger.warning("Не удалось переключить режим позиций: %s (используем %s)", e, pos_mode)
-
-    logger.info("Режим позиций Bybit: %s", pos_mode)
+    # прямой Bybit v5 для торговли: аккаунты со своими ключами, режимом позиций и лимитами
+    accounts = load_accounts()
+    for i, acc in enumerate(accounts):
+        # сдвиг часов, справочник инструментов (общий для аккаунтов на одном base), приватный WS, режим позиций
+        setup_account(acc, logger,
+                      on_position_closed=lambda a, pos: _on_position_closed(logger, data_dir, pos, a.name),
+                      reference=accounts[0] if i else None)
+    bybit, pos_mode = accounts[0].bybit, accounts[0].pos_mode
+    if len(accounts) > 1:
+        logger.info("Аккаунтов: %d (%s) — один скан, входы по всем", len(accounts),
+                    ", ".join(a.name for a in accounts))
     logger.info("Старт: exchange=%s | market=%s | mode=%s | confirm=%s | RSI=%s EMA=%s MACD=%s",
                 Settings.EXCHANGE, Settings.MARKET_TYPE, Settings.RELAX_MODE, Settings.CONFIRM_MODE,
                 Settings.ENABLE_RSI, Settings.ENABLE_EMA, Settings.ENABLE_MACD)
+    logger.info("ТФ скана: %s | тренд: %s | базовый ТФ свечей: %s",
+                ",".join(_scan_tfs()), Settings.TREND_TFS or "-", candle_store().base_tf)
+    if Settings.SHARD_WORKERS > 0:
+        get_shard_pool(logger)
+        logger.info("Скан шардирован: %d процессов-воркеров (консистентный хеш символов)", Settings.SHARD_WORKERS)
+    elif Settings.COMPUTE_WORKERS > 0:
+        logger.info("Оценка символов в пуле процессов: %d воркеров, пачки до %d символов",
+                    Settings.COMPUTE_WORKERS, Settings.COMPUTE_CHUNK)
+    fast: Optional[TickerFastPath] = None
+    if Settings.SHADOW_VARIANTS:
+        if Settings.SHARD_WORKERS > 0:
+            logger.warning("SHADOW_VARIANTS не используются: при SHARD_WORKERS свечи живут в воркерах")
+        else:
+            logger.info("Теневые варианты: %s", ", ".join(get_shadow_engine(data_dir).books))
+    if Settings.FAST_PATH:
+        if Settings.SHARD_WORKERS > 0:
+            logger.warning("FAST_PATH выключен: при SHARD_WORKERS свечи живут в воркерах")
+        else:
+            fast = TickerFastPath()
+            logger.info("Быстрый путь по тикерам: опрос раз в %.0f с, порог сдвига %.2f%%",
+                        Settings.FAST_POLL_SEC, Settings.FAST_MOVE_PCT)
 
     while True:
         try:
-            cycle_once(exchange, logger, data_dir, bybit, pos_mode)
+            cycle_once(exchange, logger, data_dir, bybit, pos_mode, accounts=accounts)
         except Exception as e:
             logger.exception("Критическая ошибка цикла: %s", e)
         finally:
-            sleep_until_next_cycle(Settings.ITER_SECONDS)
+            if fast is not None:
+                fast.reset()
+                fast.run(exchange, logger, data_dir, bybit, pos_mode, until=time.monotonic() + Settings.ITER_SECONDS,
+                         accounts=accounts)
+            else:
+                sleep_until_next_cycle(Settings.ITER_SECONDS)
 
 
 if __name__ == "__main__":
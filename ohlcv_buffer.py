@@ -0,0 +1,191 @@
+# ohlcv_buffer.py — колоночный кольцевой буфер свечей на NumPy
+#
+# Колонки ts/open/high/low/close/volume лежат в непрерывных массивах фиксированной ёмкости.
+# Хранилище «зеркальное» (2 * capacity, каждая запись пишется дважды), поэтому последние
+# n баров — всегда непрерывный срез: окно отдаётся как view без копирования.
+# Формирующаяся свеча (тот же ts, что у последней) переписывается на месте.
+# compact=True (режим LOW_MEMORY): цены во float32, объём — int32 с десятичным масштабом
+# на буфер; 24 байта на бар вместо 48.
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ("ts", "open", "high", "low", "close", "volume")
+PRICE_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+class Bars:
+    """
+    Окно свечей: набор одномерных массивов одинаковой длины (обычно view в OHLCVRing).
+    bars["close"] -> np.ndarray; len(bars); bars.tail(n) — тоже view.
+    View живёт до следующего update() буфера — дольше цикла его не держим.
+    """
+
+    __slots__ = ("ts", "open", "high", "low", "close", "volume")
+
+    def __init__(self, ts: np.ndarray, open: np.ndarray, high: np.ndarray, low: np.ndarray,
+                 close: np.ndarray, volume: np.ndarray):
+        self.ts = ts
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return getattr(self, name)
+
+    def tail(self, n: int) -> "Bars":
+        if n >= len(self):
+            return self
+        return Bars(*(getattr(self, c)[-n:] for c in COLUMNS))
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def copy(self) -> "Bars":
+        return Bars(*(np.array(getattr(self, c)) for c in COLUMNS))
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame только там, где нужен pandas (ts — datetime64)."""
+        return pd.DataFrame({
+            "ts": pd.to_datetime(self.ts, unit="ms"),
+            "open": self.open, "high": self.high, "low": self.low,
+            "close": self.close, "volume": self.volume,
+        })
+
+    def rows(self) -> list:
+        """[[ts, o, h, l, c, v], ...] — формат ccxt fetch_ohlcv."""
+        return [[int(t), o, h, l, c, v] for t, o, h, l, c, v in zip(
+            self.ts.tolist(), self.open.tolist(), self.high.tolist(), self.low.tolist(),
+            self.close.tolist(), self.volume.tolist())]
+
+    def __getstate__(self):
+        return tuple(np.ascontiguousarray(getattr(self, c)) for c in COLUMNS)
+
+    def __setstate__(self, state):
+        for c, arr in zip(COLUMNS, state):
+            setattr(self, c, arr)
+
+
+def as_bars(data) -> Bars:
+    """Bars из Bars/DataFrame (ts — datetime64 или ms)/списка строк ccxt."""
+    if isinstance(data, Bars):
+        return data
+    if isinstance(data, pd.DataFrame):
+        ts = data["ts"] if "ts" in data else pd.Series(np.zeros(len(data), dtype=np.int64))
+        if np.issubdtype(ts.dtype, np.datetime64):
+            ts = (ts - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+        return Bars(np.asarray(ts, dtype=np.int64),
+                    *(data[c].to_numpy(dtype=np.float64) for c in PRICE_COLUMNS))
+    arr = np.asarray(list(data), dtype=np.float64).reshape(-1, 6)
+    return Bars(arr[:, 0].astype(np.int64), *(np.ascontiguousarray(arr[:, i]) for i in range(1, 6)))
+
+
+_INT32_MAX = 2 ** 31 - 1
+
+
+class OHLCVRing:
+    """Буфер фиксированной ёмкости: append на месте, окно последних n баров — view."""
+
+    def __init__(self, capacity: int, compact: bool = False):
+        self.capacity = int(capacity)
+        self.compact = compact
+        price_dtype = np.float32 if compact else np.float64
+        dtypes = {"ts": np.int64, "volume": np.int32 if compact else np.float64}
+        self._cols: Dict[str, np.ndarray] = {
+            c: np.zeros(2 * self.capacity, dtype=dtypes.get(c, price_dtype)) for c in COLUMNS
+        }
+        self._w = 0        # позиция следующей записи в [0, capacity)
+        self._size = 0
+        self.vol_scale = 0.0   # compact: объём = int * vol_scale (0 — ещё не выбран)
+        self.version = 0   # растёт при каждом изменении (для кэшей производных ТФ)
+
+    def _quantize_volume(self, v: np.ndarray) -> np.ndarray:
+        v = np.nan_to_num(np.asarray(v, dtype=np.float64))
+        vmax = float(np.abs(v).max()) if len(v) else 0.0
+        if self.vol_scale <= 0:
+            # ~8 значащих цифр с запасом x20 до переполнения int32
+            self.vol_scale = 10.0 ** (int(np.ceil(np.log10(vmax))) - 8) if vmax > 0 else 1.0
+        while vmax / self.vol_scale > _INT32_MAX:
+            # объём вырос за диапазон — огрубляем уже записанное в 10 раз
+            vol = self._cols["volume"]
+            vol[:] = np.rint(vol / 10.0).astype(np.int32)
+            self.vol_scale *= 10.0
+        return np.rint(v / self.vol_scale).astype(np.int32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        if not self._size:
+            return None
+        return int(self._cols["ts"][self._w + self.capacity - 1])
+
+    def _put(self, pos: int, row: Dict[str, np.ndarray], lo: int, hi: int) -> None:
+        # одна непрерывная порция [lo, hi) строк в позиции pos и её зеркало
+        n = hi - lo
+        for c, arr in self._cols.items():
+            arr[pos:pos + n] = row[c][lo:hi]
+            arr[pos + self.capacity:pos + self.capacity + n] = row[c][lo:hi]
+
+    def extend(self, rows: Iterable) -> int:
+        """
+        Дописывает строки ccxt (отсортированные по ts). Строка с ts последнего бара
+        обновляет его на месте, более старые игнорируются. Возвращает число новых баров.
+        """
+        b = as_bars(rows)
+        if not len(b):
+            return 0
+        last = self.last_ts
+        cols = {c: getattr(b, c) for c in COLUMNS}
+        start = 0
+        if last is not None:
+            keep = b.ts >= last
+            if not keep.all():
+                cols = {c: v[keep] for c, v in cols.items()}
+            if not len(cols["ts"]):
+                return 0
+        if self.compact:
+            cols = dict(cols, volume=self._quantize_volume(cols["volume"]))
+        if last is not None:
+            if cols["ts"][0] == last:
+                p = (self._w - 1) % self.capacity
+                self._put(p, cols, 0, 1)
+                start = 1
+        n = len(cols["ts"]) - start
+        if n > self.capacity:
+            start += n - self.capacity
+            n = self.capacity
+        i = start
+        while i < start + n:
+            chunk = min(self.capacity - self._w, start + n - i)
+            self._put(self._w, cols, i, i + chunk)
+            self._w = (self._w + chunk) % self.capacity
+            i += chunk
+        self._size = min(self._size + n, self.capacity)
+        self.version += 1
+        return n
+
+    def view(self, n: Optional[int] = None) -> Bars:
+        n = self._size if n is None else min(int(n), self._size)
+        end = self._w + self.capacity
+        cols = [self._cols[c][end - n:end] for c in COLUMNS]
+        if self.compact:
+            cols[-1] = cols[-1] * self.vol_scale   # объём — единственная колонка с копией
+        return Bars(*cols)
+
+    def clear(self) -> None:
+        self._w = 0
+        self._size = 0
+        self.version += 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self._cols.values())
@@ -15,7 +15,8 @@
 
 import os
 from typing import Optional, Dict, Callable
-import pandas as pd
+
+from ohlcv_buffer import Bars, as_bars
 
 # ===== helpers: env =====
 def _env_float(name, default):
@@ -70,12 +71,15 @@ def body(o, c): return abs(c - o)
 def upper_wick(h, o, c): return h - max(o, c)
 def lower_wick(l, o, c): return min(o, c) - l
 
-def price_tol(df: pd.DataFrame) -> float:
-    p = float(df["close"].iloc[-1])
+def price_tol(df: Bars) -> float:
+    p = float(df["close"][-1])
     return max(p * TOL_PCT, 1e-9)
 
-def avg_body(df: pd.DataFrame, n: int = AVG_N) -> float:
-    return float(body(df["open"], df["close"]).rolling(n).mean().iloc[-1])
+def avg_body(df: Bars, n: int = AVG_N) -> float:
+    # как rolling(n).mean() на последней свече: окно короче n -> NaN (условия с ab не проходят)
+    if len(df) < n:
+        return float("nan")
+    return float(body(df["open"][-n:], df["close"][-n:]).mean())
 
 def wick_fracs(h, l, o, c):
     b = body(o, c)
@@ -89,162 +93,182 @@ def near_or_above(x, y, tol):  # x >= y - tol
     return x >= y - tol
 
 # ====== 2-свечные из базового набора ======
-def bullish_engulfing(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bullish_engulfing(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1, h1, l1 = df["open"].iat[-2], df["close"].iat[-2], df["high"].iat[-2], df["low"].iat[-2]
-    o2, c2, h2, l2 = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o1, c1, h1, l1 = df["open"][-2], df["close"][-2], df["high"][-2], df["low"][-2]
+    o2, c2, h2, l2 = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     tol = price_tol(df); ab = avg_body(df)
     cond = bear(o1, c1) and bull(o2, c2) and near_or_below(o2, c1, tol) and near_or_above(c2, o1, tol)
     up2, lo2 = wick_fracs(h2, l2, o2, c2)
     cond = cond and (body(o2, c2) >= STRONG_BODY_FRAC * ab) and (up2 <= MAX_UPPER_WICK_FRAC) and (lo2 <= MAX_LOWER_WICK_FRAC)
     return bool(cond)
 
-def bearish_engulfing(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bearish_engulfing(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1, h1, l1 = df["open"].iat[-2], df["close"].iat[-2], df["high"].iat[-2], df["low"].iat[-2]
-    o2, c2, h2, l2 = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o1, c1, h1, l1 = df["open"][-2], df["close"][-2], df["high"][-2], df["low"][-2]
+    o2, c2, h2, l2 = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     tol = price_tol(df); ab = avg_body(df)
     cond = bull(o1, c1) and bear(o2, c2) and near_or_above(o2, c1, tol) and near_or_below(c2, o1, tol)
     up2, lo2 = wick_fracs(h2, l2, o2, c2)
     cond = cond and (body(o2, c2) >= STRONG_BODY_FRAC * ab) and (up2 <= MAX_UPPER_WICK_FRAC) and (lo2 <= MAX_LOWER_WICK_FRAC)
     return bool(cond)
 
-def piercing_line(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def piercing_line(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df); tol = price_tol(df)
     mid = (o1 + c1) / 2.0
     cond = bear(o1, c1) and bull(o2, c2) and near_or_below(o2, c1, tol) and (c2 > mid)
     cond = cond and (body(o2, c2) >= 0.5 * ab)
     return bool(cond)
 
-def dark_cloud_cover(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def dark_cloud_cover(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df); tol = price_tol(df)
     mid = (o1 + c1) / 2.0
     cond = bull(o1, c1) and bear(o2, c2) and near_or_above(o2, c1, tol) and (c2 < mid)
     cond = cond and (body(o2, c2) >= 0.5 * ab)
     return bool(cond)
 
-def bullish_harami(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bullish_harami(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     inside = (min(o2, c2) > min(o1, c1)) and (max(o2, c2) < max(o1, c1))
     return bool(bear(o1, c1) and inside and (body(o2, c2) <= SMALL_BODY_FRAC * ab))
 
-def bearish_harami(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bearish_harami(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     inside = (min(o2, c2) > min(o1, c1)) and (max(o2, c2) < max(o1, c1))
     return bool(bull(o1, c1) and inside and (body(o2, c2) <= SMALL_BODY_FRAC * ab))
 
-def tweezer_bottom(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def tweezer_bottom(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    l1, l2 = df["low"].iat[-2], df["low"].iat[-1]
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    l1, l2 = df["low"][-2], df["low"][-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     tol = price_tol(df)
     return bool(abs(l1 - l2) <= tol and bear(o1, c1) and bull(o2, c2))
 
-def tweezer_top(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def tweezer_top(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    h1, h2 = df["high"].iat[-2], df["high"].iat[-1]
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    h1, h2 = df["high"][-2], df["high"][-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     tol = price_tol(df)
     return bool(abs(h1 - h2) <= tol and bull(o1, c1) and bear(o2, c2))
 
-def bullish_kicker(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bullish_kicker(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     return bool(bear(o1, c1) and bull(o2, c2) and (body(o2, c2) >= STRONG_BODY_FRAC * ab) and (c2 > o1))
 
-def bearish_kicker(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bearish_kicker(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     return bool(bull(o1, c1) and bear(o2, c2) and (body(o2, c2) >= STRONG_BODY_FRAC * ab) and (c2 < o1))
 
 # ====== 3-свечные и подтверждения из базового набора ======
-def morning_star(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def morning_star(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
-    o3, c3 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
+    o3, c3 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     return bool(bear(o1, c1) and (body(o2, c2) <= SMALL_BODY_FRAC * ab) and bull(o3, c3) and (c3 > (o1 + c1) / 2))
 
-def evening_star(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def evening_star(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
-    o3, c3 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
+    o3, c3 = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     return bool(bull(o1, c1) and (body(o2, c2) <= SMALL_BODY_FRAC * ab) and bear(o3, c3) and (c3 < (o1 + c1) / 2))
 
-def three_white_soldiers(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_white_soldiers(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
     o, c = df["open"], df["close"]
-    return bool(bull(o.iat[-3], c.iat[-3]) and bull(o.iat[-2], c.iat[-2]) and bull(o.iat[-1], c.iat[-1])
-                and (c.iat[-1] > c.iat[-2] > c.iat[-3]))
+    return bool(bull(o[-3], c[-3]) and bull(o[-2], c[-2]) and bull(o[-1], c[-1])
+                and (c[-1] > c[-2] > c[-3]))
 
-def three_black_crows(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_black_crows(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
     o, c = df["open"], df["close"]
-    return bool(bear(o.iat[-3], c.iat[-3]) and bear(o.iat[-2], c.iat[-2]) and bear(o.iat[-1], c.iat[-1])
-                and (c.iat[-1] < c.iat[-2] < c.iat[-3]))
+    return bool(bear(o[-3], c[-3]) and bear(o[-2], c[-2]) and bear(o[-1], c[-1])
+                and (c[-1] < c[-2] < c[-3]))
 
-def three_line_strike_bull(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_line_strike_bull(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 4: return False
     o, c = df["open"], df["close"]
-    return bool(bull(o.iat[-4], c.iat[-4]) and bull(o.iat[-3], c.iat[-3]) and bull(o.iat[-2], c.iat[-2])
-                and bear(o.iat[-1], c.iat[-1]) and (c.iat[-1] < o.iat[-4]) and (o.iat[-1] > c.iat[-2]))
+    return bool(bull(o[-4], c[-4]) and bull(o[-3], c[-3]) and bull(o[-2], c[-2])
+                and bear(o[-1], c[-1]) and (c[-1] < o[-4]) and (o[-1] > c[-2]))
 
-def three_line_strike_bear(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_line_strike_bear(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 4: return False
     o, c = df["open"], df["close"]
-    return bool(bear(o.iat[-4], c.iat[-4]) and bear(o.iat[-3], c.iat[-3]) and bear(o.iat[-2], c.iat[-2])
-                and bull(o.iat[-1], c.iat[-1]) and (c.iat[-1] > o.iat[-4]) and (o.iat[-1] < c.iat[-2]))
+    return bool(bear(o[-4], c[-4]) and bear(o[-3], c[-3]) and bear(o[-2], c[-2])
+                and bull(o[-1], c[-1]) and (c[-1] > o[-4]) and (o[-1] < c[-2]))
 
-def three_inside_up(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_inside_up(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
-    o3, c3 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
+    o3, c3 = df["open"][-1], df["close"][-1]
     harami = (c1 < o1) and (min(o2, c2) > min(o1, c1)) and (max(o2, c2) < max(o1, c1))
     return bool(harami and bull(o3, c3) and (c3 > c2))
 
-def three_inside_down(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_inside_down(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
-    o3, c3 = df["open"].iat[-1], df["close"].iat[-1]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
+    o3, c3 = df["open"][-1], df["close"][-1]
     harami = (c1 > o1) and (min(o2, c2) > min(o1, c1)) and (max(o2, c2) < max(o1, c1))
     return bool(harami and bear(o3, c3) and (c3 < c2))
 
-def three_outside_up(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_outside_up(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
     engulf = (c1 < o1) and (c2 > o2) and (o2 <= c1) and (c2 >= o1)
-    return bool(engulf and bull(df["open"].iat[-1], df["close"].iat[-1]))
+    return bool(engulf and bull(df["open"][-1], df["close"][-1]))
 
-def three_outside_down(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def three_outside_down(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 3: return False
-    o1, c1 = df["open"].iat[-3], df["close"].iat[-3]
-    o2, c2 = df["open"].iat[-2], df["close"].iat[-2]
+    o1, c1 = df["open"][-3], df["close"][-3]
+    o2, c2 = df["open"][-2], df["close"][-2]
     engulf = (c1 > o1) and (c2 < o2) and (o2 >= c1) and (c2 <= o1)
-    return bool(engulf and bear(df["open"].iat[-1], df["close"].iat[-1]))
+    return bool(engulf and bear(df["open"][-1], df["close"][-1]))
 
 # ===== НОВЫЕ ОДНОСВЕЧНЫЕ =====
 def is_doji(o, c, ab) -> bool:
@@ -254,102 +278,115 @@ def is_marubozu(h, l, o, c, tol) -> bool:
     # Почти без теней
     return (upper_wick(h, o, c) <= tol) and (lower_wick(l, o, c) <= tol)
 
-def hammer(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def hammer(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     # маленькое тело вверху диапазона + длинная нижняя тень
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df); tol = price_tol(df)
     up, lo = wick_fracs(h, l, o, c)
     return bool((body(o, c) <= SMALL_BODY_FRAC * ab) and (lo >= LONG_WICK_FRAC) and (upper_wick(h, o, c) <= MAX_UPPER_WICK_FRAC * max(body(o, c), tol)))
 
-def inverted_hammer(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def inverted_hammer(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df); tol = price_tol(df)
     up, lo = wick_fracs(h, l, o, c)
     return bool((body(o, c) <= SMALL_BODY_FRAC * ab) and (up >= LONG_WICK_FRAC) and (lower_wick(l, o, c) <= MAX_LOWER_WICK_FRAC * max(body(o, c), tol)))
 
-def hanging_man(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def hanging_man(df: Bars, trend_hint: Optional[str] = None) -> bool:
     # как hammer, но встречается после роста — контекст мы не проверяем, только форма
     return hammer(df)
 
-def shooting_star(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def shooting_star(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     # маленькое тело внизу + длинная верхняя тень
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df); tol = price_tol(df)
     up, lo = wick_fracs(h, l, o, c)
     return bool((body(o, c) <= SMALL_BODY_FRAC * ab) and (up >= LONG_WICK_FRAC) and (lower_wick(l, o, c) <= MAX_LOWER_WICK_FRAC * max(body(o, c), tol)))
 
-def doji(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def doji(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c = df["open"].iat[-1], df["close"].iat[-1]
+    o, c = df["open"][-1], df["close"][-1]
     ab = avg_body(df)
     return bool(is_doji(o, c, ab))
 
-def dragonfly_doji(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def dragonfly_doji(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df); tol = price_tol(df)
     # close≈open≈high, длинная нижняя тень
     return bool(is_doji(o, c, ab) and (abs(h - max(o, c)) <= tol) and (lower_wick(l, o, c) >= LONG_WICK_FRAC * max(body(o, c), tol)))
 
-def gravestone_doji(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def gravestone_doji(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df); tol = price_tol(df)
     # close≈open≈low, длинная верхняя тень
     return bool(is_doji(o, c, ab) and (abs(l - min(o, c)) <= tol) and (upper_wick(h, o, c) >= LONG_WICK_FRAC * max(body(o, c), tol)))
 
-def bullish_marubozu(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bullish_marubozu(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     tol = price_tol(df)
     return bool(bull(o, c) and is_marubozu(h, l, o, c, tol))
 
-def bearish_marubozu(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def bearish_marubozu(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 1: return False
-    o, c, h, l = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o, c, h, l = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     tol = price_tol(df)
     return bool(bear(o, c) and is_marubozu(h, l, o, c, tol))
 
 # ===== НОВЫЕ ДВУХСВЕЧНЫЕ =====
-def doji_star_bullish(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def doji_star_bullish(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     # сильная медвежья, затем doji
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2, h2, l2 = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2, h2, l2 = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df)
     return bool(bear(o1, c1) and is_doji(o2, c2, ab))
 
-def doji_star_bearish(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def doji_star_bearish(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     if len(df) < 2: return False
-    o1, c1 = df["open"].iat[-2], df["close"].iat[-2]
-    o2, c2, h2, l2 = df["open"].iat[-1], df["close"].iat[-1], df["high"].iat[-1], df["low"].iat[-1]
+    o1, c1 = df["open"][-2], df["close"][-2]
+    o2, c2, h2, l2 = df["open"][-1], df["close"][-1], df["high"][-1], df["low"][-1]
     ab = avg_body(df)
     return bool(bull(o1, c1) and is_doji(o2, c2, ab))
 
-def matching_high(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def matching_high(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     # два одинаковых close подряд (уровень сопротивления)
     if len(df) < 2: return False
-    c1, c2 = df["close"].iat[-2], df["close"].iat[-1]
+    c1, c2 = df["close"][-2], df["close"][-1]
     tol = price_tol(df)
     return bool(abs(c1 - c2) <= tol)
 
-def matching_low(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def matching_low(df: Bars, trend_hint: Optional[str] = None) -> bool:
+    df = as_bars(df)
     # два одинаковых close подряд (уровень поддержки)
     if len(df) < 2: return False
-    c1, c2 = df["close"].iat[-2], df["close"].iat[-1]
+    c1, c2 = df["close"][-2], df["close"][-1]
     tol = price_tol(df)
     return bool(abs(c1 - c2) <= tol)
 
 # ===== НОВЫЕ ТРЁХСВЕЧНЫЕ (CONTINUATION) =====
-def rising_three_methods(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def rising_three_methods(df: Bars, trend_hint: Optional[str] = None) -> bool:
     """
     1: сильная бычья
     2..n: маленькие (обычно 3) свечи отката, тела и экстремумы остаются внутри диапазона 1-й
     последняя: бычья с закрытием выше close 1-й.
     """
+    df = as_bars(df)
     n = len(df)
     if n < 5:  # типично 5, но допустим >=5
         return False
@@ -367,31 +404,32 @@ def rising_three_methods(df: pd.DataFrame, trend_hint: Optional[str] = None) ->
     found = False
     for i in range(n - 5, n - 3):
         if i < 0: continue
-        if bull(o.iat[i], c.iat[i]) and (body(o.iat[i], c.iat[i]) >= STRONG_BODY_FRAC * ab):
+        if bull(o[i], c[i]) and (body(o[i], c[i]) >= STRONG_BODY_FRAC * ab):
             i0 = i
             found = True
             break
     if not found:
         return False
 
-    hi0, lo0 = h.iat[i0], l.iat[i0]
+    hi0, lo0 = h[i0], l[i0]
     # Свечи внутри диапазона 1-й (минимум METHODS_MIN_INSIDE штук)
     inside_cnt = 0
     last_idx = None
     for j in range(i0 + 1, n - 1):
-        if (min(o.iat[j], c.iat[j]) >= lo0) and (max(o.iat[j], c.iat[j]) <= hi0):
+        if (min(o[j], c[j]) >= lo0) and (max(o[j], c[j]) <= hi0):
             inside_cnt += 1
             last_idx = j
     if inside_cnt < METHODS_MIN_INSIDE:
         return False
 
     # Последняя свеча бычья, закрытие выше close первой
-    return bool(bull(o.iat[-1], c.iat[-1]) and (c.iat[-1] > c.iat[i0]))
+    return bool(bull(o[-1], c[-1]) and (c[-1] > c[i0]))
 
-def falling_three_methods(df: pd.DataFrame, trend_hint: Optional[str] = None) -> bool:
+def falling_three_methods(df: Bars, trend_hint: Optional[str] = None) -> bool:
     """
     Обратный вариант для падения.
     """
+    df = as_bars(df)
     n = len(df)
     if n < 5:
         return False
@@ -407,22 +445,22 @@ def falling_three_methods(df: pd.DataFrame, trend_hint: Optional[str] = None) ->
     found = False
     for i in range(n - 5, n - 3):
         if i < 0: continue
-        if bear(o.iat[i], c.iat[i]) and (body(o.iat[i], c.iat[i]) >= STRONG_BODY_FRAC * ab):
+        if bear(o[i], c[i]) and (body(o[i], c[i]) >= STRONG_BODY_FRAC * ab):
             i0 = i
             found = True
             break
     if not found:
         return False
 
-    hi0, lo0 = h.iat[i0], l.iat[i0]
+    hi0, lo0 = h[i0], l[i0]
     inside_cnt = 0
     for j in range(i0 + 1, n - 1):
-        if (min(o.iat[j], c.iat[j]) >= lo0) and (max(o.iat[j], c.iat[j]) <= hi0):
+        if (min(o[j], c[j]) >= lo0) and (max(o[j], c[j]) <= hi0):
             inside_cnt += 1
     if inside_cnt < METHODS_MIN_INSIDE:
         return False
 
-    return bool(bear(o.iat[-1], c.iat[-1]) and (c.iat[-1] < c.iat[i0]))
+    return bool(bear(o[-1], c[-1]) and (c[-1] < c[i0]))
 
 # ===== РЕЕСТРЫ =====
 BULL_PATTERNS: Dict[str, Callable] = {
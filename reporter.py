@@ -9,6 +9,9 @@ def build_params_table(params: Dict) -> str:
     lines = ["PARAMS", "-" * 48]
     ordered = [
         ("WORK_TF", params.get("WORK_TF")),
+        ("SCAN_TFS", params.get("SCAN_TFS")),
+        ("TREND_TFS", params.get("TREND_TFS")),
+        ("TREND_FILTER", params.get("TREND_FILTER")),
         ("EMA_FAST", params.get("EMA_FAST")),
         ("EMA_SLOW", params.get("EMA_SLOW")),
         ("RSI_LEN", params.get("RSI_LEN")),
@@ -46,7 +49,8 @@ def build_signals_txt(work_tf: str, items: List[Dict]) -> str:
         pats = ", ".join(it["patterns"])
         checks = it.get("checks", {})
         flags = ", ".join([f"{k}={str(v)}" for k, v in checks.items()]) if checks else "no-indicators"
-        lines.append(f"{i:02d}. {it['symbol']:>12s} | {it['direction']} | RSI={it['rsi']:.1f} | {flags} | {pats}")
+        trend = f" | trend={it['trend']}" if it.get("trend") else ""
+        lines.append(f"{i:02d}. {it['symbol']:>12s} | {it['direction']} | RSI={it['rsi']:.1f} | {flags} | {pats}{trend}")
     if len(items)==0:
         lines.append("(no signals)")
     return "\n".join(lines)
@@ -1,9 +1,38 @@
+import contextvars
 import os
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class Settings:
+# Переопределения настроек в пределах контекста (теневые варианты стратегии, shadow.py):
+# видны только коду, выполняемому в этом контексте, — потоки скана и торговли их не видят.
+# Хук на чтение атрибутов ставится, только если заданы SHADOW_VARIANTS: без них Settings —
+# обычный класс и чтение Settings.* на горячем пути скана ничего не стоит
+_overrides: contextvars.ContextVar = contextvars.ContextVar("settings_overrides", default=None)
+
+
+class _SettingsMeta(type):
+    def __getattribute__(cls, name):
+        ov = _overrides.get()
+        if ov and name in ov:
+            return ov[name]
+        return type.__getattribute__(cls, name)
+
+
+@contextmanager
+def overridden(**values):
+    """with overridden(RELAX_MODE="relaxed"): ... — Settings.* с подменёнными значениями."""
+    if type(Settings) is not _SettingsMeta:
+        raise RuntimeError("переопределение Settings доступно только при заданных SHADOW_VARIANTS")
+    token = _overrides.set({**(_overrides.get() or {}), **values})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+class Settings(metaclass=_SettingsMeta if os.getenv("SHADOW_VARIANTS") else type):
     EXCHANGE      = os.getenv("EXCHANGE", "bybit")
     MARKET_TYPE   = os.getenv("MARKET_TYPE", "swap")   # 'spot' | 'swap'
     QUOTE         = os.getenv("QUOTE", "USDT")
@@ -12,6 +41,32 @@ class Settings:
     WORK_TF       = os.getenv("WORK_TF", "1h")
     VOL_TF        = os.getenv("VOL_TF", "1d")          # для отчёта
 
+    # Мультитаймфрейм в одном процессе: "1h,4h" — сигналы по каждому ТФ;
+    # свечи качаются один раз в наименьшем ТФ, старшие строятся ресемплингом
+    SCAN_TFS      = os.getenv("SCAN_TFS", WORK_TF)
+    TREND_TFS     = os.getenv("TREND_TFS", "")         # напр. "4h,1d" — тренд classify_trend/combine_trends
+    TREND_FILTER  = os.getenv("TREND_FILTER", "false").lower() == "true"  # пропускать только сигналы по тренду
+    SCAN_BARS     = int(os.getenv("SCAN_BARS", 300))   # окно расчёта паттернов/индикаторов на каждом ТФ
+    CANDLE_CAPACITY = int(os.getenv("CANDLE_CAPACITY", 1500))  # баров базового ТФ в памяти на символ
+    # Конвейер скана: столько символов качаются/оцениваются одновременно
+    SCAN_WORKERS  = int(os.getenv("SCAN_WORKERS", 4))
+    # Шардирование скана по процессам-воркерам (консистентный хеш символов); 0 — скан в этом процессе.
+    # Торговля и слоты позиций остаются в координаторе
+    SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 0))
+    # Оценка паттернов/индикаторов в пуле процессов (compute.py): загрузка — в потоках скана,
+    # расчёт — в COMPUTE_WORKERS процессах пачками до COMPUTE_CHUNK символов через shared_memory.
+    # 0 — оценка в потоках скана. С SHARD_WORKERS не используется (воркеры шардов и так процессы)
+    COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", 0))
+    COMPUTE_CHUNK = int(os.getenv("COMPUTE_CHUNK", 16))
+    # Общий кэш-демон свечей/тикеров на хосте (python candle_cache.py); пусто — прямой ccxt
+    CANDLE_CACHE_SOCKET = os.getenv("CANDLE_CACHE_SOCKET", "")
+    CANDLE_CACHE_TTL = float(os.getenv("CANDLE_CACHE_TTL", 30))
+    # Экономия памяти для больших universe: цены float32, объём — масштабированный int32,
+    # в буфере только окно, нужное скану/тренду/фильтру аномалий (не больше CANDLE_CAPACITY).
+    # CANDLE_MEM_LIMIT_MB > 0 — потолок памяти буферов свечей, сверх него холодные символы выселяются (LRU)
+    LOW_MEMORY    = os.getenv("LOW_MEMORY", "false").lower() == "true"
+    CANDLE_MEM_LIMIT_MB = float(os.getenv("CANDLE_MEM_LIMIT_MB", 0))
+
     # Индикаторы
     RSI_LEN       = int(os.getenv("RSI_LEN", 14))
     RSI_OVERBOUGHT= float(os.getenv("RSI_OVERBOUGHT", 70))   # normal-mode
@@ -28,6 +83,22 @@ class Settings:
 
     # Топ по суточной волатильности (через tickers)
     TOP_N_BY_VOL  = int(os.getenv("TOP_N_BY_VOL", 100))
+    # Отбор universe (universe.py): символ выбывает из топа только ниже ранга K*(1+UNIVERSE_HYSTERESIS);
+    # UNIVERSE_RANK: range — суточный диапазон тикера, stdev/atr — реализованная волатильность
+    # последних UNIVERSE_RV_BARS баров базового ТФ из буфера свечей
+    UNIVERSE_HYSTERESIS = float(os.getenv("UNIVERSE_HYSTERESIS", 0.2))
+    UNIVERSE_RANK = os.getenv("UNIVERSE_RANK", "range").lower()
+    UNIVERSE_RV_BARS = int(os.getenv("UNIVERSE_RV_BARS", 24))
+    # Ярусный скан всего universe (tiers.py): hot каждый цикл, warm/cold — реже.
+    # Ярусы — по рангу волатильности; открытые позиции и свежие сигналы всегда hot.
+    # SCAN_SYMBOLS_BUDGET — символов (запросов свечей) за цикл, по умолчанию как у TOP_N_BY_VOL
+    TIERED_SCAN   = os.getenv("TIERED_SCAN", "false").lower() == "true"
+    UNIVERSE_MAX  = int(os.getenv("UNIVERSE_MAX", 0))   # 0 — все подходящие символы
+    SCAN_HOT_N    = int(os.getenv("SCAN_HOT_N", 50))
+    SCAN_WARM_N   = int(os.getenv("SCAN_WARM_N", 150))
+    SCAN_WARM_EVERY = int(os.getenv("SCAN_WARM_EVERY", 4))
+    SCAN_COLD_EVERY = int(os.getenv("SCAN_COLD_EVERY", 24))
+    SCAN_SYMBOLS_BUDGET = int(os.getenv("SCAN_SYMBOLS_BUDGET", TOP_N_BY_VOL))
 
     # Режим строгости паттернов/порогов: normal | relaxed | debug
     RELAX_MODE    = os.getenv("RELAX_MODE", "debug").lower()
@@ -43,6 +114,16 @@ class Settings:
 
     # Периодичность
     ITER_SECONDS  = int(os.getenv("ITER_SECONDS", 1800))
+    # Бюджет времени цикла (сек): по дедлайну недокачанные символы откладываются на следующий цикл.
+    # 0 — без ограничения. CYCLE_RESERVE_SEC — запас под отчёты и дозавершение входов.
+    CYCLE_BUDGET_SEC  = float(os.getenv("CYCLE_BUDGET_SEC", ITER_SECONDS * 0.8))
+    CYCLE_RESERVE_SEC = float(os.getenv("CYCLE_RESERVE_SEC", 15))
+    # Быстрый путь между полными сканами: раз в FAST_POLL_SEC один fetch_tickers на весь universe,
+    # last дописывается в формирующуюся свечу, символы со сдвигом цены >= FAST_MOVE_PCT
+    # (от прошлой оценки) переоцениваются без загрузки свечей. С SHARD_WORKERS не работает
+    FAST_PATH     = os.getenv("FAST_PATH", "false").lower() == "true"
+    FAST_POLL_SEC = float(os.getenv("FAST_POLL_SEC", 10))
+    FAST_MOVE_PCT = float(os.getenv("FAST_MOVE_PCT", 0.5))
 
     # Telegram
     TG_REPORT_BOT_TOKEN = os.getenv("TG_REPORT_BOT_TOKEN", "")
@@ -52,6 +133,14 @@ class Settings:
 
     # Директория данных
     DATA_DIR = os.getenv("DATA_DIR", "./data")
+    # Докачка истории (python backfill.py): база свечей (пусто — DATA_DIR/candles/candles.db), потоков
+    BACKFILL_DB = os.getenv("BACKFILL_DB", "")
+    BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", 4))
+
+    # Журнал итераций (data/logs/iterations.jsonl): ротация по размеру (МБ) и/или по дню, gzip
+    LOG_MAX_MB = int(os.getenv("LOG_MAX_MB", 50))
+    LOG_ROTATE_DAILY = os.getenv("LOG_ROTATE_DAILY", "true").lower() == "true"
+    LOG_KEEP_FILES = int(os.getenv("LOG_KEEP_FILES", 30))
 
     # Аномальные пампы/дампы
     ANOMALY_FILTER_ENABLED = os.getenv("ANOMALY_FILTER_ENABLED", "true").lower() == "true"
@@ -64,16 +153,68 @@ class Settings:
     BYBIT_API_SECRET = os.getenv("BYBIT_API_SECRET", "")
     BYBIT_BASE = os.getenv("BYBIT_BASE", "https://api-demo.bybit.com")
 
+    # HTTP-транспорт Bybit: таймауты (сек), ретраи, recv window (мс)
+    BYBIT_CONNECT_TIMEOUT = float(os.getenv("BYBIT_CONNECT_TIMEOUT", 3.05))
+    BYBIT_READ_TIMEOUT = float(os.getenv("BYBIT_READ_TIMEOUT", 10))
+    BYBIT_MAX_RETRIES = int(os.getenv("BYBIT_MAX_RETRIES", 4))
+    BYBIT_RECV_WINDOW = int(os.getenv("BYBIT_RECV_WINDOW", 5000))
+
     MAX_OPEN_POSITIONS = int(os.getenv("MAX_OPEN_POSITIONS", 3))
     POSITION_USD = float(os.getenv("POSITION_USD", 100))
     LEVERAGE = int(os.getenv("LEVERAGE", 10))
 
+    # Несколько аккаунтов на один скан (accounts.py): имена через запятую, параметры аккаунта —
+    # ACCOUNT_<ИМЯ>_API_KEY/_API_SECRET/_BASE/_POSITION_USD/_LEVERAGE/_MAX_OPEN_POSITIONS/_POSITION_MODE.
+    # Пусто — один аккаунт main из BYBIT_*/POSITION_USD/LEVERAGE/MAX_OPEN_POSITIONS
+    ACCOUNTS = os.getenv("ACCOUNTS", "")
+
     ATR_LEN = int(os.getenv("ATR_LEN", 14))
     SL_ATR_MULT = float(os.getenv("SL_ATR_MULT", 1.8))
     TP_ATR_MULT = float(os.getenv("TP_ATR_MULT", 3.0))
 
     REENTRY_COOLDOWN_HOURS = int(os.getenv("REENTRY_COOLDOWN_HOURS", 24))
 
+    # Реестр здоровья символов (health.py): после ошибки скана символ пропускается с
+    # экспоненциальным backoff от HEALTH_BACKOFF_SEC (до HEALTH_MAX_BACKOFF_SEC);
+    # BadSymbol или HEALTH_QUARANTINE_AFTER ошибок подряд — карантин на HEALTH_QUARANTINE_SEC
+    HEALTH_BACKOFF_SEC = float(os.getenv("HEALTH_BACKOFF_SEC", ITER_SECONDS))
+    HEALTH_MAX_BACKOFF_SEC = float(os.getenv("HEALTH_MAX_BACKOFF_SEC", 6 * 3600))
+    HEALTH_QUARANTINE_AFTER = int(os.getenv("HEALTH_QUARANTINE_AFTER", 5))
+    HEALTH_QUARANTINE_SEC = float(os.getenv("HEALTH_QUARANTINE_SEC", 24 * 3600))
+    # Символ, которого нет в справочнике инструментов Bybit, не перезапрашиваем столько секунд
+    INSTRUMENT_MISS_TTL = float(os.getenv("INSTRUMENT_MISS_TTL", 3600))
+    # Справочник инструментов (статусы торгов для карантина) перезагружается не реже, чем раз в столько секунд
+    INSTRUMENTS_TTL = float(os.getenv("INSTRUMENTS_TTL", 3600))
+
+    # Фильтр коррелированных входов: кандидат пропускается, если корреляция доходностей CORR_TF
+    # (окно CORR_WINDOW баров, не меньше CORR_MIN_BARS общих) с открытой позицией >= CORR_MAX
+    CORR_FILTER   = os.getenv("CORR_FILTER", "false").lower() == "true"
+    CORR_TF       = os.getenv("CORR_TF", "")          # пусто — первый ТФ скана
+    CORR_WINDOW   = int(os.getenv("CORR_WINDOW", 100))
+    CORR_MIN_BARS = int(os.getenv("CORR_MIN_BARS", 30))
+    CORR_MAX      = float(os.getenv("CORR_MAX", 0.8))
+
+    # Теневые варианты стратегии (shadow.py): "имя:КЛЮЧ=значение,КЛЮЧ=значение;имя2:..." —
+    # сигналы и виртуальные сделки по тем же буферам свечей, без ордеров и лишних запросов.
+    # Вариант base (текущие настройки) считается всегда. Итоги — DATA_DIR/shadow/performance.json,
+    # сделки — shadow/trades.jsonl. Пусто — выключено (задаётся только через окружение: от него зависит,
+    # ставится ли хук переопределений на Settings). С SHARD_WORKERS не работает
+    SHADOW_VARIANTS = os.getenv("SHADOW_VARIANTS", "")
+    SHADOW_FEE_PCT = float(os.getenv("SHADOW_FEE_PCT", 0.055))   # комиссия за сторону, %
+
+    # Приватный WebSocket (position/order/execution) — состояние аккаунта без REST-опроса
+    BYBIT_WS_ENABLED = os.getenv("BYBIT_WS_ENABLED", "false").lower() == "true"
+    BYBIT_WS_PRIVATE = os.getenv("BYBIT_WS_PRIVATE", "wss://stream-demo.bybit.com/v5/private")
+
+    # Параллельное исполнение входов: число потоков и размер пула HTTP-соединений Bybit
+    EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", 4))
+    BYBIT_POOL_SIZE = int(os.getenv("BYBIT_POOL_SIZE", 10))
+    # Несколько входов за цикл — одним запросом /v5/order/create-batch
+    EXEC_BATCH_ORDERS = os.getenv("EXEC_BATCH_ORDERS", "true").lower() == "true"
+
     TG_TRADE_BOT_TOKEN = os.getenv("TG_TRADE_BOT_TOKEN", "")
     TG_TRADE_CHAT_ID = os.getenv("TG_TRADE_CHAT_ID", "")
 
+    # Фоновая очередь Telegram: сколько сообщений держим, прежде чем отбрасывать новые
+    TG_QUEUE_SIZE = int(os.getenv("TG_QUEUE_SIZE", 200))
+
@@ -0,0 +1,337 @@
+# shadow.py — теневые варианты стратегии на живых данных, без ордеров
+#
+# Тот же процесс, те же буферы свечей: после скана каждый вариант из SHADOW_VARIANTS
+#   SHADOW_VARIANTS="relaxed:RELAX_MODE=relaxed,CONFIRM_MODE=any;wide:SL_ATR_MULT=2.5,TP_ATR_MULT=4"
+# получает свои сигналы и открывает виртуальные позиции по правилам живой торговли: только новые
+# сигналы, лимит MAX_OPEN_POSITIONS, кулдаун REENTRY_COOLDOWN_HOURS, SL/TP от ATR сигнального ТФ,
+# вход по цене тикеров скана. Выход — по следующим барам базового ТФ (бар входа не учитывается):
+# первое касание SL или TP; оба в одном баре — считаем SL, гэп за стоп — по open.
+#
+# Настройки варианта подменяются через settings.overridden (contextvars) — только в этом потоке,
+# скан и входы живого конвейера их не видят. Варианты, отличающиеся лишь параметрами выхода
+# (EXIT_KEYS), делят одну оценку сигналов; вариант без подмен сигналов берёт сигналы живого скана.
+# Запросов к бирже нет. Допуски паттернов (PAT_*, patterns.py) читаются при импорте — общие.
+#
+# Состояние вариантов (позиции, кулдауны, прошлые сигналы, итоги) — в StateStore (meta);
+# при смене описания варианта его история начинается заново. Итоги —
+# DATA_DIR/shadow/performance.json, закрытые сделки — shadow/trades.jsonl.
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from candles import CandleStore, parse_tfs, tf_minutes
+from indicators import atr
+from iterlog import get_writer
+from ohlcv_buffer import Bars
+from reporter import write_file
+from settings import Settings, overridden
+from state_store import StateStore, get_store
+from utils import now_iso
+
+BASE = "base"
+# не меняют сигналы — варианты, различающиеся только ими, делят одну оценку
+EXIT_KEYS = frozenset({"ATR_LEN", "SL_ATR_MULT", "TP_ATR_MULT", "MAX_OPEN_POSITIONS",
+                       "REENTRY_COOLDOWN_HOURS", "SHADOW_FEE_PCT"})
+
+
+@dataclass
+class Variant:
+    name: str
+    overrides: Dict[str, object] = field(default_factory=dict)
+
+    def signal_overrides(self) -> Tuple:
+        return tuple(sorted((k, v) for k, v in self.overrides.items() if k not in EXIT_KEYS))
+
+
+def _cast(key: str, raw: str):
+    """Значение из описания варианта — к типу текущей настройки."""
+    if not key.isupper() or not hasattr(Settings, key):
+        raise ValueError(f"неизвестная настройка {key}")
+    cur = getattr(Settings, key)
+    raw = raw.strip()
+    if isinstance(cur, bool):
+        return raw.lower() in ("1", "true", "yes", "on")
+    if isinstance(cur, int):
+        return int(raw)
+    if isinstance(cur, float):
+        return float(raw)
+    return raw.lower() if cur == cur.lower() else raw
+
+
+def parse_variants(raw: str) -> List[Variant]:
+    """SHADOW_VARIANTS -> [base, ...]; ошибка в описании — ValueError."""
+    out: List[Variant] = []
+    for part in (raw or "").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, spec = part.partition(":")
+        name = name.strip()
+        if not name or any(v.name == name for v in out):
+            raise ValueError(f"пустое или повторное имя варианта: {part!r}")
+        ov: Dict[str, object] = {}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            key, eq, val = item.partition("=")
+            if not eq:
+                raise ValueError(f"{name}: ожидается КЛЮЧ=значение, получено {item.strip()!r}")
+            key = key.strip().upper()
+            ov[key] = _cast(key, val)
+        out.append(Variant(name, ov))
+    if not any(v.name == BASE for v in out):
+        out.insert(0, Variant(BASE))
+    return out
+
+
+def _first_hit(pos: Dict, bars: Bars) -> Optional[Tuple[int, float, str]]:
+    """(ts бара, цена выхода, sl|tp) — первое касание уровня после бара входа; None — позиция жива."""
+    ts = np.asarray(bars.ts)
+    i0 = int(np.searchsorted(ts, pos["bar_ts"], side="right"))
+    if i0 >= len(ts):
+        return None
+    o = np.asarray(bars.open[i0:], dtype=float)
+    h = np.asarray(bars.high[i0:], dtype=float)
+    lo = np.asarray(bars.low[i0:], dtype=float)
+    buy = pos["side"] == "Buy"
+    hit_sl = lo <= pos["sl"] if buy else h >= pos["sl"]
+    hit_tp = h >= pos["tp"] if buy else lo <= pos["tp"]
+    hit = hit_sl | hit_tp
+    if not hit.any():
+        return None
+    j = int(np.argmax(hit))
+    if hit_sl[j]:
+        px = min(o[j], pos["sl"]) if buy else max(o[j], pos["sl"])
+        return int(ts[i0 + j]), float(px), "sl"
+    return int(ts[i0 + j]), float(pos["tp"]), "tp"
+
+
+def _ret_pct(pos: Dict, px: float, fee_pct: float) -> float:
+    sign = 1.0 if pos["side"] == "Buy" else -1.0
+    return sign * (px / pos["entry"] - 1.0) * 100.0 - 2.0 * fee_pct
+
+
+def _empty_stats() -> Dict:
+    return {"signals": 0, "no_slot": 0, "trades": 0, "wins": 0, "pnl_pct": 0.0, "gross_win": 0.0,
+            "gross_loss": 0.0, "sum_r": 0.0, "peak": 0.0, "max_dd": 0.0}
+
+
+class ShadowBook:
+    """Один вариант: виртуальные позиции, кулдауны, прошлый снимок сигналов, накопленные итоги."""
+
+    def __init__(self, variant: Variant, state: Optional[Dict] = None):
+        self.variant = variant
+        if not state or state.get("spec") != variant.overrides:
+            state = {}
+        self.positions: Dict[str, Dict] = state.get("positions", {})
+        self.last_entry: Dict[str, int] = state.get("last_entry", {})
+        keys = state.get("prev_keys")
+        self.prev_keys = set(keys) if keys is not None else None   # None — bootstrap, без входов
+        self.stats: Dict = state.get("stats") or _empty_stats()
+        self.started: str = state.get("started") or now_iso()
+
+    def to_state(self) -> Dict:
+        return {"spec": self.variant.overrides, "started": self.started, "positions": self.positions,
+                "last_entry": self.last_entry, "stats": self.stats,
+                "prev_keys": sorted(self.prev_keys) if self.prev_keys is not None else None}
+
+    def close_hits(self, candles: CandleStore, fee_pct: float) -> List[Dict]:
+        closed = []
+        for sym, pos in list(self.positions.items()):
+            bars = candles.get(sym)
+            hit = _first_hit(pos, bars) if bars is not None else None
+            if hit is None:
+                continue
+            ts, px, reason = hit
+            ret = _ret_pct(pos, px, fee_pct)
+            risk = abs(pos["entry"] - pos["sl"]) / pos["entry"] * 100.0
+            r = ret / risk if risk > 0 else 0.0
+            st = self.stats
+            st["trades"] += 1
+            st["pnl_pct"] += ret
+            st["sum_r"] += r
+            if ret > 0:
+                st["wins"] += 1
+                st["gross_win"] += ret
+            else:
+                st["gross_loss"] -= ret
+            st["peak"] = max(st["peak"], st["pnl_pct"])
+            st["max_dd"] = max(st["max_dd"], st["peak"] - st["pnl_pct"])
+            del self.positions[sym]
+            self.last_entry[sym] = max(self.last_entry.get(sym, 0), ts)   # кулдаун и от закрытия
+            closed.append({"variant": self.variant.name, "symbol": sym, "side": pos["side"], "tf": pos["tf"],
+                           "entry_ts": pos["ts"], "exit_ts": ts, "entry": pos["entry"], "exit": px,
+                           "sl": pos["sl"], "tp": pos["tp"], "reason": reason,
+                           "pnl_pct": round(ret, 4), "r": round(r, 3), "patterns": pos.get("patterns")})
+        return closed
+
+    def enter(self, signals: List[Dict], keys: List[str], scanned: set, candles: CandleStore,
+              last_prices: Dict[str, float], now_ms: int) -> int:
+        """Входы по новым сигналам (signals и keys — параллельные списки); возвращает число входов."""
+        cur = set(keys)
+        prev = self.prev_keys
+        # не оценённые в этом цикле символы сохраняют прошлые сигналы — иначе потом сойдут за новые
+        self.prev_keys = cur | {k for k in (prev or ()) if k.split("|", 1)[0] not in scanned}
+        if prev is None:
+            return 0   # как у живой торговли: первый снимок — без входов
+        opened = 0
+        cooldown_ms = Settings.REENTRY_COOLDOWN_HOURS * 3600 * 1000
+        for sig, key in zip(signals, keys):
+            if key in prev:
+                continue
+            self.stats["signals"] += 1
+            sym = sig["symbol"]
+            if sym in self.positions:
+                continue
+            if len(self.positions) >= Settings.MAX_OPEN_POSITIONS:
+                self.stats["no_slot"] += 1
+                continue
+            if now_ms - self.last_entry.get(sym, 0) < cooldown_ms:
+                continue
+            pos = self._open(sig, candles, last_prices.get(sym), now_ms)
+            if pos is None:
+                continue
+            self.positions[sym] = pos
+            self.last_entry[sym] = now_ms
+            opened += 1
+        return opened
+
+    @staticmethod
+    def _open(sig: Dict, candles: CandleStore, last: Optional[float], now_ms: int) -> Optional[Dict]:
+        """Уровни — как calc_levels_and_qty: ATR(ATR_LEN) окна SCAN_BARS сигнального ТФ."""
+        base = candles.get(sig["symbol"])
+        df = candles.frame(sig["symbol"], sig["tf"])
+        if base is None or df is None or len(df) <= Settings.ATR_LEN:
+            return None
+        a = float(np.asarray(atr(df.tail(Settings.SCAN_BARS), Settings.ATR_LEN))[-1])
+        entry = float(last or base.close[-1])
+        if not np.isfinite(a) or a <= 0 or entry <= 0:
+            return None
+        if sig["direction"] == "BULL":
+            side, sl, tp = "Buy", entry - Settings.SL_ATR_MULT * a, entry + Settings.TP_ATR_MULT * a
+        else:
+            side, sl, tp = "Sell", entry + Settings.SL_ATR_MULT * a, entry - Settings.TP_ATR_MULT * a
+        return {"side": side, "tf": sig["tf"], "entry": entry, "sl": sl, "tp": tp, "atr": a,
+                "ts": now_ms, "bar_ts": int(base.ts[-1]), "patterns": sig.get("patterns")}
+
+    def summary(self, candles: CandleStore, last_prices: Dict[str, float], fee_pct: float) -> Dict:
+        st = self.stats
+        n = st["trades"]
+        open_pnl = 0.0
+        positions = []
+        for sym, pos in self.positions.items():
+            bars = candles.get(sym)
+            px = last_prices.get(sym) or (float(bars.close[-1]) if bars is not None else None)
+            ret = _ret_pct(pos, px, fee_pct) if px else None
+            open_pnl += ret or 0.0
+            positions.append({"symbol": sym, "side": pos["side"], "tf": pos["tf"], "entry": pos["entry"],
+                              "sl": pos["sl"], "tp": pos["tp"], "pnl_pct": None if ret is None else round(ret, 4),
+                              "stale": bars is None})
+        return {
+            "overrides": self.variant.overrides,
+            "since": self.started,
+            "signals": st["signals"],
+            "no_slot": st["no_slot"],
+            "trades": n,
+            "win_rate_pct": round(st["wins"] / n * 100.0, 1) if n else None,
+            "pnl_pct": round(st["pnl_pct"], 4),
+            "avg_pnl_pct": round(st["pnl_pct"] / n, 4) if n else None,
+            "avg_r": round(st["sum_r"] / n, 3) if n else None,
+            "profit_factor": round(st["gross_win"] / st["gross_loss"], 3) if st["gross_loss"] > 0 else None,
+            "max_drawdown_pct": round(st["max_dd"], 4),
+            "open": len(self.positions),
+            "open_pnl_pct": round(open_pnl, 4),
+            "positions": positions,
+        }
+
+
+class ShadowEngine:
+    def __init__(self, variants: List[Variant], store: StateStore, out_dir: Path):
+        self.variants = variants
+        self.store = store
+        self.out_dir = Path(out_dir)
+        self.books = {v.name: ShadowBook(v, self._load(v.name)) for v in variants}
+        self._lock = threading.Lock()
+
+    def _load(self, name: str) -> Optional[Dict]:
+        raw = self.store.get_meta(f"shadow:{name}")
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
+
+    def _evaluate(self, candles: CandleStore, symbols: List[str], overrides: Tuple) -> List[Dict]:
+        """Сигналы по уже загруженным свечам с подменой настроек варианта (ТФ — тоже из них)."""
+        from main import _scan_tfs, evaluate_symbol
+
+        sigs: List[Dict] = []
+        base = tf_minutes(candles.base_tf)
+        with overridden(**dict(overrides)):
+            scan_tfs = [tf for tf in _scan_tfs() if tf_minutes(tf) >= base]
+            trend_tfs = [tf for tf in parse_tfs(Settings.TREND_TFS) if tf_minutes(tf) >= base]
+            for sym in symbols:
+                try:
+                    s, _ = evaluate_symbol(candles, sym, scan_tfs, trend_tfs)
+                except Exception:
+                    continue
+                sigs.extend(s)
+        return sigs
+
+    def run(self, candles: CandleStore, symbols: List[str], live_signals: List[Dict],
+            last_prices: Dict[str, float]) -> Dict[str, Dict]:
+        """
+        Один цикл всех вариантов. symbols — оценённые в этом цикле символы (порядок — ранг universe),
+        live_signals — сигналы живого скана. Возвращает {вариант: итоги}.
+        """
+        from main import _signal_key
+
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            scanned = set(symbols)
+            evaluated: Dict[Tuple, Tuple[List[Dict], List[str]]] = {}
+            trades: List[Dict] = []
+            perf: Dict[str, Dict] = {}
+            for v in self.variants:
+                key = v.signal_overrides()
+                if key not in evaluated:
+                    sigs = [s for s in live_signals if s["symbol"] in scanned] if not key \
+                        else self._evaluate(candles, symbols, key)
+                    with overridden(**dict(key)):
+                        evaluated[key] = (sigs, [_signal_key(s) for s in sigs])
+                sigs, keys = evaluated[key]
+                book = self.books[v.name]
+                with overridden(**v.overrides):
+                    fee = Settings.SHADOW_FEE_PCT
+                    closed = book.close_hits(candles, fee)
+                    opened = book.enter(sigs, keys, scanned, candles, last_prices, now_ms)
+                    trades.extend(closed)
+                    perf[v.name] = dict(book.summary(candles, last_prices, fee),
+                                        cycle={"signals": len(sigs), "opened": opened, "closed": len(closed)})
+                self.store.set_meta(f"shadow:{v.name}", json.dumps(book.to_state(), ensure_ascii=False))
+
+            if trades:
+                writer = get_writer(self.out_dir / "trades.jsonl", max_bytes=Settings.LOG_MAX_MB * 1024 * 1024,
+                                    rotate_daily=Settings.LOG_ROTATE_DAILY, keep_files=Settings.LOG_KEEP_FILES)
+                for t in trades:
+                    writer.write(t)
+            write_file(self.out_dir / "performance.json",
+                       json.dumps({"ts": now_iso(), "variants": perf}, ensure_ascii=False, indent=2))
+            return perf
+
+
+_engine: Optional[ShadowEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_shadow_engine(data_dir: Path) -> ShadowEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ShadowEngine(parse_variants(Settings.SHADOW_VARIANTS), get_store(data_dir),
+                                   Path(data_dir) / "shadow")
+        return _engine
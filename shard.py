@@ -0,0 +1,224 @@
+# shard.py — скан universe в нескольких процессах-воркерах (координатор + воркеры)
+#
+# Символы раскладываются по воркерам консистентным хешированием: при изменении числа
+# воркеров переезжает ~1/N символов, остальные остаются при своём (тёплом) буфере свечей.
+# Каждый воркер держит своё соединение ccxt и CandleStore, качает и оценивает только свой
+# шард и отдаёт результаты по одному символу сразу по готовности. Лимит запросов ccxt
+# делится между воркерами (rateLimit каждого умножается на число шардов). Сигналы сводятся
+# в координаторе; торговля и учёт слотов MAX_OPEN_POSITIONS остаются только там.
+import bisect
+import hashlib
+import multiprocessing as mp
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from settings import Settings
+
+
+class HashRing:
+    """Консистентное хеширование символов по узлам (с виртуальными узлами для равномерности)."""
+
+    def __init__(self, nodes: List[str], vnodes: int = 64):
+        self.nodes = list(nodes)
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f"{n}#{v}"), n) for n in self.nodes for v in range(vnodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+    def split(self, keys: List[str]) -> Dict[str, List[str]]:
+        """{node: [keys...]} с сохранением исходного порядка внутри узла."""
+        out: Dict[str, List[str]] = {n: [] for n in self.nodes}
+        for k in keys:
+            out[self.node_for(k)].append(k)
+        return out
+
+
+def _hash(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# =========================
+# Воркер
+# =========================
+def _worker_main(name: str, jobs, results, scan_workers: int, n_shards: int = 1):
+    # импорт внутри процесса: воркер поднимается через spawn и строит своё окружение сам
+    from bybit_data import build_exchange
+    from main import candle_store, scan_symbol
+
+    exchange = build_exchange()
+    # у каждого процесса свой троттлер ccxt: делим общий бюджет запросов между шардами,
+    # иначе N воркеров вместе бьют биржу в N раз чаще rateLimit
+    if n_shards > 1 and getattr(exchange, "enableRateLimit", False):
+        exchange.rateLimit = float(getattr(exchange, "rateLimit", 0) or 0) * n_shards
+    candles = candle_store(exchange)
+    pool = ThreadPoolExecutor(max_workers=max(1, scan_workers), thread_name_prefix=f"{name}-scan")
+    running: Dict[int, List[Future]] = {}
+
+    def one(cycle: int, sym: str, scan_tfs: List[str], trend_tfs: List[str]):
+        try:
+            sigs, frames = scan_symbol(exchange, candles, sym, scan_tfs, trend_tfs)
+            # свечи нужны координатору только для ATR по сигналам — остальное не гоняем через IPC
+            results.put(("ok", name, cycle, sym, sigs, frames if sigs else {}))
+        except Exception as e:
+            results.put(("err", name, cycle, sym, f"{type(e).__name__}: {e}", None))
+
+    while True:
+        msg = jobs.get()
+        if msg is None:
+            break
+        kind, cycle = msg[0], msg[1]
+        if kind == "scan":
+            _, _, syms, scan_tfs, trend_tfs, owned = msg
+            keep = set(owned)
+            for sym in candles.symbols():
+                if sym not in keep:
+                    candles.drop(sym)
+            running[cycle] = [pool.submit(one, cycle, s, scan_tfs, trend_tfs) for s in syms]
+        elif kind == "cancel":
+            for fut in running.pop(cycle, []):
+                fut.cancel()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# =========================
+# Координатор
+# =========================
+class ShardPool:
+    """
+    N локальных процессов-воркеров. submit() раскладывает символы по кольцу и возвращает
+    по Future на символ в порядке входного списка — cycle_once работает с ними так же,
+    как с задачами локального пула скана (дедлайн, порядок, отмена).
+    Упавший воркер перезапускается, его незавершённые символы получают исключение.
+    """
+
+    def __init__(self, workers: int, scan_workers: int = 4, logger=None):
+        self.names = [f"w{i}" for i in range(max(1, workers))]
+        self.ring = HashRing(self.names)
+        self.scan_workers = scan_workers
+        self.logger = logger
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._jobs: Dict[str, "mp.Queue"] = {}
+        self._procs: Dict[str, "mp.Process"] = {}
+        self._lock = threading.Lock()
+        self._cycle = 0
+        self._futs: Dict[Tuple[int, str], Future] = {}
+        self._owner: Dict[Tuple[int, str], str] = {}
+        self._stopped = False
+        for n in self.names:
+            self._spawn(n)
+        self._reader = threading.Thread(target=self._read_loop, daemon=True, name="shard-reader")
+        self._reader.start()
+
+    def _log(self, level: str, msg: str, *args):
+        if self.logger is not None:
+            getattr(self.logger, level)(msg, *args)
+
+    def _spawn(self, name: str) -> None:
+        jobs = self._ctx.Queue()
+        p = self._ctx.Process(target=_worker_main, args=(name, jobs, self._results, self.scan_workers,
+                                                            len(self.names)),
+                              name=f"scan-{name}", daemon=True)
+        p.start()
+        self._jobs[name] = jobs
+        self._procs[name] = p
+
+    def submit(self, symbols: List[str], scan_tfs: List[str], trend_tfs: List[str],
+               universe: Optional[List[str]] = None) -> List[Future]:
+        """universe — все символы, чьи свечи воркерам держать (ярусный скан берёт за цикл только часть)."""
+        with self._lock:
+            # незавершённое прошлым циклом больше не нужно
+            prev = self._cycle
+            self._cycle += 1
+            cycle = self._cycle
+            for n in self.names:
+                self._jobs[n].put(("cancel", prev))
+            self._futs = {}
+            self._owner = {}
+            futures = []
+            for sym in symbols:
+                fut: Future = Future()
+                self._futs[(cycle, sym)] = fut
+                self._owner[(cycle, sym)] = self.ring.node_for(sym)
+                futures.append(fut)
+            owned = self.ring.split(universe if universe is not None else symbols)
+            for n, syms in self.ring.split(symbols).items():
+                self._jobs[n].put(("scan", cycle, syms, scan_tfs, trend_tfs, owned[n]))
+        return futures
+
+    @staticmethod
+    def _settle(fut: Future, result=None, error: Optional[BaseException] = None) -> None:
+        try:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+        except InvalidStateError:
+            pass  # отменён координатором (дедлайн)
+
+    def _read_loop(self):
+        while not self._stopped:
+            try:
+                kind, name, cycle, sym, a, b = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                fut = self._futs.pop((cycle, sym), None)
+                self._owner.pop((cycle, sym), None)
+            if fut is None:
+                continue
+            if kind == "ok":
+                self._settle(fut, (a, b))
+            else:
+                self._settle(fut, error=RuntimeError(a))
+
+    def _check_workers(self):
+        for n, p in list(self._procs.items()):
+            if p.is_alive() or self._stopped:
+                continue
+            self._log("warning", "Воркер скана %s завершился (code=%s) — перезапуск", n, p.exitcode)
+            with self._lock:
+                lost = [k for k, owner in self._owner.items() if owner == n]
+                futs = [self._futs.pop(k) for k in lost if k in self._futs]
+                for k in lost:
+                    self._owner.pop(k, None)
+                self._spawn(n)
+            for fut in futs:
+                self._settle(fut, error=RuntimeError(f"scan worker {n} died"))
+
+    def pids(self) -> List[int]:
+        return [p.pid for p in self._procs.values() if p.is_alive() and p.pid is not None]
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopped = True
+        for n in self.names:
+            try:
+                self._jobs[n].put(None)
+            except (OSError, ValueError):
+                pass
+        for p in self._procs.values():
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+
+
+_shards: Optional[ShardPool] = None
+_shards_lock = threading.Lock()
+
+
+def get_shard_pool(logger=None) -> ShardPool:
+    """Пул воркеров процесса (SHARD_WORKERS штук, создаётся при первом вызове)."""
+    global _shards
+    with _shards_lock:
+        if _shards is None:
+            _shards = ShardPool(Settings.SHARD_WORKERS, scan_workers=Settings.SCAN_WORKERS, logger=logger)
+        return _shards
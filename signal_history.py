@@ -0,0 +1,208 @@
+# signal_history.py — компактная колоночная история сигналов + CLI для выборок
+#
+# Одна запись = 28 байт (ts, symbol id, direction, bitmask паттернов, RSI, bitmask индикаторов),
+# файл data/history/signals_<tf>.bin только дописывается; справочники символов и паттернов —
+# в signals_<tf>.meta.json. Запросы идут по np.memmap без загрузки всего файла в память.
+#
+#   python signal_history.py --since 2025-09-01 --symbol HIFI/USDT:USDT --pattern "Tweezer Top"
+import argparse
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ("ts", "<i8"),          # unix ms (UTC)
+    ("symbol", "<u4"),      # индекс в meta["symbols"]
+    ("direction", "i1"),    # +1 BULL, -1 BEAR
+    ("checks", "u1"),       # bitmask пройденных индикаторов (см. CHECK_BITS)
+    ("checks_on", "u1"),    # bitmask включённых индикаторов
+    ("_pad", "u1"),
+    ("patterns", "<u8"),    # bitmask по meta["patterns"]
+    ("rsi", "<f4"),
+])
+
+CHECK_BITS = {"EMA": 1, "RSI": 2, "MACD": 4}
+MAX_PATTERNS = 64
+
+
+class SignalHistory:
+    def __init__(self, base_dir: Path, tf: str):
+        self.base_dir = Path(base_dir)
+        self.tf = tf
+        self.bin_path = self.base_dir / f"signals_{tf}.bin"
+        self.meta_path = self.base_dir / f"signals_{tf}.meta.json"
+        self._lock = threading.Lock()
+        self.meta = self._load_meta()
+        self._sym_idx = {s: i for i, s in enumerate(self.meta["symbols"])}
+        self._pat_idx = {p: i for i, p in enumerate(self.meta["patterns"])}
+
+    def _load_meta(self) -> Dict:
+        if self.meta_path.exists():
+            try:
+                return json.loads(self.meta_path.read_text(encoding="utf-8"))
+            except ValueError:
+                pass
+        return {"version": 1, "tf": self.tf, "symbols": [], "patterns": []}
+
+    def _save_meta(self) -> None:
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+
+    def _symbol_id(self, sym: str) -> int:
+        i = self._sym_idx.get(sym)
+        if i is None:
+            i = len(self.meta["symbols"])
+            self.meta["symbols"].append(sym)
+            self._sym_idx[sym] = i
+        return i
+
+    def _pattern_bits(self, names: Iterable[str]) -> int:
+        bits = 0
+        for n in names:
+            i = self._pat_idx.get(n)
+            if i is None:
+                i = len(self.meta["patterns"])
+                if i >= MAX_PATTERNS:
+                    continue
+                self.meta["patterns"].append(n)
+                self._pat_idx[n] = i
+            bits |= 1 << i
+        return bits
+
+    # -------- запись --------
+    def append(self, signals: List[Dict], ts: Optional[datetime] = None) -> int:
+        if not signals:
+            return 0
+        ts_ms = int((ts or datetime.now(timezone.utc)).timestamp() * 1000)
+        with self._lock:
+            n_sym, n_pat = len(self.meta["symbols"]), len(self.meta["patterns"])
+            rec = np.zeros(len(signals), dtype=RECORD_DTYPE)
+            for i, s in enumerate(signals):
+                checks = s.get("checks") or {}
+                rec[i]["ts"] = ts_ms
+                rec[i]["symbol"] = self._symbol_id(s["symbol"])
+                rec[i]["direction"] = 1 if s["direction"] == "BULL" else -1
+                rec[i]["checks"] = sum(CHECK_BITS.get(k, 0) for k, v in checks.items() if v)
+                rec[i]["checks_on"] = sum(CHECK_BITS.get(k, 0) for k in checks)
+                rec[i]["patterns"] = self._pattern_bits(s.get("patterns", []))
+                rec[i]["rsi"] = float(s.get("rsi") or np.nan)
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            if len(self.meta["symbols"]) != n_sym or len(self.meta["patterns"]) != n_pat:
+                # справочник пишем до данных: запись никогда не ссылается на неизвестный id
+                self._save_meta()
+            with open(self.bin_path, "ab") as f:
+                f.write(rec.tobytes())
+        return len(signals)
+
+    # -------- чтение --------
+    def records(self) -> np.ndarray:
+        """Все записи как memmap (без чтения в память)."""
+        if not self.bin_path.exists() or self.bin_path.stat().st_size < RECORD_DTYPE.itemsize:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        n = self.bin_path.stat().st_size // RECORD_DTYPE.itemsize
+        return np.memmap(self.bin_path, dtype=RECORD_DTYPE, mode="r", shape=(n,))
+
+    def query(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              symbol: Optional[str] = None, pattern: Optional[str] = None,
+              direction: Optional[str] = None) -> np.ndarray:
+        """
+        Выборка по диапазону времени (бинарный поиск — ts только растёт), символу,
+        паттерну и направлению. Возвращает копию подходящих записей.
+        """
+        rec = self.records()
+        if len(rec) == 0:
+            return rec
+        ts = rec["ts"]
+        lo = int(np.searchsorted(ts, int(since.timestamp() * 1000), side="left")) if since else 0
+        hi = int(np.searchsorted(ts, int(until.timestamp() * 1000), side="right")) if until else len(rec)
+        part = rec[lo:hi]
+        mask = np.ones(len(part), dtype=bool)
+        if symbol is not None:
+            sid = self._sym_idx.get(symbol)
+            if sid is None:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            mask &= part["symbol"] == sid
+        if pattern is not None:
+            pid = self._pat_idx.get(pattern)
+            if pid is None:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            mask &= (part["patterns"] & np.uint64(1 << pid)) != 0
+        if direction is not None:
+            mask &= part["direction"] == (1 if direction.upper() == "BULL" else -1)
+        return np.array(part[mask])
+
+    def decode(self, rec: np.ndarray) -> List[Dict]:
+        out = []
+        syms, pats = self.meta["symbols"], self.meta["patterns"]
+        for r in rec:
+            bits = int(r["patterns"])
+            out.append({
+                "ts": datetime.fromtimestamp(int(r["ts"]) / 1000, tz=timezone.utc).isoformat(timespec="seconds"),
+                "symbol": syms[int(r["symbol"])],
+                "direction": "BULL" if int(r["direction"]) > 0 else "BEAR",
+                "patterns": [p for i, p in enumerate(pats) if bits >> i & 1],
+                "rsi": float(r["rsi"]),
+                "checks": {k: bool(int(r["checks"]) & b) for k, b in CHECK_BITS.items() if int(r["checks_on"]) & b},
+            })
+        return out
+
+
+_histories: Dict[str, SignalHistory] = {}
+_histories_lock = threading.Lock()
+
+
+def get_history(data_dir: Path, tf: str) -> SignalHistory:
+    key = f"{Path(data_dir).resolve()}|{tf}"
+    with _histories_lock:
+        h = _histories.get(key)
+        if h is None:
+            h = SignalHistory(Path(data_dir) / "history", tf)
+            _histories[key] = h
+        return h
+
+
+def _parse_dt(s: str) -> datetime:
+    t = datetime.fromisoformat(s)
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def main():
+    from settings import Settings
+
+    ap = argparse.ArgumentParser(description="Query compact signal history")
+    ap.add_argument("--data-dir", default=Settings.DATA_DIR)
+    ap.add_argument("--tf", default=Settings.WORK_TF)
+    ap.add_argument("--since", type=_parse_dt, help="ISO время, напр. 2025-09-22 или 2025-09-22T21:00")
+    ap.add_argument("--until", type=_parse_dt)
+    ap.add_argument("--symbol")
+    ap.add_argument("--pattern")
+    ap.add_argument("--direction", choices=["BULL", "BEAR", "bull", "bear"])
+    ap.add_argument("--limit", type=int, default=0, help="последние N совпадений (0 — все)")
+    ap.add_argument("--json", action="store_true", help="JSON-строки вместо таблицы")
+    ap.add_argument("--count", action="store_true", help="только число совпадений")
+    args = ap.parse_args()
+
+    h = SignalHistory(Path(args.data_dir) / "history", args.tf)
+    rec = h.query(args.since, args.until, args.symbol, args.pattern, args.direction)
+    if args.count:
+        print(len(rec))
+        return
+    if args.limit > 0:
+        rec = rec[-args.limit:]
+    for row in h.decode(rec):
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            flags = ", ".join(f"{k}={v}" for k, v in row["checks"].items()) or "no-indicators"
+            print(f"{row['ts']} | {row['symbol']:>18s} | {row['direction']} | RSI={row['rsi']:.1f} | "
+                  f"{flags} | {', '.join(row['patterns'])}")
+
+
+if __name__ == "__main__":
+    main()
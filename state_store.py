@@ -0,0 +1,322 @@
+# state_store.py — транзакционное хранилище состояния бота (SQLite, WAL)
+#
+# Заменяет data/state/last_signals.json и last_entries.json: каждая запись —
+# атомарный upsert по ключу, чтение — индексированный lookup, а не разбор всего файла.
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signals (
+    key        TEXT PRIMARY KEY,          -- "symbol|direction[|tf]"
+    symbol     TEXT NOT NULL,
+    direction  TEXT NOT NULL,
+    pos        INTEGER NOT NULL,          -- индекс при последней записи строки (порядок — meta.signals_order)
+    payload    TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    account TEXT NOT NULL DEFAULT 'main', -- торговый аккаунт (accounts.py)
+    symbol  TEXT NOT NULL,                -- bybit symbol
+    ts      TEXT NOT NULL,                -- ISO время последнего входа
+    PRIMARY KEY (account, symbol)
+);
+CREATE TABLE IF NOT EXISTS cooldowns (
+    account TEXT NOT NULL DEFAULT 'main',
+    symbol  TEXT NOT NULL,
+    until   TEXT NOT NULL,                -- ISO, до какого момента вход запрещён
+    reason  TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (account, symbol)
+);
+CREATE TABLE IF NOT EXISTS deferred (
+    symbol TEXT PRIMARY KEY,              -- ccxt symbol, не обработан до дедлайна цикла
+    since  TEXT NOT NULL,                 -- ISO, с какого цикла откладывается
+    cycles INTEGER NOT NULL DEFAULT 1     -- сколько циклов подряд
+);
+CREATE TABLE IF NOT EXISTS symbol_health (
+    symbol      TEXT PRIMARY KEY,         -- ccxt symbol
+    kind        TEXT NOT NULL,            -- тип последней ошибки (bad_symbol, timeout, data, ...)
+    failures    INTEGER NOT NULL,         -- ошибок подряд
+    last_error  TEXT NOT NULL DEFAULT '',
+    retry_at    TEXT NOT NULL,            -- ISO, раньше не пробуем
+    quarantined INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+DEFAULT_ACCOUNT = "main"
+
+
+def _table_ddl(table: str) -> str:
+    """CREATE TABLE таблицы из _SCHEMA (для миграций)."""
+    head = f"CREATE TABLE IF NOT EXISTS {table} ("
+    return head + _SCHEMA.split(head, 1)[1].split(");", 1)[0] + ")"
+
+
+def _parse_iso(iso: str) -> Optional[datetime]:
+    try:
+        t = datetime.fromisoformat(iso)
+    except (TypeError, ValueError):
+        return None
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t
+
+
+class StateStore:
+    """
+    Обёртка над одной SQLite-базой (data/state/state.db).
+    Потокобезопасна: одно соединение под замком, транзакция на каждую операцию.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._migrate_accounts()
+        self._migrate_json()
+
+    # -------- служебное --------
+    def _tx(self):
+        return _Tx(self._db, self._lock)
+
+    def _migrate_accounts(self) -> None:
+        """entries/cooldowns до мультиаккаунта (ключ — только symbol): строки уходят аккаунту main."""
+        with self._tx() as db:
+            for table, cols in (("entries", "symbol, ts"), ("cooldowns", "symbol, until, reason")):
+                have = [r[1] for r in db.execute(f"PRAGMA table_info({table})")]
+                if "account" in have:
+                    continue
+                db.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+                db.execute(_table_ddl(table))
+                db.execute(f"INSERT INTO {table}(account, {cols}) SELECT ?, {cols} FROM {table}_v1",
+                           (DEFAULT_ACCOUNT,))
+                db.execute(f"DROP TABLE {table}_v1")
+
+    def _migrate_json(self) -> None:
+        """Однократный импорт прежних JSON-файлов из той же папки."""
+        sig_file = self.path.parent / "last_signals.json"
+        ent_file = self.path.parent / "last_entries.json"
+        if sig_file.exists() and self.get_meta("signals_saved") is None:
+            try:
+                self.replace_signals(json.loads(sig_file.read_text(encoding="utf-8")))
+                sig_file.rename(sig_file.with_suffix(".json.migrated"))
+            except (OSError, ValueError):
+                pass
+        if ent_file.exists():
+            try:
+                mapping = json.loads(ent_file.read_text(encoding="utf-8"))
+                with self._tx() as db:
+                    db.executemany("INSERT OR IGNORE INTO entries(account, symbol, ts) VALUES (?, ?, ?)",
+                                   [(DEFAULT_ACCOUNT, k, str(v)) for k, v in mapping.items()])
+                ent_file.rename(ent_file.with_suffix(".json.migrated"))
+            except (OSError, ValueError):
+                pass
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._tx() as db:
+            db.execute("INSERT INTO meta(key, value) VALUES (?, ?) "
+                       "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    # -------- сигналы --------
+    def has_signals_snapshot(self) -> bool:
+        return self.get_meta("signals_saved") is not None
+
+    def load_signals(self) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT key, payload FROM signals ORDER BY pos").fetchall()
+            order_blob = self._db.execute("SELECT value FROM meta WHERE key = 'signals_order'").fetchone()
+        if order_blob:
+            # порядок снимка хранится одним списком ключей; pos — только запасной порядок старых баз
+            try:
+                rank = {k: i for i, k in enumerate(json.loads(order_blob[0]))}
+            except ValueError:
+                rank = {}
+            rows.sort(key=lambda r: rank.get(r[0], len(rank)))
+        out = []
+        for _, payload in rows:
+            try:
+                out.append(json.loads(payload))
+            except ValueError:
+                continue
+        return out
+
+    def replace_signals(self, signals: List[Dict], key: Optional[Callable[[Dict], str]] = None) -> int:
+        """
+        Делает таблицу равной снимку signals, трогая только изменившиеся ключи.
+        Порядок снимка пишется одной строкой meta (signals_order), поэтому вставка сигнала
+        в начало не переписывает все последующие строки.
+        key — функция ключа сигнала (по умолчанию "symbol|direction").
+        Возвращает число записанных/удалённых строк.
+        """
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        wanted: Dict[str, tuple] = {}
+        for i, s in enumerate(signals):
+            k = key(s) if key else f"{s['symbol']}|{s['direction']}"
+            wanted[k] = (s["symbol"], s["direction"], i,
+                           json.dumps(s, ensure_ascii=False, default=str))
+        changed = 0
+        with self._tx() as db:
+            existing = dict(db.execute("SELECT key, payload FROM signals"))
+            gone = [(k,) for k in existing if k not in wanted]
+            if gone:
+                db.executemany("DELETE FROM signals WHERE key = ?", gone)
+            upserts = [
+                (k, sym, d, pos, payload, now)
+                for k, (sym, d, pos, payload) in wanted.items()
+                if existing.get(k) != payload
+            ]
+            if upserts:
+                db.executemany(
+                    "INSERT INTO signals(key, symbol, direction, pos, payload, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET pos = excluded.pos, payload = excluded.payload, "
+                    "updated_at = excluded.updated_at",
+                    upserts,
+                )
+            db.executemany("INSERT INTO meta(key, value) VALUES (?, ?) "
+                           "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                           [("signals_order", json.dumps(list(wanted), ensure_ascii=False)),
+                            ("signals_saved", now)])
+            changed = len(gone) + len(upserts)
+        return changed
+
+    # -------- входы / кулдауны (по аккаунтам) --------
+    def get_entry(self, symbol: str, account: str = DEFAULT_ACCOUNT) -> Optional[datetime]:
+        with self._lock:
+            row = self._db.execute("SELECT ts FROM entries WHERE account = ? AND symbol = ?",
+                                   (account, symbol)).fetchone()
+        return _parse_iso(row[0]) if row else None
+
+    def load_entries(self, account: str = DEFAULT_ACCOUNT) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._db.execute("SELECT symbol, ts FROM entries WHERE account = ?", (account,)).fetchall())
+
+    def record_entry(self, symbol: str, ts: datetime, cooldown_until: Optional[datetime] = None,
+                     account: str = DEFAULT_ACCOUNT) -> None:
+        """Отметка входа (и, если задано, кулдауна) одной транзакцией."""
+        with self._tx() as db:
+            db.execute("INSERT INTO entries(account, symbol, ts) VALUES (?, ?, ?) "
+                       "ON CONFLICT(account, symbol) DO UPDATE SET ts = excluded.ts",
+                       (account, symbol, ts.isoformat(timespec="seconds")))
+            if cooldown_until is not None:
+                self._upsert_cooldown(db, account, symbol, cooldown_until, "entry")
+
+    def set_cooldown(self, symbol: str, until: datetime, reason: str = "", account: str = DEFAULT_ACCOUNT) -> None:
+        with self._tx() as db:
+            self._upsert_cooldown(db, account, symbol, until, reason)
+
+    @staticmethod
+    def _upsert_cooldown(db, account: str, symbol: str, until: datetime, reason: str) -> None:
+        # кулдаун только продлевается: более ранний until не перетирает поздний
+        db.execute("INSERT INTO cooldowns(account, symbol, until, reason) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT(account, symbol) DO UPDATE SET until = excluded.until, reason = excluded.reason "
+                   "WHERE excluded.until > cooldowns.until",
+                   (account, symbol, until.astimezone(timezone.utc).isoformat(timespec="seconds"), reason))
+
+    def cooldown_until(self, symbol: str, account: str = DEFAULT_ACCOUNT) -> Optional[datetime]:
+        with self._lock:
+            row = self._db.execute("SELECT until FROM cooldowns WHERE account = ? AND symbol = ?",
+                                   (account, symbol)).fetchone()
+        return _parse_iso(row[0]) if row else None
+
+    def prune_cooldowns(self, now: datetime) -> int:
+        with self._tx() as db:
+            cur = db.execute("DELETE FROM cooldowns WHERE until < ?",
+                             (now.astimezone(timezone.utc).isoformat(timespec="seconds"),))
+            return cur.rowcount
+
+    # -------- отложенные символы (бюджет цикла) --------
+    def load_deferred(self) -> Dict[str, int]:
+        """{symbol: сколько циклов подряд откладывается}"""
+        with self._lock:
+            return dict(self._db.execute("SELECT symbol, cycles FROM deferred").fetchall())
+
+    def replace_deferred(self, symbols: List[str]) -> None:
+        """Снимок отложенных за цикл: повторно отложенным счётчик растёт, обработанные удаляются."""
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        wanted = set(symbols)
+        with self._tx() as db:
+            gone = [(s,) for (s,) in db.execute("SELECT symbol FROM deferred") if s not in wanted]
+            if gone:
+                db.executemany("DELETE FROM deferred WHERE symbol = ?", gone)
+            db.executemany("INSERT INTO deferred(symbol, since, cycles) VALUES (?, ?, 1) "
+                           "ON CONFLICT(symbol) DO UPDATE SET cycles = deferred.cycles + 1",
+                           [(s, now) for s in wanted])
+
+    # -------- здоровье символов --------
+    def load_health(self) -> Dict[str, Dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT symbol, kind, failures, last_error, retry_at, quarantined FROM symbol_health").fetchall()
+        return {sym: {"kind": kind, "failures": n, "last_error": err, "retry_at": _parse_iso(at),
+                      "quarantined": bool(q)}
+                for sym, kind, n, err, at, q in rows}
+
+    def upsert_health(self, symbol: str, kind: str, failures: int, last_error: str,
+                      retry_at: datetime, quarantined: bool) -> None:
+        with self._tx() as db:
+            db.execute("INSERT INTO symbol_health(symbol, kind, failures, last_error, retry_at, quarantined) "
+                       "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(symbol) DO UPDATE SET kind = excluded.kind, "
+                       "failures = excluded.failures, last_error = excluded.last_error, "
+                       "retry_at = excluded.retry_at, quarantined = excluded.quarantined",
+                       (symbol, kind, failures, last_error[:500],
+                        retry_at.astimezone(timezone.utc).isoformat(timespec="seconds"), int(quarantined)))
+
+    def clear_health(self, symbols: List[str]) -> None:
+        if not symbols:
+            return
+        with self._tx() as db:
+            db.executemany("DELETE FROM symbol_health WHERE symbol = ?", [(s,) for s in symbols])
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class _Tx:
+    def __init__(self, db: sqlite3.Connection, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
+
+
+_stores: Dict[str, StateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(data_dir: Path) -> StateStore:
+    """Одно хранилище на data_dir на процесс."""
+    path = Path(data_dir) / "state" / "state.db"
+    key = str(path.resolve())
+    with _stores_lock:
+        st = _stores.get(key)
+        if st is None:
+            st = StateStore(path)
+            _stores[key] = st
+        return st
@@ -1,17 +1,31 @@
-import requests
+import queue
+import random
+import threading
+import time
 from pathlib import Path
+from typing import Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
 
 class TelegramError(RuntimeError):
     pass
 
+# Общая keep-alive сессия вместо нового соединения на каждый вызов
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
 def _post(url: str, data=None, files=None):
-    r = requests.post(url, data=data, files=files, timeout=30)
+    r = _session.post(url, data=data, files=files, timeout=30)
     if not r.ok:
         try:
             detail = r.json()
         except Exception:
             detail = {"text": r.text}
-        raise TelegramError(f"{r.status_code} {r.reason} | {detail}")
+        err = TelegramError(f"{r.status_code} {r.reason} | {detail}")
+        err.status = r.status_code
+        err.retry_after = (detail.get("parameters") or {}).get("retry_after") if isinstance(detail, dict) else None
+        raise err
     return r.json()
 
 def send_text(bot_token: str, chat_id: str, text: str):
@@ -25,3 +39,107 @@ def send_document(bot_token: str, chat_id: str, file_path: Path, caption: str =
         files = {"document": (file_path.name, f, "text/plain")}
         data = {"chat_id": chat_id, "caption": caption}
         return _post(url, data=data, files=files)
+
+def send_document_bytes(bot_token: str, chat_id: str, filename: str, content: Union[bytes, str], caption: str = ""):
+    """Отправка документа прямо из памяти — без промежуточного файла на диске."""
+    url = f"https://api.telegram.org/bot{bot_token}/sendDocument"
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    files = {"document": (filename, content, "text/plain")}
+    data = {"chat_id": chat_id, "caption": caption}
+    return _post(url, data=data, files=files)
+
+
+class TelegramDispatcher:
+    """
+    Фоновая отправка в Telegram: ограниченная очередь + один рабочий поток.
+    submit_* никогда не блокирует торговый цикл: при переполнении сообщение отбрасывается (с логом).
+    429 — ждём retry_after из ответа Telegram; 5xx/сеть — экспоненциальный backoff; прочие 4xx — не повторяем.
+    """
+
+    def __init__(self, maxsize: int = 200, max_retries: int = 5, logger=None):
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+        self.max_retries = max_retries
+        self.logger = logger
+        self._thread = threading.Thread(target=self._run, daemon=True, name="tg-dispatch")
+        self._thread.start()
+
+    def _log(self, level: str, msg: str, *args):
+        if self.logger is not None:
+            getattr(self.logger, level)(msg, *args)
+
+    def _submit(self, job) -> bool:
+        try:
+            self._q.put_nowait(job)
+            return True
+        except queue.Full:
+            self._log("warning", "Telegram очередь переполнена — сообщение отброшено")
+            return False
+
+    def submit_text(self, bot_token: str, chat_id: str, text: str) -> bool:
+        return self._submit(("text", bot_token, chat_id, text, None, ""))
+
+    def submit_document(self, bot_token: str, chat_id: str, filename: str, content: Union[bytes, str],
+                        caption: str = "", announce: str = "") -> bool:
+        """
+        Документ из памяти. announce — бывшее отдельное сообщение-анонс («Report incoming…»),
+        теперь уходит одной строкой подписи того же вызова.
+        """
+        if announce:
+            caption = f"{announce}\n{caption}" if caption else announce
+        return self._submit(("doc", bot_token, chat_id, filename, content, caption))
+
+    def _send(self, job):
+        kind, token, chat, a, b, caption = job
+        if kind == "text":
+            send_text(token, chat, a)
+        else:
+            send_document_bytes(token, chat, a, b, caption=caption)
+
+    def _run(self):
+        while True:
+            job = self._q.get()
+            try:
+                attempt = 0
+                while True:
+                    try:
+                        self._send(job)
+                        break
+                    except TelegramError as e:
+                        status = getattr(e, "status", None)
+                        retry_after = getattr(e, "retry_after", None)
+                        if attempt >= self.max_retries or (status and status < 500 and status != 429):
+                            self._log("error", "Telegram error: %s", e)
+                            break
+                        delay = float(retry_after) if retry_after else min(30.0, 2 ** attempt + random.random())
+                    except requests.RequestException as e:
+                        if attempt >= self.max_retries:
+                            self._log("error", "Telegram network error: %s", e)
+                            break
+                        delay = min(30.0, 2 ** attempt + random.random())
+                    attempt += 1
+                    time.sleep(delay)
+            except Exception as e:
+                self._log("error", "Telegram dispatcher error: %s", e)
+            finally:
+                self._q.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт опустошения очереди (для остановки/проверок). True — всё отправлено."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self._q.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+_dispatcher: Optional[TelegramDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher(logger=None, maxsize: int = 200) -> TelegramDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TelegramDispatcher(maxsize=maxsize, logger=logger)
+        return _dispatcher
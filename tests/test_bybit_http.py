@@ -0,0 +1,127 @@
+# Транспорт Bybit v5 против локальной заглушки bybit_stub: часы, ретраи, идемпотентность ордеров
+import pytest
+
+from bybit_http import BybitHTTPError, BybitTransport
+from bybit_stub import start_stub
+
+SKEW_MS = 7000
+
+
+@pytest.fixture
+def stub():
+    server, state = start_stub(port=0, skew_ms=SKEW_MS)
+    yield f"http://127.0.0.1:{server.server_address[1]}", state
+    server.shutdown()
+    server.server_close()
+
+
+def _transport(base: str, **kw) -> BybitTransport:
+    kw.setdefault("max_retries", 3)
+    return BybitTransport(base, api_key="key", api_secret="secret", backoff_base=0.01, backoff_cap=0.5, **kw)
+
+
+def _order(link: str = "") -> dict:
+    o = {"category": "linear", "symbol": "BTCUSDT", "side": "Buy", "orderType": "Market",
+         "qty": "0.001", "positionIdx": 0}
+    if link:
+        o["orderLinkId"] = link
+    return o
+
+
+def test_sync_time_tracks_server_skew(stub):
+    base, _ = stub
+    http = _transport(base)
+    assert abs(http.sync_time() - SKEW_MS) < 500
+
+
+def test_sync_time_http_error(stub):
+    base, st = stub
+    st.fail_next("/v5/market/time", "http500")
+    with pytest.raises(BybitHTTPError) as e:
+        _transport(base).sync_time()
+    assert e.value.status == 500
+
+
+def test_sync_time_bad_ret_code(stub):
+    base, st = stub
+    st.fail_next("/v5/market/time", "ratelimit")
+    with pytest.raises(BybitHTTPError) as e:
+        _transport(base).sync_time()
+    assert e.value.ret_code == "10006"
+
+
+def test_signed_get_resyncs_clock_on_10002(stub):
+    base, st = stub
+    http = _transport(base)
+    # часы не синхронизированы: подпись по локальному времени выходит за recv_window
+    data = http.request("GET", "/v5/position/list", params={"category": "linear"}, auth=True)
+    assert data["retCode"] == 0
+    assert st.calls == ["/v5/position/list", "/v5/market/time", "/v5/position/list"]
+    assert abs(http.clock.offset_ms - SKEW_MS) < 500
+
+
+def test_timestamp_fault_retries_order_with_link_id(stub):
+    base, st = stub
+    http = _transport(base)
+    http.sync_time()
+    st.fail_next("/v5/order/create", "timestamp")
+    data = http.request("POST", "/v5/order/create", body=_order("link-ts"), auth=True)
+    assert data["result"]["orderLinkId"] == "link-ts"
+    assert st.calls.count("/v5/market/time") == 2
+    assert len(st.orders) == 1
+
+
+def test_lost_reply_retry_counts_duplicate_link_id_as_success(stub):
+    base, st = stub
+    http = _transport(base)
+    http.sync_time()
+    # первая попытка исполнена, но ответ потерян — повтор получает 110072
+    st.fail_next("/v5/order/create", "lost")
+    data = http.request("POST", "/v5/order/create", body=_order("link-lost"), auth=True)
+    assert data["retCode"] == 0
+    assert data["result"]["orderLinkId"] == "link-lost"
+    assert st.calls.count("/v5/order/create") == 2
+    assert len(st.orders) == 1
+
+
+def test_duplicate_link_id_on_first_attempt_is_error(stub):
+    base, st = stub
+    http = _transport(base)
+    http.sync_time()
+    http.request("POST", "/v5/order/create", body=_order("link-dup"), auth=True)
+    with pytest.raises(BybitHTTPError) as e:
+        http.request("POST", "/v5/order/create", body=_order("link-dup"), auth=True)
+    assert e.value.ret_code == "110072"
+    assert len(st.orders) == 1
+
+
+def test_order_without_link_id_is_not_retried(stub):
+    base, st = stub
+    http = _transport(base)
+    http.sync_time()
+    st.fail_next("/v5/order/create", "http500")
+    with pytest.raises(BybitHTTPError) as e:
+        http.request("POST", "/v5/order/create", body=_order(), auth=True)
+    assert e.value.status == 500
+    assert st.calls.count("/v5/order/create") == 1
+    assert not st.orders
+
+
+def test_get_retries_http500_and_rate_limit(stub):
+    base, st = stub
+    http = _transport(base)
+    st.fail_next("/v5/market/tickers", "http500")
+    st.fail_next("/v5/market/tickers", "ratelimit")
+    data = http.request("GET", "/v5/market/tickers", params={"category": "linear", "symbol": "BTCUSDT"})
+    assert data["result"]["list"][0]["symbol"] == "BTCUSDT"
+    assert st.calls.count("/v5/market/tickers") == 3
+
+
+def test_gives_up_after_max_retries(stub):
+    base, st = stub
+    http = _transport(base, max_retries=2)
+    st.fail_next("/v5/market/tickers", "http500", times=5)
+    with pytest.raises(BybitHTTPError) as e:
+        http.request("GET", "/v5/market/tickers", params={"category": "linear"})
+    assert e.value.status == 500
+    assert st.calls.count("/v5/market/tickers") == 3
@@ -0,0 +1,89 @@
+# tiers.py — ярусное расписание скана для всего universe бессрочных контрактов
+#
+# Вместо жёсткого TOP_N_BY_VOL сканируем все подходящие символы, но с разной частотой:
+#   hot  — топ по волатильности + открытые позиции, свежие и отложенные сигналы: каждый цикл;
+#   warm — следующие SCAN_WARM_N по рангу: раз в SCAN_WARM_EVERY циклов;
+#   cold — остальные: раз в SCAN_COLD_EVERY циклов.
+# Ярус пересчитывается каждый цикл по свежему рангу UniverseEngine (universe.py), так что символ
+# сразу поднимается в hot, когда его волатильность растёт. Число символов (= запросов свечей)
+# за цикл ограничено SCAN_SYMBOLS_BUDGET: hot идут всегда, остальные — по степени просрочки
+# (не меньше четверти бюджета, даже если hot заняли его целиком).
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from settings import Settings
+
+TIERS = ("hot", "warm", "cold")
+
+
+class TierScheduler:
+    def __init__(self, hot_n: int, warm_n: int, warm_every: int, cold_every: int, budget: int):
+        self.hot_n = int(hot_n)
+        self.warm_n = int(warm_n)
+        self.every = {"hot": 1, "warm": max(1, int(warm_every)), "cold": max(1, int(cold_every))}
+        self.budget = int(budget)
+        self.cycle = 0
+        self._last: Dict[str, int] = {}   # symbol -> номер цикла последнего успешного скана
+        self._lock = threading.Lock()
+
+    def tier_of(self, rank: int, boosted: bool) -> str:
+        if boosted or rank < self.hot_n:
+            return "hot"
+        if rank < self.hot_n + self.warm_n:
+            return "warm"
+        return "cold"
+
+    def plan(self, universe_rows: List[Dict], boosted: Set[str]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Новый цикл: (символы к скану в этом цикле, {symbol: ярус} для всего universe).
+        universe_rows — в порядке ранга (по убыванию vol24h_pct).
+        """
+        with self._lock:
+            self.cycle += 1
+            tiers: Dict[str, str] = {}
+            hot: List[str] = []
+            due: List[Tuple[float, int, str]] = []
+            for rank, r in enumerate(universe_rows):
+                sym = r["symbol"]
+                tier = tiers[sym] = self.tier_of(rank, sym in boosted)
+                if tier == "hot":
+                    hot.append(sym)
+                    continue
+                last = self._last.get(sym)
+                age = self.cycle - last if last is not None else None
+                if age is None or age >= self.every[tier]:
+                    # ни разу не сканированные — первыми, дальше по степени просрочки, затем по рангу
+                    overdue = float("inf") if age is None else age / self.every[tier]
+                    due.append((-overdue, rank, sym))
+            due.sort()
+            # четверть бюджета всегда остаётся ротации: при массе сигналов warm/cold не голодают
+            room = max(self.budget - len(hot), self.budget // 4) if self.budget > 0 else len(due)
+            return hot + [sym for _, _, sym in due[:room]], tiers
+
+    def mark(self, symbol: str) -> None:
+        """Символ отсканирован в текущем цикле (ошибки и отложенные по дедлайну не отмечаем)."""
+        with self._lock:
+            self._last[symbol] = self.cycle
+
+    def forget(self, keep: Set[str]) -> None:
+        with self._lock:
+            for sym in [s for s in self._last if s not in keep]:
+                del self._last[sym]
+
+
+_scheduler: Optional[TierScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_tier_scheduler() -> TierScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TierScheduler(
+                hot_n=Settings.SCAN_HOT_N,
+                warm_n=Settings.SCAN_WARM_N,
+                warm_every=Settings.SCAN_WARM_EVERY,
+                cold_every=Settings.SCAN_COLD_EVERY,
+                budget=Settings.SCAN_SYMBOLS_BUDGET,
+            )
+        return _scheduler
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-import pandas as pd
+import numpy as np
 from indicators import ema, slope
 
 @dataclass
@@ -8,21 +8,21 @@ class TrendConfig:
     ema_slow:int=200
     slope_len:int=8
 
-def classify_trend(df: pd.DataFrame, cfg: TrendConfig = TrendConfig()) -> str:
+def classify_trend(df, cfg: TrendConfig = TrendConfig()) -> str:
     """
     Критерии (действенная и устойчивая логика):
     - BULL: close > EMA200, EMA50 > EMA200, slope(EMA50) > 0
     - BEAR: close < EMA200, EMA50 < EMA200, slope(EMA50) < 0
     - иначе NEUTRAL
     """
-    c = df["close"]
+    c = np.asarray(df["close"], dtype=float)   # DataFrame или окно Bars
     e50 = ema(c, cfg.ema_fast)
     e200= ema(c, cfg.ema_slow)
     s = slope(e50, cfg.slope_len)
     last = len(c)-1
-    if c.iat[last] > e200.iat[last] and e50.iat[last] > e200.iat[last] and s > 0:
+    if c[last] > e200[last] and e50[last] > e200[last] and s > 0:
         return "BULL"
-    if c.iat[last] < e200.iat[last] and e50.iat[last] < e200.iat[last] and s < 0:
+    if c[last] < e200[last] and e50[last] < e200[last] and s < 0:
         return "BEAR"
     return "NEUTRAL"
 
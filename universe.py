@@ -0,0 +1,134 @@
+# universe.py — отбор universe по волатильности без пересборки с нуля каждый цикл
+#
+# Подходящие символы (_is_symbol_ok) считаются один раз на снимок exchange.markets —
+# индекс пересобирается, только когда markets перезагружены. Каждый цикл остаётся один
+# fetch_tickers: оценки считаются векторно, топ-K — через argpartition без полной сортировки.
+# Гистерезис ранга: новичок входит, попав в топ-K; символ из прошлого universe держится, пока
+# не опустится ниже K * (1 + UNIVERSE_HYSTERESIS), или пока его место не займёт новичок из топ-K
+# (выбывают действующие с наименьшей оценкой) — пары на границе топа не мигают туда-обратно
+# (и не выселяют друг другу тёплые буферы свечей), а всплеск волатильности не ждёт свободного места.
+#
+# UNIVERSE_RANK — по чему ранжировать:
+#   range — (high24h - low24h) / last, как раньше;
+#   stdev — σ лог-доходностей последних UNIVERSE_RV_BARS баров базового ТФ из буфера свечей;
+#   atr   — средний true range тех же баров.
+# Реализованная волатильность приводится к суточной σ (×√баров в сутках), у символов без
+# свечей в буфере — оценка Паркинсона по суточному диапазону, чтобы шкалы были сравнимы.
+import threading
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from bybit_data import _is_symbol_ok
+from candles import CandleStore, tf_minutes
+from settings import Settings
+
+_PARKINSON = 2.0 * np.sqrt(np.log(2.0))   # E[range] суток = σ * 2√ln2
+_MEAN_RANGE = np.sqrt(8.0 / np.pi)        # E|true range| бара ≈ σ * √(8/π)
+
+
+class UniverseEngine:
+    def __init__(self, hysteresis: float = 0.2, rank_by: str = "range", rv_bars: int = 24):
+        self.hysteresis = max(float(hysteresis), 0.0)
+        self.rank_by = rank_by
+        self.rv_bars = max(int(rv_bars), 2)
+        self.members: Set[str] = set()
+        self._markets_key = None
+        self._eligible: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def eligible(self, exchange) -> Set[str]:
+        """Индекс подходящих символов; пересобирается при перезагрузке markets."""
+        markets = exchange.markets or {}
+        key = (id(markets), len(markets))
+        if key != self._markets_key:
+            self._eligible = {sym for sym, m in markets.items() if m and _is_symbol_ok(m)}
+            self._markets_key = key
+        return self._eligible
+
+    def _realized(self, candles: CandleStore, symbols: List[str]) -> np.ndarray:
+        """Суточная σ, % по буферу свечей; NaN — мало баров или символа нет в буфере."""
+        per_day = np.sqrt(1440.0 / tf_minutes(candles.base_tf))
+        out = np.full(len(symbols), np.nan)
+        n = self.rv_bars
+        for i, sym in enumerate(symbols):
+            bars = candles.get(sym)
+            if bars is None or len(bars) < n + 1:
+                continue
+            c = np.asarray(bars.close[-(n + 1):], dtype=float)
+            if self.rank_by == "atr":
+                h = np.asarray(bars.high[-n:], dtype=float)
+                lo = np.asarray(bars.low[-n:], dtype=float)
+                tr = np.maximum(h, c[:-1]) - np.minimum(lo, c[:-1])
+                out[i] = float(np.mean(tr / c[1:])) / _MEAN_RANGE * per_day * 100.0
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    out[i] = float(np.std(np.diff(np.log(c)), ddof=1)) * per_day * 100.0
+        return out
+
+    def top(self, exchange, limit: Optional[int] = None, exclude: Optional[Set[str]] = None,
+            candles: Optional[CandleStore] = None) -> List[Dict]:
+        """
+        [{"symbol", "vol24h_pct", "last"}] по убыванию оценки: vol24h_pct = (high24h - low24h) / last,
+        last — цена из того же снимка тикеров (референс для входа); при ранжировании по реализованной
+        волатильности добавляется "rv_pct".
+        limit: по умолчанию TOP_N_BY_VOL, 0 — все подходящие символы.
+        """
+        tickers = exchange.fetch_tickers()
+        with self._lock:
+            ok = self.eligible(exchange)
+            syms = [s for s in tickers if s in ok and not (exclude and s in exclude)]
+            tk = [tickers[s] for s in syms]
+            last = np.array([t.get("last") or 0.0 for t in tk], dtype=float)
+            high = np.array([t.get("high") or 0.0 for t in tk], dtype=float)
+            low = np.array([t.get("low") or 0.0 for t in tk], dtype=float)
+            valid = (last > 0) & (high > 0) & (low > 0)
+            idx = np.flatnonzero(valid)
+            syms = [syms[i] for i in idx]
+            last, high, low = last[idx], high[idx], low[idx]
+            vol = (high - low) / last * 100.0
+            rv = None
+            score = vol
+            if self.rank_by in ("stdev", "atr") and candles is not None and len(syms):
+                rv = self._realized(candles, syms)
+                score = np.where(np.isnan(rv), vol / _PARKINSON, rv)
+
+            limit = Settings.TOP_N_BY_VOL if limit is None else limit
+            picked = self._select(syms, score, limit)
+            if limit > 0:
+                self.members = {syms[i] for i in picked}
+            rows = []
+            for i in picked:
+                row = {"symbol": syms[i], "vol24h_pct": float(vol[i]), "last": float(last[i])}
+                if rv is not None:
+                    row["rv_pct"] = float(score[i])
+                rows.append(row)
+            return rows
+
+    def _select(self, syms: List[str], score: np.ndarray, k: int) -> np.ndarray:
+        """Индексы отобранных символов по убыванию score (топ-K с гистерезисом)."""
+        n = len(syms)
+        if k <= 0 or k >= n:
+            return np.argsort(-score, kind="stable")
+        # кандидаты — топ K*(1+h): новички входят из первых K, действующие держатся до границы выхода;
+        # если набирается больше K, место новичкам уступают действующие с наименьшей оценкой
+        exit_k = min(n, int(np.ceil(k * (1.0 + self.hysteresis))))
+        cand = np.argpartition(-score, exit_k - 1)[:exit_k]
+        cand = cand[np.argsort(-score[cand], kind="stable")]
+        new = [i for i in cand[:k] if syms[i] not in self.members]
+        held = [i for i in cand if syms[i] in self.members]
+        keep = np.array(new + held[:k - len(new)], dtype=np.int64)
+        return keep[np.argsort(-score[keep], kind="stable")]
+
+
+_engine: Optional[UniverseEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_universe_engine() -> UniverseEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = UniverseEngine(hysteresis=Settings.UNIVERSE_HYSTERESIS, rank_by=Settings.UNIVERSE_RANK,
+                                     rv_bars=Settings.UNIVERSE_RV_BARS)
+        return _engine
@@ -1,4 +1,4 @@
-import os, sys, time, json, logging
+import os, sys, time, logging
 from pathlib import Path
 from datetime import datetime, timezone
 
@@ -44,11 +44,6 @@ def _json_default(o):
         return str(o)
     return str(o)
 
-def write_jsonl(path, obj):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False, default=_json_default) + "\n")
-
 def sleep_until_next_cycle(seconds):
     time.sleep(seconds)
 
@@ -60,3 +55,37 @@ def ensure_dirs(base="./data"):
     (base / "state").mkdir(parents=True, exist_ok=True)   # <-- ДОБАВЛЕНО
     return base
 
+# --- память процесса (Linux /proc; иначе — пик за всё время через getrusage) ---
+def _proc_status_kb(key, pid="self"):
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def rss_mb(pid="self"):
+    kb = _proc_status_kb("VmRSS", pid)
+    return round(kb / 1024, 1) if kb is not None else None
+
+def peak_rss_mb(pid="self"):
+    """Пиковый RSS (VmHWM) с последнего reset_peak_rss() — или с запуска процесса."""
+    kb = _proc_status_kb("VmHWM", pid)
+    if kb is None and pid == "self":
+        try:
+            import resource
+            kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # Linux: КБ
+        except (ImportError, OSError):
+            return None
+    return round(kb / 1024, 1) if kb is not None else None
+
+def reset_peak_rss(pid="self"):
+    """Сброс VmHWM (Linux >= 4.0), чтобы пик мерился по циклу. False — не поддерживается."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False